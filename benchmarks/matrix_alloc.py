@@ -0,0 +1,113 @@
+'''
+counts euclid object allocations and time per frame for the model/normal
+matrix path of gltests/shaders04, once written with the allocating operators
+and once with the in-place (*_into) methods on preallocated matrices.
+
+run from the repository root: python -m benchmarks.matrix_alloc
+'''
+
+import math
+import timeit
+
+from euclid import *
+
+FRAMES = 10000
+
+COUNTED = (Vector3, Matrix3, Matrix4, Quaternion)
+
+
+class AllocationCounter(object):
+    """
+    Counts constructor calls of the euclid classes while active.
+
+    """
+    def __init__(self):
+        self.count = 0
+        self.originals = {}
+
+    def __enter__(self):
+        for cls in COUNTED:
+            self.originals[cls] = cls.__init__
+            cls.__init__ = self._wrap(cls.__init__)
+        return self
+
+    def __exit__(self, *exc_info):
+        for cls, init in self.originals.items():
+            cls.__init__ = init
+
+    def _wrap(self, init):
+        def counting_init(obj, *args, **kwargs):
+            self.count += 1
+            init(obj, *args, **kwargs)
+        return counting_init
+
+
+def allocating_frame(rx, ry, rz, aspect):
+    # shader04.on_draw before the in-place API
+    quaternion = Quaternion.new_rotate_euler(0, math.radians(rz), 0) * \
+                 Quaternion.new_rotate_euler(math.radians(ry), 0, 0)
+    rotation = quaternion.get_matrix()
+    translation = Matrix4.new_translate(0.0, 0.0, -4.0)
+    matrix = translation * rotation
+    normal_matrix = Matrix3.new_identity()
+    normal_matrix[:] = (matrix.a, matrix.b, matrix.c,
+                        matrix.e, matrix.f, matrix.g,
+                        matrix.i, matrix.j, matrix.k)
+    projection = Matrix4.new_perspective(math.radians(60.), aspect, .1, 1000)
+    return (projection, matrix, normal_matrix.transposed(),
+            normal_matrix.inverse(), Matrix3.new_identity())
+
+
+class InPlaceFrame(object):
+    """
+    The same frame on matrices allocated once up front.
+
+    """
+    def __init__(self, aspect):
+        self.rotation = Quaternion()
+        self.translation = Vector3(0.0, 0.0, -4.0)
+        self.model = Matrix4()
+        self.normal = Matrix3()
+        self.normal_transposed = Matrix3()
+        self.normal_inverse = Matrix3()
+        self.identity = Matrix3()
+        # only changes on resize
+        self.projection = Matrix4.new_perspective(math.radians(60.), aspect,
+                                                  .1, 1000)
+
+    def __call__(self, rx, ry, rz, aspect):
+        rotation = self.rotation.identity()
+        rotation.rotate_euler(0, math.radians(rz), 0)
+        rotation.rotate_euler(math.radians(ry), 0, 0)
+        model = Matrix4.new_trs_into(self.translation, rotation, None,
+                                     self.model)
+        # same column-major slice assignment as normal_matrix[:] above
+        normal = self.normal
+        (normal.a, normal.e, normal.i,
+         normal.b, normal.f, normal.j,
+         normal.c, normal.g, normal.k) = (model.a, model.b, model.c,
+                                          model.e, model.f, model.g,
+                                          model.i, model.j, model.k)
+        normal.invalidate()
+        return (self.projection, model,
+                normal.transposed_into(self.normal_transposed),
+                normal.inverse_into(self.normal_inverse), self.identity)
+
+
+def measure(name, frame):
+    angles = [(i * 0.01, i * 0.8, i * 0.3) for i in range(FRAMES)]
+
+    def run():
+        for rx, ry, rz in angles:
+            frame(rx, ry, rz, 4 / 3.)
+
+    with AllocationCounter() as counter:
+        run()
+    seconds = min(timeit.repeat(run, number=1, repeat=5))
+    print('%-12s %6.1f allocations/frame %8.2f us/frame' %
+          (name, counter.count / float(FRAMES), seconds / FRAMES * 1e6))
+
+
+if __name__ == '__main__':
+    measure('allocating', allocating_frame)
+    measure('in-place', InPlaceFrame(4 / 3.))
@@ -0,0 +1,46 @@
+'''
+reports the vertex and index buffer sizes of generated meshes as they were
+(duplicated seams, 32 bit indices), with welded seams and the index type
+chosen by vertex count, and with the quantised vertex format on top.
+
+run from the repository root: python -m benchmarks.mesh_buffers
+'''
+
+from mesh import SphereMesh, CylinderMesh
+from torus import Torus
+
+MESHES = (
+    ('torus 50x30', lambda weld: Torus(1, 0.3, 50, 30, weld=weld)),
+    ('torus 500x300', lambda weld: Torus(1, 0.3, 500, 300, weld=weld)),
+    ('torus 2000x1000', lambda weld: Torus(1, 0.3, 2000, 1000, weld=weld)),
+    ('sphere 64x33', lambda weld: SphereMesh(1., 64, 33, weld=weld)),
+    ('cylinder 64', lambda weld: CylinderMesh(1., 2., 64, weld=weld)),
+)
+
+
+def sizes(mesh, index_size):
+    vertex_bytes = mesh.vertices.nbytes + mesh.normals.nbytes
+    return vertex_bytes, len(mesh.indices) * index_size
+
+
+def kib(count):
+    return '%10.1f KiB' % (count / 1024.)
+
+
+def report(name, create):
+    before = sizes(create(False), 4)
+    mesh = create(True)
+    after = mesh.buffer_bytes()
+    quantized = mesh.buffer_bytes(quantized=True)
+    saved = 1. - float(sum(after)) / sum(before)
+    saved_quantized = 1. - float(sum(quantized)) / sum(before)
+    print('%-16s vertices %s -> %s -> %s  indices %s -> %s (%s)  '
+          'saved %4.1f%% / %4.1f%% quantised' % (
+              name, kib(before[0]), kib(after[0]), kib(quantized[0]),
+              kib(before[1]), kib(after[1]), mesh.indices.dtype,
+              saved * 100, saved_quantized * 100))
+
+
+if __name__ == '__main__':
+    for name, create in MESHES:
+        report(name, create)
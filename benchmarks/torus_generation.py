@@ -0,0 +1,89 @@
+'''
+times torus mesh generation at increasing tessellation, once with the
+original nested loops and once with the parametric mesh code behind
+torus.Torus, and
+checks that both produce the same vertex, normal and index layout.
+
+run from the repository root: python -m benchmarks.torus_generation
+'''
+
+import timeit
+from math import pi, cos, sin
+
+import numpy as np
+
+from torus import Torus
+
+SIZES = ((50, 30), (500, 300), (2000, 1000))
+
+
+def loop_arrays(radius, inner_radius, slices, inner_slices):
+    # Torus.__init__ before the numpy version
+    vertices = []
+    normals = []
+
+    u_step = 2 * pi / (slices - 1)
+    v_step = 2 * pi / (inner_slices - 1)
+    u = 0.
+    for i in range(slices):
+        cos_u = cos(u)
+        sin_u = sin(u)
+        v = 0.
+        for j in range(inner_slices):
+            cos_v = cos(v)
+            sin_v = sin(v)
+
+            d = (radius + inner_radius * cos_v)
+            x = d * cos_u
+            y = d * sin_u
+            z = inner_radius * sin_v
+
+            nx = cos_u * cos_v
+            ny = sin_u * cos_v
+            nz = sin_v
+
+            vertices.extend([x, y, z])
+            normals.extend([nx, ny, nz])
+            v += v_step
+        u += u_step
+
+    indices = []
+    for i in range(slices - 1):
+        for j in range(inner_slices - 1):
+            p = i * inner_slices + j
+            indices.extend([p, p + inner_slices, p + inner_slices + 1])
+            indices.extend([p, p + inner_slices + 1, p + 1])
+    return vertices, normals, indices
+
+
+def torus_arrays(radius, inner_radius, slices, inner_slices):
+    torus = Torus(radius, inner_radius, slices, inner_slices)
+    return torus.vertices, torus.normals, torus.indices
+
+
+def check(slices, inner_slices):
+    old = loop_arrays(1, 0.3, slices, inner_slices)
+    new = torus_arrays(1, 0.3, slices, inner_slices)
+    # the loops accumulate the angles, so allow for their drift
+    for a, b in zip(old[:2], new[:2]):
+        assert len(a) == len(b)
+        assert np.allclose(a, b, atol=1e-5)
+    assert list(new[2]) == old[2]
+
+
+def measure(slices, inner_slices):
+    def run(generate):
+        return min(timeit.repeat(
+            lambda: generate(1, 0.3, slices, inner_slices),
+            number=1, repeat=3))
+
+    loops = run(loop_arrays)
+    arrays = run(torus_arrays)
+    print('%5d x %-5d %10.3f ms loops %10.3f ms numpy %8.1fx' %
+          (slices, inner_slices, loops * 1e3, arrays * 1e3, loops / arrays))
+
+
+if __name__ == '__main__':
+    check(50, 30)
+    for slices, inner_slices in SIZES:
+        measure(slices, inner_slices)
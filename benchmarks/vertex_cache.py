@@ -0,0 +1,38 @@
+'''
+simulated post-transform vertex cache efficiency (ACMR, misses per
+triangle, and ATVR, misses per vertex) of generated meshes in their
+generated order and after ParametricMesh.optimize, with the time the
+optimisation takes.
+
+run from the repository root: python -m benchmarks.vertex_cache
+'''
+
+import timeit
+
+from mesh import SphereMesh
+from torus import Torus
+from vertexcache import cache_stats
+
+CACHE_SIZES = (16, 32)
+
+MESHES = (
+    ('torus 50x30', lambda: Torus(1, 0.3, 50, 30)),
+    ('torus 500x300', lambda: Torus(1, 0.3, 500, 300)),
+    ('sphere 64x33', lambda: SphereMesh(1., 64, 33)),
+)
+
+
+def report(name, create, cache_size):
+    before = cache_stats(create().indices, cache_size)
+    mesh = create()
+    seconds = timeit.timeit(lambda: mesh.optimize(cache_size), number=1)
+    after = cache_stats(mesh.indices, cache_size)
+    print('%-14s cache %2d  ACMR %.3f -> %.3f  ATVR %.3f -> %.3f  %7.1f ms'
+          % (name, cache_size, before[0], after[0], before[1], after[1],
+             seconds * 1e3))
+
+
+if __name__ == '__main__':
+    for cache_size in CACHE_SIZES:
+        for name, create in MESHES:
+            report(name, create, cache_size)
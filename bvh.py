@@ -0,0 +1,377 @@
+'''
+bounding volume hierarchies over euclid spheres, axis aligned boxes and
+triangles, used for picking and collision queries.
+
+The trees are built top down with the surface area heuristic and packed into
+flat numpy arrays (one row per node), so queries walk the tree one level at a
+time with array operations instead of visiting nodes in Python.  When the
+primitives move, refit() recomputes the node bounds in place without
+rebuilding; rebuild() once the tree quality has degraded.
+
+    spheres = SphereBVH(SphereArray(centers, radii))
+    hit = spheres.raycast_first(Ray3(Point3(0., 0., 5.), Vector3(0., 0., -1.)))
+    if hit is not None:
+        index, u = hit
+'''
+
+import numpy as np
+
+from euclid import *
+from euclid import _as_scalar_data, _as_vector3_data, _line3_operand, \
+    _intersect_line3_aabb3_array, _intersect_line3_sphere_array, \
+    _require_numpy
+
+
+def _dot(a, b):
+    a, b = np.broadcast_arrays(a, b)
+    return np.einsum('ij,ij->i', a, b)
+
+
+def _area(lo, hi):
+    # half the surface area, which is all the heuristic needs
+    d = hi - lo
+    return d[..., 0] * d[..., 1] + d[..., 1] * d[..., 2] + \
+        d[..., 2] * d[..., 0]
+
+
+def _intersect_line3_triangle_array(p, v, lo, hi, a, b, c):
+    # Moller-Trumbore
+    e1 = b - a
+    e2 = c - a
+    pv = np.cross(v, e2)
+    det = _dot(e1, pv)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        inv = 1.0 / det
+        tv = p - a
+        s = _dot(tv, pv) * inv
+        qv = np.cross(tv, e1)
+        t = _dot(v, qv) * inv
+        u = _dot(e2, qv) * inv
+        # s, t and u are inf or nan for degenerate triangles (det == 0)
+        hit = (det != 0) & (s >= 0) & (t >= 0) & (s + t <= 1) & \
+            (u >= lo) & (u <= hi)
+    return hit, u
+
+
+def _closest_point_box_array(p, bmin, bmax):
+    return np.minimum(np.maximum(p, bmin), bmax)
+
+
+def _overlap_sphere_box_array(c, r, bmin, bmax):
+    d = _closest_point_box_array(c, bmin, bmax) - c
+    return _dot(d, d) <= r * r
+
+
+def _closest_point_triangle_array(p, a, b, c):
+    # Ericson, Real-Time Collision Detection 5.1.5, evaluated for every row
+    # and resolved by Voronoi region.
+    p, a, b, c = np.broadcast_arrays(p, a, b, c)
+    ab = b - a
+    ac = c - a
+    ap = p - a
+    bp = p - b
+    cp = p - c
+    d1 = _dot(ab, ap)
+    d2 = _dot(ac, ap)
+    d3 = _dot(ab, bp)
+    d4 = _dot(ac, bp)
+    d5 = _dot(ab, cp)
+    d6 = _dot(ac, cp)
+    va = d3 * d6 - d5 * d4
+    vb = d5 * d2 - d1 * d6
+    vc = d1 * d4 - d3 * d2
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        denom = 1.0 / (va + vb + vc)
+        result = a + ab * (vb * denom)[:, None] + ac * (vc * denom)[:, None]
+        regions = (
+            # highest priority last
+            ((va <= 0) & (d4 - d3 >= 0) & (d5 - d6 >= 0),
+             b + (c - b) * ((d4 - d3) /
+                            ((d4 - d3) + (d5 - d6)))[:, None]),
+            ((vb <= 0) & (d2 >= 0) & (d6 <= 0),
+             a + ac * (d2 / (d2 - d6))[:, None]),
+            ((d6 >= 0) & (d5 <= d6), c),
+            ((vc <= 0) & (d1 >= 0) & (d3 <= 0),
+             a + ab * (d1 / (d1 - d3))[:, None]),
+            ((d3 >= 0) & (d4 <= d3), b),
+            ((d1 <= 0) & (d2 <= 0), a),
+        )
+    for mask, point in regions:
+        result[mask] = point[mask]
+    return result
+
+
+class BVH(object):
+    """
+    Base class of the hierarchies.  Subclasses hold the primitives and
+    provide their bounds and the exact ray and sphere tests.
+
+    The nodes are stored depth first: node 0 is the root, the left child of
+    an inner node directly follows it and node_right holds the right child.
+    Leaves have node_right == -1 and cover order[node_start:node_start +
+    node_count], order being the primitive indices sorted into leaves.
+
+    """
+    def __init__(self, leaf_size=8):
+        _require_numpy()
+        self.leaf_size = leaf_size
+        self.rebuild()
+
+    def __len__(self):
+        return len(self.order)
+
+    def __repr__(self):
+        return '%s(<%d primitives, %d nodes>)' % (
+            self.__class__.__name__, len(self.order), len(self.node_right))
+
+    def _bounds(self):
+        raise NotImplementedError
+
+    def _intersect_line3(self, p, v, lo, hi, index):
+        raise NotImplementedError
+
+    def _intersect_sphere(self, c, r, index):
+        raise NotImplementedError
+
+    def rebuild(self):
+        '''Build the tree from scratch for the current primitives.'''
+        lo, hi = self._bounds()
+        centroids = (lo + hi) * 0.5
+        count = len(lo)
+        order = np.arange(count)
+        node_lo = []
+        node_hi = []
+        node_right = []
+        node_start = []
+        node_count = []
+        node_depth = []
+
+        # (start, end, depth, parent); the parent's right link is patched
+        # when its right child is created.  Left children are pushed last so
+        # they are always created directly after their parent.
+        stack = [(0, count, 0, -1)] if count else []
+        while stack:
+            start, end, depth, parent = stack.pop()
+            node = len(node_right)
+            if parent >= 0 and node != parent + 1:
+                node_right[parent] = node
+            index = order[start:end]
+            node_lo.append(lo[index].min(axis=0))
+            node_hi.append(hi[index].max(axis=0))
+            node_start.append(start)
+            node_count.append(end - start)
+            node_depth.append(depth)
+            node_right.append(-1)
+            if end - start <= self.leaf_size:
+                continue
+
+            split = self._split(index, lo, hi, centroids)
+            order[start:end] = split[0]
+            middle = start + split[1]
+            stack.append((middle, end, depth + 1, node))
+            stack.append((start, middle, depth + 1, node))
+
+        self.order = order
+        self.node_lo = np.array(node_lo).reshape(-1, 3)
+        self.node_hi = np.array(node_hi).reshape(-1, 3)
+        self.node_right = np.array(node_right, dtype=np.intp)
+        self.node_start = np.array(node_start, dtype=np.intp)
+        self.node_count = np.array(node_count, dtype=np.intp)
+
+        # Inner nodes grouped by depth, deepest first, for refit.
+        depth = np.array(node_depth, dtype=np.intp)
+        inner = np.flatnonzero(self.node_right >= 0)
+        self._levels = [inner[depth[inner] == d]
+                        for d in range(depth.max(initial=0), -1, -1)]
+        self._leaves = np.flatnonzero(self.node_right < 0)
+        self._leaves = self._leaves[np.argsort(self.node_start[self._leaves])]
+
+    def _split(self, index, lo, hi, centroids):
+        # Full sweep SAH: sort along all three axes at once and take the
+        # prefix with the smallest area weighted cost.
+        count = len(index)
+        sorted_index = index[np.argsort(centroids[index], axis=0,
+                                        kind='stable')]
+        l = lo[sorted_index]
+        h = hi[sorted_index]
+        left = _area(np.minimum.accumulate(l), np.maximum.accumulate(h))
+        right = _area(np.minimum.accumulate(l[::-1])[::-1],
+                      np.maximum.accumulate(h[::-1])[::-1])
+        n = np.arange(1, count)[:, None]
+        cost = left[:-1] * n + right[1:] * (count - n)
+        i, axis = np.unravel_index(np.argmin(cost), cost.shape)
+        return sorted_index[:, axis], i + 1
+
+    def refit(self):
+        '''Recompute the node bounds after the primitives moved, keeping
+        the tree topology.'''
+        if not len(self.order):
+            return
+        lo, hi = self._bounds()
+        starts = self.node_start[self._leaves]
+        self.node_lo[self._leaves] = np.minimum.reduceat(lo[self.order],
+                                                         starts)
+        self.node_hi[self._leaves] = np.maximum.reduceat(hi[self.order],
+                                                         starts)
+        for nodes in self._levels:
+            left = nodes + 1
+            right = self.node_right[nodes]
+            self.node_lo[nodes] = np.minimum(self.node_lo[left],
+                                             self.node_lo[right])
+            self.node_hi[nodes] = np.maximum(self.node_hi[left],
+                                             self.node_hi[right])
+
+    def _candidates(self, test):
+        # Primitive indices in all leaves whose bounds pass test, walking
+        # the tree one level at a time.
+        if not len(self.order):
+            return self.order
+        nodes = np.zeros(1, dtype=np.intp)
+        leaves = []
+        while len(nodes):
+            nodes = nodes[test(self.node_lo[nodes], self.node_hi[nodes])]
+            right = self.node_right[nodes]
+            leaf = right < 0
+            leaves.append(nodes[leaf])
+            nodes = np.concatenate((nodes[~leaf] + 1, right[~leaf]))
+        leaves = np.concatenate(leaves)
+        starts = self.node_start[leaves]
+        counts = self.node_count[leaves]
+        offsets = np.repeat(starts - np.cumsum(counts) + counts, counts)
+        return self.order[offsets + np.arange(counts.sum())]
+
+    def raycast_all(self, line):
+        '''Return (indices, u) of all primitives hit by line (a Line3, Ray3
+        or LineSegment3), sorted by the parameter u of the first
+        intersection point.'''
+        p, v, lo, hi = _line3_operand(line)
+        index = self._candidates(lambda bmin, bmax:
+            _intersect_line3_aabb3_array(p, v, lo, hi, bmin, bmax)[0])
+        hit, u = self._intersect_line3(p, v, lo, hi, index)
+        index = index[hit]
+        u = u[hit]
+        order = np.argsort(u, kind='stable')
+        return index[order], u[order]
+
+    def raycast_first(self, line):
+        '''Return (index, u) of the closest primitive hit by line, or None.
+        '''
+        index, u = self.raycast_all(line)
+        if not len(index):
+            return None
+        return int(index[0]), float(u[0])
+
+    def query_sphere(self, sphere):
+        '''Return the sorted indices of all primitives overlapping sphere.'''
+        c = np.array(((sphere.c.x, sphere.c.y, sphere.c.z),))
+        r = sphere.r
+        index = self._candidates(lambda bmin, bmax:
+            _overlap_sphere_box_array(c, r, bmin, bmax))
+        return np.sort(index[self._intersect_sphere(c, r, index)])
+
+
+class SphereBVH(BVH):
+    """
+    Hierarchy over a SphereArray (or a list of Sphere).  Move the spheres by
+    passing new centers and radii to refit().
+
+    """
+    def __init__(self, spheres, leaf_size=8):
+        if not isinstance(spheres, SphereArray):
+            spheres = SphereArray.new_from_spheres(spheres)
+        self.spheres = spheres.copy()
+        super(SphereBVH, self).__init__(leaf_size)
+
+    def _bounds(self):
+        r = self.spheres.r[:, None]
+        return self.spheres.c - r, self.spheres.c + r
+
+    def _intersect_line3(self, p, v, lo, hi, index):
+        hit, near, far = _intersect_line3_sphere_array(
+            p, v, lo, hi, self.spheres.c[index], self.spheres.r[index])
+        return hit, near
+
+    def _intersect_sphere(self, c, r, index):
+        d = self.spheres.c[index] - c
+        return _dot(d, d) <= (self.spheres.r[index] + r) ** 2
+
+    def refit(self, centers=None, radii=None):
+        if centers is not None:
+            self.spheres.c[:] = _as_vector3_data(centers)
+        if radii is not None:
+            self.spheres.r[:] = _as_scalar_data(radii, len(self.spheres))
+        super(SphereBVH, self).refit()
+
+
+class BoxBVH(BVH):
+    """
+    Hierarchy over axis aligned boxes, given as an AABB3Array or a list of
+    AABB3.
+
+    """
+    def __init__(self, boxes, leaf_size=8):
+        if not isinstance(boxes, AABB3Array):
+            boxes = AABB3Array.new_from_aabbs(boxes)
+        self.boxes = boxes.copy()
+        super(BoxBVH, self).__init__(leaf_size)
+
+    def _bounds(self):
+        return self.boxes.minimum, self.boxes.maximum
+
+    def _intersect_line3(self, p, v, lo, hi, index):
+        hit, near, far = _intersect_line3_aabb3_array(
+            p, v, lo, hi, self.boxes.minimum[index],
+            self.boxes.maximum[index])
+        return hit, near
+
+    def _intersect_sphere(self, c, r, index):
+        return _overlap_sphere_box_array(c, r, self.boxes.minimum[index],
+                                         self.boxes.maximum[index])
+
+    def refit(self, boxes=None):
+        if boxes is not None:
+            if not isinstance(boxes, AABB3Array):
+                boxes = AABB3Array.new_from_aabbs(boxes)
+            self.boxes.minimum[:] = boxes.minimum
+            self.boxes.maximum[:] = boxes.maximum
+        super(BoxBVH, self).refit()
+
+
+class TriangleBVH(BVH):
+    """
+    Hierarchy over an indexed triangle mesh, e.g. the vertices and indices
+    of a Torus.  vertices is an (N, 3) array-like or flat list, indices a
+    flat list or (M, 3) array of vertex indices; without indices every three
+    vertices form a triangle.  Pass new vertex positions to refit() for
+    deforming meshes.
+
+    """
+    def __init__(self, vertices, indices=None, leaf_size=8):
+        self.vertices = _as_vector3_data(vertices).copy()
+        if indices is None:
+            indices = np.arange(len(self.vertices))
+        self.triangles = np.asarray(indices, dtype=np.intp).reshape(-1, 3)
+        super(TriangleBVH, self).__init__(leaf_size)
+
+    def _corners(self, index=slice(None)):
+        t = self.triangles[index]
+        return (self.vertices[t[:, 0]], self.vertices[t[:, 1]],
+                self.vertices[t[:, 2]])
+
+    def _bounds(self):
+        a, b, c = self._corners()
+        return np.minimum(np.minimum(a, b), c), np.maximum(np.maximum(a, b), c)
+
+    def _intersect_line3(self, p, v, lo, hi, index):
+        a, b, c = self._corners(index)
+        return _intersect_line3_triangle_array(p, v, lo, hi, a, b, c)
+
+    def _intersect_sphere(self, c, r, index):
+        d = _closest_point_triangle_array(c, *self._corners(index)) - c
+        return _dot(d, d) <= r * r
+
+    def refit(self, vertices=None):
+        if vertices is not None:
+            self.vertices[:] = _as_vector3_data(vertices)
+        super(TriangleBVH, self).refit()
@@ -0,0 +1,181 @@
+'''
+plane clipping and cross sections of indexed triangle meshes, such as the
+vertex and index lists of a Torus, for cutaway views.
+
+Everything works on whole numpy arrays: the triangles are classified by how
+many of their corners lie on the kept side of the plane, the cut edges are
+split once each and shared by the triangles on both sides of them, and the
+cross section is chained from the cut edges.
+
+    vertices, indices, normals = clip_mesh(torus.vertices, torus.indices,
+                                           Plane(Vector3(0., 1., 0.), 0.),
+                                           torus.normals)
+    for polyline in cross_section(torus.vertices, torus.indices, plane):
+        ...
+
+The kept side is the one the plane normal points to (n.p >= k), the same
+convention as the Frustum planes.  Sets of LineSegment3 are clipped with
+`LineSegment3Array.clip`.
+'''
+
+import numpy as np
+
+from euclid import *
+from euclid import _as_vector3_data, _require_numpy
+
+
+def _as_triangles(indices):
+    return np.asarray(indices, dtype=np.intp).reshape(-1, 3)
+
+
+def _distances(vertices, plane):
+    return vertices.dot((plane.n.x, plane.n.y, plane.n.z)) - plane.k
+
+
+def _cut(vertices, triangles, plane):
+    # Classify the triangles and rotate the cut ones so that their odd
+    # corner (the only kept one, or the only dropped one) comes first, which
+    # keeps the winding.  Returns the vertex distances d, the number of kept
+    # corners of every triangle, the indices of the cut triangles, their
+    # rotated corners (a, b, c), the unique cut edges as (E, 2) vertex pairs
+    # and the ids of the edges (a, b) and (a, c) of every cut triangle.
+    d = _distances(vertices, plane)
+    kept = d[triangles] >= 0
+    count = kept.sum(axis=1)
+    cut = np.flatnonzero((count == 1) | (count == 2))
+    t = triangles[cut]
+    k = kept[cut]
+    odd = np.where(count[cut] == 1, np.argmax(k, axis=1),
+                   np.argmin(k, axis=1))
+    rows = np.arange(len(cut))[:, None]
+    t = t[rows, (odd[:, None] + np.arange(3)) % 3]
+
+    # edges keyed by their sorted vertex pair packed into one integer
+    a = np.concatenate((t[:, 0], t[:, 0]))
+    b = np.concatenate((t[:, 1], t[:, 2]))
+    n = len(vertices)
+    keys, edge_id = np.unique(np.minimum(a, b) * n + np.maximum(a, b),
+                              return_inverse=True)
+    edges = np.column_stack((keys // n, keys % n))
+    edge_id = edge_id.reshape(2, -1)
+    return d, count, cut, t, edges, edge_id[0], edge_id[1]
+
+
+def _edge_points(vertices, d, edges, values=None):
+    # points (or interpolated values) where the edges cross the plane
+    a = edges[:, 0]
+    b = edges[:, 1]
+    u = (d[a] / (d[a] - d[b]))[:, None]
+    if values is None:
+        values = vertices
+    return values[a] + u * (values[b] - values[a])
+
+
+def clip_mesh(vertices, indices, plane, normals=None):
+    '''Clip a triangle mesh to one side of plane.
+
+    vertices (and normals) are (N, 3) array-likes or flat lists of N * 3
+    floats, indices a flat list or (M, 3) array of vertex indices.  Returns
+    (vertices, indices, normals) of the clipped mesh as an (N', 3) array,
+    a flat index array and an (N', 3) array of renormalised normals (None
+    if no normals were passed).  Vertices no longer referenced are dropped
+    and new ones are added where the plane cuts an edge; each cut edge gets
+    one new vertex shared by the triangles on both sides.
+    '''
+    _require_numpy()
+    vertices = _as_vector3_data(vertices)
+    triangles = _as_triangles(indices)
+    d, count, cut, t, edges, ab, ac = _cut(vertices, triangles, plane)
+    base = len(vertices)
+    ab = ab + base
+    ac = ac + base
+
+    one = count[cut] == 1
+    two = ~one
+    # one kept corner a: triangle (a, ab, ac); two kept corners b and c: the
+    # quad (ab, b, c, ac) as two triangles
+    triangles = np.concatenate((
+        triangles[count == 3],
+        np.column_stack((t[one, 0], ab[one], ac[one])),
+        np.column_stack((ab[two], t[two, 1], t[two, 2])),
+        np.column_stack((ab[two], t[two, 2], ac[two]))))
+
+    if normals is not None:
+        normals = _as_vector3_data(normals)
+        normals = np.concatenate((normals,
+                                  _edge_points(vertices, d, edges, normals)))
+        length = np.sqrt(np.einsum('ij,ij->i', normals, normals))
+        normals = normals / np.where(length > 0, length, 1.0)[:, None]
+    vertices = np.concatenate((vertices, _edge_points(vertices, d, edges)))
+
+    used = np.zeros(len(vertices), dtype=bool)
+    used[triangles] = True
+    remap = np.cumsum(used) - 1
+    vertices = vertices[used]
+    if normals is not None:
+        normals = normals[used]
+    return vertices, remap[triangles].reshape(-1), normals
+
+
+def section_segments(vertices, indices, plane):
+    '''Return the cross section of a mesh with plane as an (M, 2, 3) array
+    of line segments, one per cut triangle, oriented along the boundary of
+    the clipped mesh (see clip_mesh).'''
+    _require_numpy()
+    vertices = _as_vector3_data(vertices)
+    d, count, cut, t, edges, ab, ac = _cut(vertices, _as_triangles(indices),
+                                           plane)
+    points = _edge_points(vertices, d, edges)
+    start, end = _oriented(count[cut], ab, ac)
+    return np.stack((points[start], points[end]), axis=1)
+
+
+def _oriented(count, ab, ac):
+    # The clipped triangle (a, ab, ac) has the boundary edge ab -> ac, the
+    # quad (ab, b, c, ac) the edge ac -> ab.
+    one = count == 1
+    return np.where(one, ab, ac), np.where(one, ac, ab)
+
+
+def cross_section(vertices, indices, plane):
+    '''Return the cross section of a mesh with plane as a list of
+    polylines, each an (K, 3) array of points.  Closed loops repeat their
+    first point at the end, so every polyline can be drawn as a line
+    strip.
+
+    The polylines are chained through the vertex indices, so they break
+    where the mesh has separate vertices at the same position, e.g. along
+    the seams of a Torus.
+    '''
+    _require_numpy()
+    vertices = _as_vector3_data(vertices)
+    d, count, cut, t, edges, ab, ac = _cut(vertices, _as_triangles(indices),
+                                           plane)
+    points = _edge_points(vertices, d, edges)
+    start, end = _oriented(count[cut], ab, ac)
+
+    following = np.full(len(edges), -1, dtype=np.intp)
+    following[start] = end
+    has_previous = np.zeros(len(edges), dtype=bool)
+    has_previous[end] = True
+
+    # Walk open chains from their first edge, then whatever is left, which
+    # are closed loops.  Only integer lists are touched in the loop.
+    following = following.tolist()
+    visited = [False] * len(edges)
+    heads = np.flatnonzero(~has_previous & (np.asarray(following) >= 0))
+    polylines = []
+    for head in heads.tolist() + list(range(len(edges))):
+        if visited[head] or following[head] < 0:
+            continue
+        chain = [head]
+        visited[head] = True
+        e = following[head]
+        while e >= 0 and not visited[e]:
+            chain.append(e)
+            visited[e] = True
+            e = following[e]
+        if e == head:
+            chain.append(head)
+        polylines.append(points[chain])
+    return polylines
@@ -31,8 +31,11 @@ __docformat__ = 'restructuredtext'
 __version__ = '$Id$'
 __revision__ = '$Revision$'
 
+import array
+import ctypes
 import math
 import operator
+import sys
 import types
 
 try:
@@ -40,6 +43,13 @@ try:
 except NameError:
     long = int
 
+# numpy is optional; it is only needed by the array types (Vector3Array and
+# friends), the scalar classes work without it.
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
 # Some magic here.  If _use_slots is True, the classes will derive from
 # object and will define a __slots__ class variable.  If _use_slots is
 # False, classes will be old-style and will not define __slots__.
@@ -50,15 +60,22 @@ except NameError:
 #                      versions of Python (2.4 and 2.5).
 _use_slots = True
 
-# If True, allows components of Vector2 and Vector3 to be set via swizzling;
-# e.g.  v.xyz = (1, 2, 3).  This is much, much slower than the more verbose
-# v.x = 1; v.y = 2; v.z = 3,  and slows down ordinary element setting as
-# well.  Recommended setting is False.
-_enable_swizzle_set = False
+# If True, Matrix3 and Matrix4 keep their elements in a single array('d') in
+# OpenGL (column-major) order instead of one slot per element.  The letter
+# attributes (M.a, M.b, ...) become properties onto that array so the API is
+# unchanged, but slicing, copying and uploading a matrix is a single memcpy.
+# Element-wise arithmetic is somewhat slower, every letter access going
+# through a property.
+_use_array_storage = False
 
-# Requires class to derive from object.
-if _enable_swizzle_set:
-    _use_slots = True
+# Matrices whose determinant is smaller than this in magnitude are treated as
+# singular by the inverse methods, which then return identity.  Can also be
+# overridden per call with the epsilon argument.
+_inverse_epsilon = 1e-12
+
+# Tolerance used by Matrix4.is_rigid when checking that the rotation part is
+# orthonormal.
+_rigid_epsilon = 1e-9
 
 
 # Implement _use_slots magic.
@@ -142,27 +159,14 @@ class Vector2:
         return iter((self.x, self.y))
 
     def __getattr__(self, name):
+        # Two and three component swizzles are properties installed by
+        # _install_swizzles, this only handles the longer ones.
         try:
             return tuple([(self.x, self.y)['xy'.index(c)] \
                           for c in name])
         except ValueError:
             raise AttributeError(name)
 
-    if _enable_swizzle_set:
-        # This has detrimental performance on ordinary setattr as well
-        # if enabled
-        def __setattr__(self, name, value):
-            if len(name) == 1:
-                object.__setattr__(self, name, value)
-            else:
-                try:
-                    l = [self.x, self.y]
-                    for c, v in map(None, name, value):
-                        l['xy'.index(c)] = v
-                    self.x, self.y = l
-                except ValueError:
-                    raise AttributeError(name)
-
     def __add__(self, other):
         if isinstance(other, Vector2):
             # Vector + Vector -> Vector
@@ -364,29 +368,18 @@ class Vector3:
         return iter((self.x, self.y, self.z))
 
     def __getattr__(self, name):
+        # Two and three component swizzles are properties installed by
+        # _install_swizzles, this only handles the longer ones.
         try:
             return tuple([(self.x, self.y, self.z)['xyz'.index(c)] \
                           for c in name])
         except ValueError:
             raise AttributeError(name)
 
-    if _enable_swizzle_set:
-        # This has detrimental performance on ordinary setattr as well
-        # if enabled
-        def __setattr__(self, name, value):
-            if len(name) == 1:
-                object.__setattr__(self, name, value)
-            else:
-                try:
-                    l = [self.x, self.y, self.z]
-                    for c, v in map(None, name, value):
-                        l['xyz'.index(c)] = v
-                    self.x, self.y, self.z = l
-                except ValueError:
-                    raise AttributeError(name)
-
     def __add__(self, other):
-        if isinstance(other, Vector3):
+        if isinstance(other, Vector3Array):
+            return NotImplemented
+        elif isinstance(other, Vector3):
             # Vector + Vector -> Vector
             # Vector + Point -> Point
             # Point + Point -> Vector
@@ -417,7 +410,9 @@ class Vector3:
         return self
 
     def __sub__(self, other):
-        if isinstance(other, Vector3):
+        if isinstance(other, Vector3Array):
+            return NotImplemented
+        elif isinstance(other, Vector3):
             # Vector - Vector -> Vector
             # Vector - Point -> Point
             # Point - Point -> Vector
@@ -435,7 +430,9 @@ class Vector3:
                            self.z - other[2])
 
     def __rsub__(self, other):
-        if isinstance(other, Vector3):
+        if isinstance(other, Vector3Array):
+            return NotImplemented
+        elif isinstance(other, Vector3):
             return Vector3(other.x - self.x,
                            other.y - self.y,
                            other.z - self.z)
@@ -446,7 +443,9 @@ class Vector3:
                            other.z - self[2])
 
     def __mul__(self, other):
-        if isinstance(other, Vector3):
+        if isinstance(other, Vector3Array):
+            return NotImplemented
+        elif isinstance(other, Vector3):
             # TODO component-wise mul/div in-place and on Vector2; docs.
             if self.__class__ is Point3 or other.__class__ is Point3:
                 _class = Point3
@@ -589,14 +588,78 @@ class Vector3:
         return self.dot(n) * n
 
 
+# Swizzles
+# Every two and three letter combination of the components (v.xz, v.zyx,
+# v.xx, ...) is a property generated once here, so reading a swizzle costs
+# no more than an ordinary attribute.  Combinations without repeated letters
+# can also be assigned, e.g.  v.xz = (1, 2).
+
+def _swizzle_setter(name):
+    namespace = {}
+    exec('def __set__(self, value):\n'
+         '    %s = value\n' % ', '.join('self.' + c for c in name),
+         namespace)
+    return namespace['__set__']
+
+
+def _install_swizzles(cls, components):
+    names = [a + b for a in components for b in components]
+    names += [ab + c for ab in names for c in components]
+    for name in names:
+        if len(set(name)) == len(name):
+            fset = _swizzle_setter(name)
+        else:
+            fset = None
+        setattr(cls, name, property(operator.attrgetter(*name), fset))
+
+
+_install_swizzles(Vector2, 'xy')
+_install_swizzles(Vector3, 'xyz')
+
+
+def _matrix_buffer(M, ctype, size):
+    # Cached ctypes copy of M in column-major order.  It is refilled in place
+    # (so views onto it stay valid) only when the matrix version changed.
+    try:
+        buffers = M._buffers
+    except AttributeError:
+        buffers = M._buffers = {}
+    entry = buffers.get(ctype)
+    if entry is None:
+        entry = buffers[ctype] = [None, (ctype * size)()]
+    if entry[0] != M._version:
+        if _use_array_storage and ctype is ctypes.c_double:
+            ctypes.memmove(entry[1], M._m.buffer_info()[0], 8 * size)
+        else:
+            entry[1][:] = M[:]
+        entry[0] = M._version
+    return entry[1]
+
+
+def _matrix_array_interface(M, rows):
+    buffer = _matrix_buffer(M, ctypes.c_double, rows * rows)
+    return {'shape': (rows, rows),
+            'typestr': (sys.byteorder == 'little' and '<' or '>') + 'f8',
+            # column-major: element (row, column) is at row + rows * column
+            'strides': (8, 8 * rows),
+            'data': (ctypes.addressof(buffer), True),
+            'version': 3}
+
+
 # a b c
 # e f g
 # i j k
 
 class Matrix3:
-    __slots__ = list('abcefgijk')
+    # _version is bumped by every in-place operation and keys the cached
+    # buffers in _buffers; see as_ctypes.
+    if _use_array_storage:
+        __slots__ = ['_m', '_version', '_buffers']
+    else:
+        __slots__ = list('abcefgijk') + ['_version', '_buffers']
 
     def __init__(self):
+        self._version = 0
         self.identity()
 
     def __copy__(self):
@@ -633,40 +696,11 @@ class Matrix3:
         (self.a, self.e, self.i,
          self.b, self.f, self.j,
          self.c, self.g, self.k) = L
+        self._version += 1
 
     def __mul__(self, other):
         if isinstance(other, Matrix3):
-            # Caching repeatedly accessed attributes in local variables
-            # apparently increases performance by 20%.  Attrib: Will McGugan.
-            Aa = self.a
-            Ab = self.b
-            Ac = self.c
-            Ae = self.e
-            Af = self.f
-            Ag = self.g
-            Ai = self.i
-            Aj = self.j
-            Ak = self.k
-            Ba = other.a
-            Bb = other.b
-            Bc = other.c
-            Be = other.e
-            Bf = other.f
-            Bg = other.g
-            Bi = other.i
-            Bj = other.j
-            Bk = other.k
-            C = Matrix3()
-            C.a = Aa * Ba + Ab * Be + Ac * Bi
-            C.b = Aa * Bb + Ab * Bf + Ac * Bj
-            C.c = Aa * Bc + Ab * Bg + Ac * Bk
-            C.e = Ae * Ba + Af * Be + Ag * Bi
-            C.f = Ae * Bb + Af * Bf + Ag * Bj
-            C.g = Ae * Bc + Af * Bg + Ag * Bk
-            C.i = Ai * Ba + Aj * Be + Ak * Bi
-            C.j = Ai * Bb + Aj * Bf + Ak * Bj
-            C.k = Ai * Bc + Aj * Bg + Ak * Bk
-            return C
+            return Matrix3.multiply_into(self, other, Matrix3())
         elif isinstance(other, Point2):
             A = self
             B = other
@@ -688,39 +722,12 @@ class Matrix3:
 
     def __imul__(self, other):
         assert isinstance(other, Matrix3)
-        # Cache attributes in local vars (see Matrix3.__mul__).
-        Aa = self.a
-        Ab = self.b
-        Ac = self.c
-        Ae = self.e
-        Af = self.f
-        Ag = self.g
-        Ai = self.i
-        Aj = self.j
-        Ak = self.k
-        Ba = other.a
-        Bb = other.b
-        Bc = other.c
-        Be = other.e
-        Bf = other.f
-        Bg = other.g
-        Bi = other.i
-        Bj = other.j
-        Bk = other.k
-        self.a = Aa * Ba + Ab * Be + Ac * Bi
-        self.b = Aa * Bb + Ab * Bf + Ac * Bj
-        self.c = Aa * Bc + Ab * Bg + Ac * Bk
-        self.e = Ae * Ba + Af * Be + Ag * Bi
-        self.f = Ae * Bb + Af * Bf + Ag * Bj
-        self.g = Ae * Bc + Af * Bg + Ag * Bk
-        self.i = Ai * Ba + Aj * Be + Ak * Bi
-        self.j = Ai * Bb + Aj * Bf + Ak * Bj
-        self.k = Ai * Bc + Aj * Bg + Ak * Bk
-        return self
+        return Matrix3.multiply_into(self, other, self)
 
     def identity(self):
         self.a = self.f = self.k = 1.
         self.b = self.c = self.e = self.g = self.i = self.j = 0
+        self._version += 1
         return self
 
     def scale(self, x, y):
@@ -777,27 +784,8 @@ class Matrix3:
                 - self.b * self.e * self.k
                 - self.c * self.f * self.i)
 
-    def inverse(self):
-        tmp = Matrix3()
-        d = self.determinant()
-
-        if abs(d) < 0.001:
-            # No inverse, return identity
-            return tmp
-        else:
-            d = 1.0 / d
-
-            tmp.a = d * (self.f * self.k - self.g * self.j)
-            tmp.b = d * (self.c * self.j - self.b * self.k)
-            tmp.c = d * (self.b * self.g - self.c * self.f)
-            tmp.e = d * (self.g * self.i - self.e * self.k)
-            tmp.f = d * (self.a * self.k - self.c * self.i)
-            tmp.g = d * (self.c * self.e - self.a * self.g)
-            tmp.i = d * (self.e * self.j - self.f * self.i)
-            tmp.j = d * (self.b * self.i - self.a * self.j)
-            tmp.k = d * (self.a * self.f - self.b * self.e)
-
-            return tmp
+    def inverse(self, epsilon=None):
+        return self.inverse_into(Matrix3(), epsilon)
 
     def transpose(self):
         (self.a, self.e, self.i,
@@ -806,6 +794,7 @@ class Matrix3:
             (self.a, self.b, self.c,
              self.e, self.f, self.g,
              self.i, self.j, self.k)
+        self._version += 1
         return self
 
     def transposed(self):
@@ -813,15 +802,119 @@ class Matrix3:
         M.transpose()
         return M
 
+    # In-place operations.  These write the result into a caller supplied
+    # matrix instead of allocating a new one, so hot loops can reuse
+    # preallocated matrices.  out may be one of the operands.
+    def multiply_into(A, B, out):
+        """Compute A * B into out and return out."""
+        # Caching repeatedly accessed attributes in local variables
+        # apparently increases performance by 20%.  Attrib: Will McGugan.
+        Aa = A.a
+        Ab = A.b
+        Ac = A.c
+        Ae = A.e
+        Af = A.f
+        Ag = A.g
+        Ai = A.i
+        Aj = A.j
+        Ak = A.k
+        Ba = B.a
+        Bb = B.b
+        Bc = B.c
+        Be = B.e
+        Bf = B.f
+        Bg = B.g
+        Bi = B.i
+        Bj = B.j
+        Bk = B.k
+        out.a = Aa * Ba + Ab * Be + Ac * Bi
+        out.b = Aa * Bb + Ab * Bf + Ac * Bj
+        out.c = Aa * Bc + Ab * Bg + Ac * Bk
+        out.e = Ae * Ba + Af * Be + Ag * Bi
+        out.f = Ae * Bb + Af * Bf + Ag * Bj
+        out.g = Ae * Bc + Af * Bg + Ag * Bk
+        out.i = Ai * Ba + Aj * Be + Ak * Bi
+        out.j = Ai * Bb + Aj * Bf + Ak * Bj
+        out.k = Ai * Bc + Aj * Bg + Ak * Bk
+        out._version += 1
+        return out
+
+    multiply_into = staticmethod(multiply_into)
+
+    def transposed_into(self, out):
+        (out.a, out.e, out.i,
+         out.b, out.f, out.j,
+         out.c, out.g, out.k) = \
+            (self.a, self.b, self.c,
+             self.e, self.f, self.g,
+             self.i, self.j, self.k)
+        out._version += 1
+        return out
+
+    def inverse_into(self, out, epsilon=None):
+        a = self.a
+        b = self.b
+        c = self.c
+        e = self.e
+        f = self.f
+        g = self.g
+        i = self.i
+        j = self.j
+        k = self.k
+        d = (a * f * k + b * g * i + c * e * j
+             - a * g * j - b * e * k - c * f * i)
+
+        if epsilon is None:
+            epsilon = _inverse_epsilon
+        if abs(d) < epsilon:
+            # No inverse, return identity
+            return out.identity()
+
+        d = 1.0 / d
+        out.a = d * (f * k - g * j)
+        out.b = d * (c * j - b * k)
+        out.c = d * (b * g - c * f)
+        out.e = d * (g * i - e * k)
+        out.f = d * (a * k - c * i)
+        out.g = d * (c * e - a * g)
+        out.i = d * (e * j - f * i)
+        out.j = d * (b * i - a * j)
+        out.k = d * (a * f - b * e)
+        out._version += 1
+        return out
+
+    # Buffer export
+    def invalidate(self):
+        '''Mark the matrix as changed after assigning elements directly.'''
+        self._version += 1
+
+    def as_ctypes(self, ctype=ctypes.c_float):
+        '''Return the matrix as a ctypes array in OpenGL (column-major) order.
+
+        See `Matrix4.as_ctypes`.
+        '''
+        return _matrix_buffer(self, ctype, 9)
+
+    __array_interface__ = property(lambda self:
+                                   _matrix_array_interface(self, 3))
+
+    def __buffer__(self, flags):
+        return memoryview(self.as_ctypes())
+
 # a b c d
 # e f g h
 # i j k l
 # m n o p
 
 class Matrix4:
-    __slots__ = list('abcdefghijklmnop')
+    if _use_array_storage:
+        __slots__ = ['_m', '_version', '_buffers', '_normal']
+    else:
+        __slots__ = list('abcdefghijklmnop') + ['_version', '_buffers',
+                                                '_normal']
 
     def __init__(self):
+        self._version = 0
         self.identity()
 
     def __copy__(self):
@@ -869,60 +962,11 @@ class Matrix4:
          self.b, self.f, self.j, self.n,
          self.c, self.g, self.k, self.o,
          self.d, self.h, self.l, self.p) = L
+        self._version += 1
 
     def __mul__(self, other):
         if isinstance(other, Matrix4):
-            # Cache attributes in local vars (see Matrix3.__mul__).
-            Aa = self.a
-            Ab = self.b
-            Ac = self.c
-            Ad = self.d
-            Ae = self.e
-            Af = self.f
-            Ag = self.g
-            Ah = self.h
-            Ai = self.i
-            Aj = self.j
-            Ak = self.k
-            Al = self.l
-            Am = self.m
-            An = self.n
-            Ao = self.o
-            Ap = self.p
-            Ba = other.a
-            Bb = other.b
-            Bc = other.c
-            Bd = other.d
-            Be = other.e
-            Bf = other.f
-            Bg = other.g
-            Bh = other.h
-            Bi = other.i
-            Bj = other.j
-            Bk = other.k
-            Bl = other.l
-            Bm = other.m
-            Bn = other.n
-            Bo = other.o
-            Bp = other.p
-            C = Matrix4()
-            C.a = Aa * Ba + Ab * Be + Ac * Bi + Ad * Bm
-            C.b = Aa * Bb + Ab * Bf + Ac * Bj + Ad * Bn
-            C.c = Aa * Bc + Ab * Bg + Ac * Bk + Ad * Bo
-            C.d = Aa * Bd + Ab * Bh + Ac * Bl + Ad * Bp
-            C.e = Ae * Ba + Af * Be + Ag * Bi + Ah * Bm
-            C.f = Ae * Bb + Af * Bf + Ag * Bj + Ah * Bn
-            C.g = Ae * Bc + Af * Bg + Ag * Bk + Ah * Bo
-            C.h = Ae * Bd + Af * Bh + Ag * Bl + Ah * Bp
-            C.i = Ai * Ba + Aj * Be + Ak * Bi + Al * Bm
-            C.j = Ai * Bb + Aj * Bf + Ak * Bj + Al * Bn
-            C.k = Ai * Bc + Aj * Bg + Ak * Bk + Al * Bo
-            C.l = Ai * Bd + Aj * Bh + Ak * Bl + Al * Bp
-            C.m = Am * Ba + An * Be + Ao * Bi + Ap * Bm
-            C.n = Am * Bb + An * Bf + Ao * Bj + Ap * Bn
-            C.o = Am * Bc + An * Bg + Ao * Bk + Ap * Bo
-            C.p = Am * Bd + An * Bh + Ao * Bl + Ap * Bp
-            return C
+            return Matrix4.multiply_into(self, other, Matrix4())
         elif isinstance(other, Point3):
             A = self
             B = other
@@ -946,56 +990,7 @@ class Matrix4:
 
     def __imul__(self, other):
         assert isinstance(other, Matrix4)
-        # Cache attributes in local vars (see Matrix3.__mul__).
-        Aa = self.a
-        Ab = self.b
-        Ac = self.c
-        Ad = self.d
-        Ae = self.e
-        Af = self.f
-        Ag = self.g
-        Ah = self.h
-        Ai = self.i
-        Aj = self.j
-        Ak = self.k
-        Al = self.l
-        Am = self.m
-        An = self.n
-        Ao = self.o
-        Ap = self.p
-        Ba = other.a
-        Bb = other.b
-        Bc = other.c
-        Bd = other.d
-        Be = other.e
-        Bf = other.f
-        Bg = other.g
-        Bh = other.h
-        Bi = other.i
-        Bj = other.j
-        Bk = other.k
-        Bl = other.l
-        Bm = other.m
-        Bn = other.n
-        Bo = other.o
-        Bp = other.p
-        self.a = Aa * Ba + Ab * Be + Ac * Bi + Ad * Bm
-        self.b = Aa * Bb + Ab * Bf + Ac * Bj + Ad * Bn
-        self.c = Aa * Bc + Ab * Bg + Ac * Bk + Ad * Bo
-        self.d = Aa * Bd + Ab * Bh + Ac * Bl + Ad * Bp
-        self.e = Ae * Ba + Af * Be + Ag * Bi + Ah * Bm
-        self.f = Ae * Bb + Af * Bf + Ag * Bj + Ah * Bn
-        self.g = Ae * Bc + Af * Bg + Ag * Bk + Ah * Bo
-        self.h = Ae * Bd + Af * Bh + Ag * Bl + Ah * Bp
-        self.i = Ai * Ba + Aj * Be + Ak * Bi + Al * Bm
-        self.j = Ai * Bb + Aj * Bf + Ak * Bj + Al * Bn
-        self.k = Ai * Bc + Aj * Bg + Ak * Bk + Al * Bo
-        self.l = Ai * Bd + Aj * Bh + Ak * Bl + Al * Bp
-        self.m = Am * Ba + An * Be + Ao * Bi + Ap * Bm
-        self.n = Am * Bb + An * Bf + Ao * Bj + Ap * Bn
-        self.o = Am * Bc + An * Bg + Ao * Bk + Ap * Bo
-        self.p = Am * Bd + An * Bh + Ao * Bl + Ap * Bp
-        return self
+        return Matrix4.multiply_into(self, other, self)
 
     def transform(self, other):
         A = self
@@ -1011,10 +1006,51 @@ class Matrix4:
             P.z /= w
         return P
 
+    # Batched transforms of (N, 3) buffers.  Each takes a Vector3Array,
+    # Point3Array or any (N, 3) array-like and returns an array container for
+    # container input, an ndarray otherwise.  If out (an ndarray or container
+    # of matching shape, possibly the input itself) is given the result is
+    # written into it and out is returned.  Results keep the float dtype of
+    # the input.
+
+    def _rows(self):
+        _require_numpy()
+        return np.array(((self.a, self.b, self.c, self.d),
+                         (self.e, self.f, self.g, self.h),
+                         (self.i, self.j, self.k, self.l),
+                         (self.m, self.n, self.o, self.p)))
+
+    def transform_points(self, points, out=None):
+        '''Transform points, applying the translation (like ``self * P``).
+
+        >>> points = np.zeros((2, 3), dtype=np.float32)
+        >>> Matrix4.new_translate(1., 2., 3.).transform_points(points).dtype
+        dtype('float32')
+        >>> out = np.empty((2, 3), dtype=np.float32)
+        >>> Matrix4().transform_points(points, out=out).dtype
+        dtype('float32')
+        '''
+        M = self._rows()
+        return _transform_array(points, M[:3, :3], M[:3, 3], None, out,
+                                Point3Array)
+
+    def transform_vectors(self, vectors, out=None):
+        '''Transform vectors, ignoring the translation (like ``self * V``).'''
+        M = self._rows()
+        return _transform_array(vectors, M[:3, :3], None, None, out,
+                                Vector3Array)
+
+    def project_points(self, points, out=None):
+        '''Transform points with perspective divide (like `transform`).'''
+        M = self._rows()
+        return _transform_array(points, M[:3, :3], M[:3, 3], M[3], out,
+                                Point3Array)
+
     def identity(self):
         self.a = self.f = self.k = self.p = 1.
         self.b = self.c = self.d = self.e = self.g = self.h = \
             self.i = self.j = self.l = self.m = self.n = self.o = 0
+        self._version += 1
         return self
 
     def scale(self, x, y, z):
@@ -1058,6 +1094,7 @@ class Matrix4:
              self.e, self.f, self.g, self.h,
              self.i, self.j, self.k, self.l,
              self.m, self.n, self.o, self.p)
+        self._version += 1
         return self
 
     def transposed(self):
@@ -1065,6 +1102,317 @@ class Matrix4:
         M.transpose()
         return M
 
+    # In-place operations; see Matrix3.multiply_into.
+    def multiply_into(A, B, out):
+        """Compute A * B into out and return out."""
+        # Cache attributes in local vars (see Matrix3.multiply_into).
+        Aa = A.a
+        Ab = A.b
+        Ac = A.c
+        Ad = A.d
+        Ae = A.e
+        Af = A.f
+        Ag = A.g
+        Ah = A.h
+        Ai = A.i
+        Aj = A.j
+        Ak = A.k
+        Al = A.l
+        Am = A.m
+        An = A.n
+        Ao = A.o
+        Ap = A.p
+        Ba = B.a
+        Bb = B.b
+        Bc = B.c
+        Bd = B.d
+        Be = B.e
+        Bf = B.f
+        Bg = B.g
+        Bh = B.h
+        Bi = B.i
+        Bj = B.j
+        Bk = B.k
+        Bl = B.l
+        Bm = B.m
+        Bn = B.n
+        Bo = B.o
+        Bp = B.p
+        out.a = Aa * Ba + Ab * Be + Ac * Bi + Ad * Bm
+        out.b = Aa * Bb + Ab * Bf + Ac * Bj + Ad * Bn
+        out.c = Aa * Bc + Ab * Bg + Ac * Bk + Ad * Bo
+        out.d = Aa * Bd + Ab * Bh + Ac * Bl + Ad * Bp
+        out.e = Ae * Ba + Af * Be + Ag * Bi + Ah * Bm
+        out.f = Ae * Bb + Af * Bf + Ag * Bj + Ah * Bn
+        out.g = Ae * Bc + Af * Bg + Ag * Bk + Ah * Bo
+        out.h = Ae * Bd + Af * Bh + Ag * Bl + Ah * Bp
+        out.i = Ai * Ba + Aj * Be + Ak * Bi + Al * Bm
+        out.j = Ai * Bb + Aj * Bf + Ak * Bj + Al * Bn
+        out.k = Ai * Bc + Aj * Bg + Ak * Bk + Al * Bo
+        out.l = Ai * Bd + Aj * Bh + Ak * Bl + Al * Bp
+        out.m = Am * Ba + An * Be + Ao * Bi + Ap * Bm
+        out.n = Am * Bb + An * Bf + Ao * Bj + Ap * Bn
+        out.o = Am * Bc + An * Bg + Ao * Bk + Ap * Bo
+        out.p = Am * Bd + An * Bh + Ao * Bl + Ap * Bp
+        out._version += 1
+        return out
+
+    multiply_into = staticmethod(multiply_into)
+
+    def new_trs_into(translation, rotation, scale, out):
+        """Write translate * rotate * scale into out and return out.
+
+        translation and scale are Vector3 (scale may be None for unit
+        scale), rotation is a Quaternion.  The product is written directly,
+        without building the three intermediate matrices.
+        """
+        x = rotation.x
+        y = rotation.y
+        z = rotation.z
+        w = rotation.w
+        xx = x * x
+        xy = x * y
+        xz = x * z
+        xw = x * w
+        yy = y * y
+        yz = y * z
+        yw = y * w
+        zz = z * z
+        zw = z * w
+        if scale is None:
+            sx = sy = sz = 1.
+        else:
+            sx = scale.x
+            sy = scale.y
+            sz = scale.z
+        out.a = (1 - 2 * (yy + zz)) * sx
+        out.b = 2 * (xy - zw) * sy
+        out.c = 2 * (xz + yw) * sz
+        out.d = translation.x
+        out.e = 2 * (xy + zw) * sx
+        out.f = (1 - 2 * (xx + zz)) * sy
+        out.g = 2 * (yz - xw) * sz
+        out.h = translation.y
+        out.i = 2 * (xz - yw) * sx
+        out.j = 2 * (yz + xw) * sy
+        out.k = (1 - 2 * (xx + yy)) * sz
+        out.l = translation.z
+        out.m = out.n = out.o = 0
+        out.p = 1.
+        out._version += 1
+        return out
+
+    new_trs_into = staticmethod(new_trs_into)
+
+    def transposed_into(self, out):
+        (out.a, out.e, out.i, out.m,
+         out.b, out.f, out.j, out.n,
+         out.c, out.g, out.k, out.o,
+         out.d, out.h, out.l, out.p) = \
+            (self.a, self.b, self.c, self.d,
+             self.e, self.f, self.g, self.h,
+             self.i, self.j, self.k, self.l,
+             self.m, self.n, self.o, self.p)
+        out._version += 1
+        return out
+
+    def inverse_into(self, out, epsilon=None):
+        '''Write the inverse into out and return out.
+
+        Picks the cheapest valid method: `inverse_rigid_into` for rotation
+        plus translation, `inverse_affine_into` for other affine matrices and
+        the full 4x4 inverse otherwise.  Singular matrices (determinant below
+        epsilon, default _inverse_epsilon) give identity.
+        '''
+        if self.m == 0 and self.n == 0 and self.o == 0 and self.p == 1:
+            if self.is_rigid():
+                return self.inverse_rigid_into(out)
+            return self.inverse_affine_into(out, epsilon)
+        return self.inverse_general_into(out, epsilon)
+
+    def inverse_rigid_into(self, out):
+        '''Write the inverse of a rigid transform (rotation and translation
+        only) into out: the transposed rotation and rotated translation.
+        The matrix is not checked; see `is_rigid`.
+        '''
+        a = self.a
+        b = self.b
+        c = self.c
+        d = self.d
+        e = self.e
+        f = self.f
+        g = self.g
+        h = self.h
+        i = self.i
+        j = self.j
+        k = self.k
+        l = self.l
+        out.a = a
+        out.b = e
+        out.c = i
+        out.d = -(a * d + e * h + i * l)
+        out.e = b
+        out.f = f
+        out.g = j
+        out.h = -(b * d + f * h + j * l)
+        out.i = c
+        out.j = g
+        out.k = k
+        out.l = -(c * d + g * h + k * l)
+        out.m = out.n = out.o = 0
+        out.p = 1.
+        out._version += 1
+        return out
+
+    def inverse_affine_into(self, out, epsilon=None):
+        '''Write the inverse of an affine matrix (bottom row 0 0 0 1) into
+        out: the inverse 3x3 part and the inversely transformed translation.
+        The bottom row is not checked; see `is_affine`.
+        '''
+        a = self.a
+        b = self.b
+        c = self.c
+        e = self.e
+        f = self.f
+        g = self.g
+        i = self.i
+        j = self.j
+        k = self.k
+        A = f * k - g * j
+        B = g * i - e * k
+        C = e * j - f * i
+        det = a * A + b * B + c * C
+
+        if epsilon is None:
+            epsilon = _inverse_epsilon
+        if abs(det) < epsilon:
+            # No inverse, return identity
+            return out.identity()
+
+        det = 1.0 / det
+        a, b, c, e, f, g, i, j, k = (
+            det * A, det * (c * j - b * k), det * (b * g - c * f),
+            det * B, det * (a * k - c * i), det * (c * e - a * g),
+            det * C, det * (b * i - a * j), det * (a * f - b * e))
+        d = self.d
+        h = self.h
+        l = self.l
+        out.a = a
+        out.b = b
+        out.c = c
+        out.d = -(a * d + b * h + c * l)
+        out.e = e
+        out.f = f
+        out.g = g
+        out.h = -(e * d + f * h + g * l)
+        out.i = i
+        out.j = j
+        out.k = k
+        out.l = -(i * d + j * h + k * l)
+        out.m = out.n = out.o = 0
+        out.p = 1.
+        out._version += 1
+        return out
+
+    def inverse_general_into(self, out, epsilon=None):
+        '''Write the full 4x4 inverse into out, e.g. for projections.'''
+        Aa = self.a
+        Ab = self.b
+        Ac = self.c
+        Ad = self.d
+        Ae = self.e
+        Af = self.f
+        Ag = self.g
+        Ah = self.h
+        Ai = self.i
+        Aj = self.j
+        Ak = self.k
+        Al = self.l
+        Am = self.m
+        An = self.n
+        Ao = self.o
+        Ap = self.p
+        d = ((Aa * Af - Ae * Ab) * (Ak * Ap - Ao * Al)
+             - (Aa * Aj - Ai * Ab) * (Ag * Ap - Ao * Ah)
+             + (Aa * An - Am * Ab) * (Ag * Al - Ak * Ah)
+             + (Ae * Aj - Ai * Af) * (Ac * Ap - Ao * Ad)
+             - (Ae * An - Am * Af) * (Ac * Al - Ak * Ad)
+             + (Ai * An - Am * Aj) * (Ac * Ah - Ag * Ad))
+
+        if epsilon is None:
+            epsilon = _inverse_epsilon
+        if abs(d) < epsilon:
+            # No inverse, return identity
+            return out.identity()
+
+        d = 1.0 / d
+        out.a = d * (Af * (Ak * Ap - Ao * Al) + Aj * (
+                    Ao * Ah - Ag * Ap) + An * (Ag * Al - Ak * Ah))
+        out.e = d * (Ag * (Ai * Ap - Am * Al) + Ak * (
+                    Am * Ah - Ae * Ap) + Ao * (Ae * Al - Ai * Ah))
+        out.i = d * (Ah * (Ai * An - Am * Aj) + Al * (
+                    Am * Af - Ae * An) + Ap * (Ae * Aj - Ai * Af))
+        out.m = d * (Ae * (An * Ak - Aj * Ao) + Ai * (
+                    Af * Ao - An * Ag) + Am * (Aj * Ag - Af * Ak))
+
+        out.b = d * (Aj * (Ac * Ap - Ao * Ad) + An * (
+                    Ak * Ad - Ac * Al) + Ab * (Ao * Al - Ak * Ap))
+        out.f = d * (Ak * (Aa * Ap - Am * Ad) + Ao * (
+                    Ai * Ad - Aa * Al) + Ac * (Am * Al - Ai * Ap))
+        out.j = d * (Al * (Aa * An - Am * Ab) + Ap * (
+                    Ai * Ab - Aa * Aj) + Ad * (Am * Aj - Ai * An))
+        out.n = d * (Ai * (An * Ac - Ab * Ao) + Am * (
+                    Ab * Ak - Aj * Ac) + Aa * (Aj * Ao - An * Ak))
+
+        out.c = d * (An * (Ac * Ah - Ag * Ad) + Ab * (
+                    Ag * Ap - Ao * Ah) + Af * (Ao * Ad - Ac * Ap))
+        out.g = d * (Ao * (Aa * Ah - Ae * Ad) + Ac * (
+                    Ae * Ap - Am * Ah) + Ag * (Am * Ad - Aa * Ap))
+        out.k = d * (Ap * (Aa * Af - Ae * Ab) + Ad * (
+                    Ae * An - Am * Af) + Ah * (Am * Ab - Aa * An))
+        out.o = d * (Am * (Af * Ac - Ab * Ag) + Aa * (
+                    An * Ag - Af * Ao) + Ae * (Ab * Ao - An * Ac))
+
+        out.d = d * (Ab * (Ak * Ah - Ag * Al) + Af * (
+                    Ac * Al - Ak * Ad) + Aj * (Ag * Ad - Ac * Ah))
+        out.h = d * (Ac * (Ai * Ah - Ae * Al) + Ag * (
+                    Aa * Al - Ai * Ad) + Ak * (Ae * Ad - Aa * Ah))
+        out.l = d * (Ad * (Ai * Af - Ae * Aj) + Ah * (
+                    Aa * Aj - Ai * Ab) + Al * (Ae * Ab - Aa * Af))
+        out.p = d * (Aa * (Af * Ak - Aj * Ag) + Ae * (
+                    Aj * Ac - Ab * Ak) + Ai * (Ab * Ag - Af * Ac))
+
+        out._version += 1
+        return out
+
+    # Buffer export
+    def invalidate(self):
+        '''Mark the matrix as changed after assigning elements directly.'''
+        self._version += 1
+
+    def as_ctypes(self, ctype=ctypes.c_float):
+        '''Return the matrix as a ctypes array in OpenGL (column-major) order.
+
+        The array is cached on the matrix and refilled only after the matrix
+        has been changed by one of its in-place methods, so uploading an
+        unchanged matrix is a pointer pass::
+
+            glUniformMatrix4fv(location, 1, GL_FALSE, matrix.as_ctypes())
+
+        Pass ctypes.c_double for a double precision copy.  Elements assigned
+        directly (``matrix.d = x``) are not tracked; call `invalidate`
+        afterwards.  The matrix also exposes the double precision copy through
+        ``__array_interface__`` (numpy.asarray(matrix) is a read-only view)
+        and the buffer protocol (float32) on Python 3.12+.
+        '''
+        return _matrix_buffer(self, ctype, 16)
+
+    __array_interface__ = property(lambda self:
+                                   _matrix_array_interface(self, 4))
+
+    def __buffer__(self, flags):
+        return memoryview(self.as_ctypes())
+
     # Static constructors
     def new(cls, *values):
         M = cls()
@@ -1190,6 +1538,14 @@ class Matrix4:
 
     new_rotate_triple_axis = classmethod(new_rotate_triple_axis)
 
+    def new_trs(cls, translation, rotation, scale=None):
+        '''Return translate * rotate * scale for a Vector3 translation,
+        Quaternion rotation and optional Vector3 scale; see `new_trs_into`.
+        '''
+        return cls.new_trs_into(translation, rotation, scale, cls())
+
+    new_trs = classmethod(new_trs)
+
     def new_look_at(cls, eye, at, up):
         z = (eye - at).normalized()
         x = up.cross(z).normalized()
@@ -1231,53 +1587,162 @@ class Matrix4:
                 + (self.i * self.n - self.m * self.j)
                 * (self.c * self.h - self.g * self.d))
 
-    def inverse(self):
-        tmp = Matrix4()
-        d = self.determinant();
-
-        if abs(d) < 0.001:
-            # No inverse, return identity
-            return tmp
+    def inverse(self, epsilon=None):
+        return self.inverse_into(Matrix4(), epsilon)
+
+    def inverse_rigid(self):
+        return self.inverse_rigid_into(Matrix4())
+
+    def inverse_affine(self, epsilon=None):
+        return self.inverse_affine_into(Matrix4(), epsilon)
+
+    def is_affine(self):
+        return self.m == 0 and self.n == 0 and self.o == 0 and self.p == 1
+
+    def is_rigid(self, epsilon=None):
+        '''Return True if the matrix is affine and its 3x3 part is a
+        rotation (orthonormal columns) within epsilon (default
+        _rigid_epsilon).  A reflection also counts as rigid.
+        '''
+        return self.is_affine() and self._is_orthonormal(epsilon)
+
+    def _is_orthonormal(self, epsilon=None):
+        if epsilon is None:
+            epsilon = _rigid_epsilon
+        a = self.a
+        b = self.b
+        c = self.c
+        e = self.e
+        f = self.f
+        g = self.g
+        i = self.i
+        j = self.j
+        k = self.k
+        return (abs(a * a + e * e + i * i - 1) < epsilon and
+                abs(b * b + f * f + j * j - 1) < epsilon and
+                abs(c * c + g * g + k * k - 1) < epsilon and
+                abs(a * b + e * f + i * j) < epsilon and
+                abs(a * c + e * g + i * k) < epsilon and
+                abs(b * c + f * g + j * k) < epsilon)
+
+    def normal_matrix(self):
+        '''Return the Matrix3 that transforms normals: the inverse transpose
+        of the upper 3x3 part, or the 3x3 part itself for a rotation.
+
+        The result is cached on the matrix until it changes (tracked as for
+        `as_ctypes`) and the same Matrix3 is returned each time, so treat it
+        as read-only; use `normal_matrix_into` for a private copy.
+        '''
+        try:
+            version, N = self._normal
+        except AttributeError:
+            version, N = None, Matrix3()
+        if version != self._version:
+            self._normal = (self._version, self.normal_matrix_into(N))
+        return N
+
+    def normal_matrix_into(self, out, epsilon=None):
+        '''Write the normal matrix (see `normal_matrix`) into the Matrix3
+        out and return out.  A singular 3x3 part gives identity.
+        '''
+        a = self.a
+        b = self.b
+        c = self.c
+        e = self.e
+        f = self.f
+        g = self.g
+        i = self.i
+        j = self.j
+        k = self.k
+        if self._is_orthonormal():
+            out.a = a
+            out.b = b
+            out.c = c
+            out.e = e
+            out.f = f
+            out.g = g
+            out.i = i
+            out.j = j
+            out.k = k
+            out._version += 1
+            return out
+
+        # The inverse transpose is the cofactor matrix over the determinant.
+        A = f * k - g * j
+        B = g * i - e * k
+        C = e * j - f * i
+        det = a * A + b * B + c * C
+        if epsilon is None:
+            epsilon = _inverse_epsilon
+        if abs(det) < epsilon:
+            return out.identity()
+
+        det = 1.0 / det
+        out.a = det * A
+        out.b = det * B
+        out.c = det * C
+        out.e = det * (c * j - b * k)
+        out.f = det * (a * k - c * i)
+        out.g = det * (b * i - a * j)
+        out.i = det * (b * g - c * f)
+        out.j = det * (c * e - a * g)
+        out.k = det * (a * f - b * e)
+        out._version += 1
+        return out
+
+    def decompose(self):
+        '''Split an affine matrix into (translation, rotation, scale), the
+        inverse of `new_trs`.
+
+        Returns a Vector3, a unit Quaternion and a Vector3.  A reflection is
+        folded into a negative x scale.  Shear cannot be represented and
+        gives an approximate rotation.
+        '''
+        a = self.a
+        b = self.b
+        c = self.c
+        e = self.e
+        f = self.f
+        g = self.g
+        i = self.i
+        j = self.j
+        k = self.k
+        sx = math.sqrt(a * a + e * e + i * i)
+        sy = math.sqrt(b * b + f * f + j * j)
+        sz = math.sqrt(c * c + g * g + k * k)
+        if a * (f * k - g * j) - b * (e * k - g * i) + c * (e * j - f * i) < 0:
+            sx = -sx
+
+        # Normalize the columns; a zero scale leaves its column as is.
+        if sx:
+            a /= sx
+            e /= sx
+            i /= sx
+        if sy:
+            b /= sy
+            f /= sy
+            j /= sy
+        if sz:
+            c /= sz
+            g /= sz
+            k /= sz
+
+        # Quaternion from the rotation matrix (inverse of get_matrix),
+        # choosing the largest of w, x, y, z as pivot for stability.
+        trace = a + f + k
+        if trace > 0:
+            s = 0.5 / math.sqrt(trace + 1.)
+            Q = Quaternion(0.25 / s, (j - g) * s, (c - i) * s, (e - b) * s)
+        elif a > f and a > k:
+            s = 2. * math.sqrt(1. + a - f - k)
+            Q = Quaternion((j - g) / s, 0.25 * s, (b + e) / s, (c + i) / s)
+        elif f > k:
+            s = 2. * math.sqrt(1. + f - a - k)
+            Q = Quaternion((c - i) / s, (b + e) / s, 0.25 * s, (g + j) / s)
         else:
-            d = 1.0 / d;
-
-            tmp.a = d * (self.f * (self.k * self.p - self.o * self.l) + self.j * (
-                        self.o * self.h - self.g * self.p) + self.n * (self.g * self.l - self.k * self.h));
-            tmp.e = d * (self.g * (self.i * self.p - self.m * self.l) + self.k * (
-                        self.m * self.h - self.e * self.p) + self.o * (self.e * self.l - self.i * self.h));
-            tmp.i = d * (self.h * (self.i * self.n - self.m * self.j) + self.l * (
-                        self.m * self.f - self.e * self.n) + self.p * (self.e * self.j - self.i * self.f));
-            tmp.m = d * (self.e * (self.n * self.k - self.j * self.o) + self.i * (
-                        self.f * self.o - self.n * self.g) + self.m * (self.j * self.g - self.f * self.k));
-
-            tmp.b = d * (self.j * (self.c * self.p - self.o * self.d) + self.n * (
-                        self.k * self.d - self.c * self.l) + self.b * (self.o * self.l - self.k * self.p));
-            tmp.f = d * (self.k * (self.a * self.p - self.m * self.d) + self.o * (
-                        self.i * self.d - self.a * self.l) + self.c * (self.m * self.l - self.i * self.p));
-            tmp.j = d * (self.l * (self.a * self.n - self.m * self.b) + self.p * (
-                        self.i * self.b - self.a * self.j) + self.d * (self.m * self.j - self.i * self.n));
-            tmp.n = d * (self.i * (self.n * self.c - self.b * self.o) + self.m * (
-                        self.b * self.k - self.j * self.c) + self.a * (self.j * self.o - self.n * self.k));
-
-            tmp.c = d * (self.n * (self.c * self.h - self.g * self.d) + self.b * (
-                        self.g * self.p - self.o * self.h) + self.f * (self.o * self.d - self.c * self.p));
-            tmp.g = d * (self.o * (self.a * self.h - self.e * self.d) + self.c * (
-                        self.e * self.p - self.m * self.h) + self.g * (self.m * self.d - self.a * self.p));
-            tmp.k = d * (self.p * (self.a * self.f - self.e * self.b) + self.d * (
-                        self.e * self.n - self.m * self.f) + self.h * (self.m * self.b - self.a * self.n));
-            tmp.o = d * (self.m * (self.f * self.c - self.b * self.g) + self.a * (
-                        self.n * self.g - self.f * self.o) + self.e * (self.b * self.o - self.n * self.c));
-
-            tmp.d = d * (self.b * (self.k * self.h - self.g * self.l) + self.f * (
-                        self.c * self.l - self.k * self.d) + self.j * (self.g * self.d - self.c * self.h));
-            tmp.h = d * (self.c * (self.i * self.h - self.e * self.l) + self.g * (
-                        self.a * self.l - self.i * self.d) + self.k * (self.e * self.d - self.a * self.h));
-            tmp.l = d * (self.d * (self.i * self.f - self.e * self.j) + self.h * (
-                        self.a * self.j - self.i * self.b) + self.l * (self.e * self.b - self.a * self.f));
-            tmp.p = d * (self.a * (self.f * self.k - self.j * self.g) + self.e * (
-                        self.j * self.c - self.b * self.k) + self.i * (self.b * self.g - self.f * self.c));
-
-        return tmp;
+            s = 2. * math.sqrt(1. + k - a - f)
+            Q = Quaternion((e - b) / s, (c + i) / s, (g + j) / s, 0.25 * s)
+        return Vector3(self.d, self.h, self.l), Q, Vector3(sx, sy, sz)
 
     def get_quaternion(self):
         """Returns a quaternion representing the rotation part of the matrix.
@@ -1321,6 +1786,70 @@ class Matrix4:
         return Quaternion(w, x, y, z)
 
 
+# Array storage
+# With _use_array_storage the methods below replace the slot based ones that
+# touch every element, the remaining methods work unchanged through the
+# letter properties.
+
+def _storage_property(index):
+    def fget(self):
+        return self._m[index]
+
+    def fset(self, value):
+        self._m[index] = value
+
+    return property(fget, fset)
+
+
+def _install_array_storage(cls, letters, rows):
+    size = rows * rows
+    elements = array.array('d', [float(i % (rows + 1) == 0)
+                                 for i in range(size)])
+
+    def __init__(self):
+        self._m = elements[:]
+        self._version = 0
+
+    def __copy__(self):
+        M = self.__class__.__new__(self.__class__)
+        M._m = self._m[:]
+        M._version = 0
+        return M
+
+    def __getitem__(self, key):
+        return self._m[key]
+
+    def __setitem__(self, key, value):
+        if isinstance(key, slice):
+            value = array.array('d', value)
+            # array slice assignment would silently resize the matrix
+            if len(value) != len(range(*key.indices(size))):
+                raise ValueError('expected %d values, got %d' %
+                                 (len(range(*key.indices(size))),
+                                  len(value)))
+        self._m[key] = value
+        self._version += 1
+
+    def identity(self):
+        self._m[:] = elements
+        self._version += 1
+        return self
+
+    for index, letter in enumerate(letters):
+        row, column = divmod(index, rows)
+        setattr(cls, letter, _storage_property(column * rows + row))
+    cls.__init__ = __init__
+    cls.__copy__ = cls.copy = __copy__
+    cls.__getitem__ = __getitem__
+    cls.__setitem__ = __setitem__
+    cls.identity = identity
+
+
+if _use_array_storage:
+    _install_array_storage(Matrix3, 'abcefgijk', 3)
+    _install_array_storage(Matrix4, 'abcdefghijklmnop', 4)
+
+
 class Quaternion:
     # All methods and naming conventions based off
     # http://www.euclideanspace.com/maths/algebra/realNormedAlgebra/quaternions
@@ -1530,6 +2059,35 @@ class Quaternion:
         M.k = 1 - 2 * (xx + yy)
         return M
 
+    def get_matrix_into(self, out):
+        '''Write the rotation matrix into the Matrix4 out and return out.'''
+        x = self.x
+        y = self.y
+        z = self.z
+        w = self.w
+        xx = x * x
+        xy = x * y
+        xz = x * z
+        xw = x * w
+        yy = y * y
+        yz = y * z
+        yw = y * w
+        zz = z * z
+        zw = z * w
+        out.a = 1 - 2 * (yy + zz)
+        out.b = 2 * (xy - zw)
+        out.c = 2 * (xz + yw)
+        out.e = 2 * (xy + zw)
+        out.f = 1 - 2 * (xx + zz)
+        out.g = 2 * (yz - xw)
+        out.i = 2 * (xz - yw)
+        out.j = 2 * (yz + xw)
+        out.k = 1 - 2 * (xx + yy)
+        out.d = out.h = out.l = out.m = out.n = out.o = 0
+        out.p = 1.
+        out._version += 1
+        return out
+
     # Static constructors
     def new_identity(cls):
         return cls()
@@ -1668,18 +2226,37 @@ class Geometry:
     _intersect_point2 = _intersect_unimplemented
     _intersect_line2 = _intersect_unimplemented
     _intersect_circle = _intersect_unimplemented
+    _intersect_aabb2 = _intersect_unimplemented
     _connect_point2 = _connect_unimplemented
     _connect_line2 = _connect_unimplemented
     _connect_circle = _connect_unimplemented
+    _connect_aabb2 = _connect_unimplemented
 
     _intersect_point3 = _intersect_unimplemented
     _intersect_line3 = _intersect_unimplemented
     _intersect_sphere = _intersect_unimplemented
     _intersect_plane = _intersect_unimplemented
+    _intersect_aabb3 = _intersect_unimplemented
     _connect_point3 = _connect_unimplemented
     _connect_line3 = _connect_unimplemented
     _connect_sphere = _connect_unimplemented
     _connect_plane = _connect_unimplemented
+    _connect_aabb3 = _connect_unimplemented
+
+    def _distance_unimplemented(self, other):
+        raise AttributeError('Cannot find distance between %s and %s' %
+                             (self.__class__, other.__class__))
+
+    _distance_squared_point2 = _distance_unimplemented
+    _distance_squared_line2 = _distance_unimplemented
+    _distance_squared_circle = _distance_unimplemented
+    _distance_squared_aabb2 = _distance_unimplemented
+
+    _distance_squared_point3 = _distance_unimplemented
+    _distance_squared_line3 = _distance_unimplemented
+    _distance_squared_sphere = _distance_unimplemented
+    _distance_squared_plane = _distance_unimplemented
+    _distance_squared_aabb3 = _distance_unimplemented
 
     def intersect(self, other):
         raise NotImplementedError
@@ -1687,11 +2264,13 @@ class Geometry:
     def connect(self, other):
         raise NotImplementedError
 
+    def distance_squared(self, other):
+        raise NotImplementedError
+
     def distance(self, other):
-        c = self.connect(other)
-        if c:
-            return c.length
-        return 0.0
+        # Same value as abs(self.connect(other)) (0 where connect returns
+        # None), computed without building the connecting segment.
+        return math.sqrt(self.distance_squared(other))
 
 
 def _intersect_point2_circle(P, C):
@@ -1754,7 +2333,8 @@ def _intersect_circle_circle(A, B):
     d = abs(A.c - B.c)
     s = A.r + B.r
     m = abs(A.r - B.r)
-    if d > s or d < m:
+    if d > s or d < m or d == 0:
+        # apart, one inside the other, or concentric (no single crossing)
         return None
     d2 = d ** 2
     s2 = s ** 2
@@ -1843,6 +2423,86 @@ def _connect_circle_circle(A, B):
                         Point2(B.c.x + s2 * v.x * B.r, B.c.y + s2 * v.y * B.r))
 
 
+# The _distance_squared functions give the squared length of the segment the
+# matching _connect function would build, without allocating it.
+
+def _distance_squared_surface(d2, r):
+    # From a point at squared distance d2 of a circle or sphere centre to its
+    # surface.  Like the connect functions, a point at the centre itself has
+    # no direction to the surface and gets distance 0.
+    if not d2:
+        return 0.0
+    return (math.sqrt(d2) - r) ** 2
+
+
+def _distance_squared_circles(d2, ra, rb):
+    # As _connect_circle_circle and _connect_sphere_sphere for centres at
+    # squared distance d2.
+    if not d2:
+        return 0.0
+    d = math.sqrt(d2)
+    if ra >= rb and d < ra:
+        return (d + rb - ra) ** 2
+    elif rb > ra and d < rb:
+        return (d + ra - rb) ** 2
+    return (d - ra - rb) ** 2
+
+
+def _distance_squared_point2_line2(P, L):
+    d = L.v.magnitude_squared()
+    assert d != 0
+    u = ((P.x - L.p.x) * L.v.x + \
+         (P.y - L.p.y) * L.v.y) / d
+    if not L._u_in(u):
+        u = max(min(u, 1.0), 0.0)
+    dx = L.p.x + u * L.v.x - P.x
+    dy = L.p.y + u * L.v.y - P.y
+    return dx * dx + dy * dy
+
+
+def _distance_squared_point2_circle(P, C):
+    dx = P.x - C.c.x
+    dy = P.y - C.c.y
+    return _distance_squared_surface(dx * dx + dy * dy, C.r)
+
+
+def _distance_squared_line2_line2(A, B):
+    d = B.v.y * A.v.x - B.v.x * A.v.y
+    if d == 0:
+        if isinstance(B, Ray2) or isinstance(B, LineSegment2):
+            return _distance_squared_point2_line2(B.p, A)
+        return _distance_squared_point2_line2(A.p, B)
+
+    dy = A.p.y - B.p.y
+    dx = A.p.x - B.p.x
+    ua = (B.v.x * dy - B.v.y * dx) / d
+    if not A._u_in(ua):
+        ua = max(min(ua, 1.0), 0.0)
+    ub = (A.v.x * dy - A.v.y * dx) / d
+    if not B._u_in(ub):
+        ub = max(min(ub, 1.0), 0.0)
+    dx = A.p.x + ua * A.v.x - B.p.x - ub * B.v.x
+    dy = A.p.y + ua * A.v.y - B.p.y - ub * B.v.y
+    return dx * dx + dy * dy
+
+
+def _distance_squared_circle_line2(C, L):
+    d = L.v.magnitude_squared()
+    assert d != 0
+    u = ((C.c.x - L.p.x) * L.v.x + (C.c.y - L.p.y) * L.v.y) / d
+    if not L._u_in(u):
+        u = max(min(u, 1.0), 0.0)
+    dx = L.p.x + u * L.v.x - C.c.x
+    dy = L.p.y + u * L.v.y - C.c.y
+    return _distance_squared_surface(dx * dx + dy * dy, C.r)
+
+
+def _distance_squared_circle_circle(A, B):
+    dx = B.c.x - A.c.x
+    dy = B.c.y - A.c.y
+    return _distance_squared_circles(dx * dx + dy * dy, A.r, B.r)
+
+
 class Point2(Vector2, Geometry):
     def __repr__(self):
         return 'Point2(%.2f, %.2f)' % (self.x, self.y)
@@ -1869,6 +2529,31 @@ class Point2(Vector2, Geometry):
         if c:
             return c._swap()
 
+    def distance_squared(self, other):
+        return other._distance_squared_point2(self)
+
+    def _distance_squared_point2(self, other):
+        dx = self.x - other.x
+        dy = self.y - other.y
+        return dx * dx + dy * dy
+
+    def _distance_squared_line2(self, other):
+        return _distance_squared_point2_line2(self, other)
+
+    def _distance_squared_circle(self, other):
+        return _distance_squared_point2_circle(self, other)
+
+    def _intersect_aabb2(self, other):
+        return _intersect_point2_aabb2(self, other)
+
+    def _connect_aabb2(self, other):
+        c = _connect_point2_aabb2(self, other)
+        if c:
+            return c._swap()
+
+    def _distance_squared_aabb2(self, other):
+        return _distance_squared_point2_aabb2(self, other)
+
 
 class Line2(Geometry):
     __slots__ = ['p', 'v']
@@ -1918,6 +2603,8 @@ class Line2(Geometry):
         self.p = t * self.p
         self.v = t * self.v
 
+    _u_range = (-float('inf'), float('inf'))
+
     def _u_in(self, u):
         return True
 
@@ -1942,12 +2629,37 @@ class Line2(Geometry):
     def _connect_circle(self, other):
         return _connect_circle_line2(other, self)
 
+    def distance_squared(self, other):
+        return other._distance_squared_line2(self)
+
+    def _distance_squared_point2(self, other):
+        return _distance_squared_point2_line2(other, self)
+
+    def _distance_squared_line2(self, other):
+        return _distance_squared_line2_line2(other, self)
+
+    def _distance_squared_circle(self, other):
+        return _distance_squared_circle_line2(other, self)
+
+    def _intersect_aabb2(self, other):
+        return _intersect_line2_aabb2(self, other)
+
+    def _connect_aabb2(self, other):
+        c = _connect_line2_aabb2(self, other)
+        if c:
+            return c._swap()
+
+    def _distance_squared_aabb2(self, other):
+        return _distance_squared_line2_aabb2(self, other)
+
 
 class Ray2(Line2):
     def __repr__(self):
         return 'Ray2(<%.2f, %.2f> + u<%.2f, %.2f>)' % \
                (self.p.x, self.p.y, self.v.x, self.v.y)
 
+    _u_range = (0.0, float('inf'))
+
     def _u_in(self, u):
         return u >= 0.0
 
@@ -1957,6 +2669,8 @@ class LineSegment2(Line2):
         return 'LineSegment2(<%.2f, %.2f> to <%.2f, %.2f>)' % \
                (self.p.x, self.p.y, self.p.x + self.v.x, self.p.y + self.v.y)
 
+    _u_range = (0.0, 1.0)
+
     def _u_in(self, u):
         return u >= 0.0 and u <= 1.0
 
@@ -2021,75 +2735,450 @@ class Circle(Geometry):
     def _connect_circle(self, other):
         return _connect_circle_circle(other, self)
 
+    def distance_squared(self, other):
+        return other._distance_squared_circle(self)
+
+    def _distance_squared_point2(self, other):
+        return _distance_squared_point2_circle(other, self)
+
+    def _distance_squared_line2(self, other):
+        return _distance_squared_circle_line2(self, other)
+
+    def _distance_squared_circle(self, other):
+        return _distance_squared_circle_circle(other, self)
+
+    def _intersect_aabb2(self, other):
+        return _intersect_circle_aabb2(self, other)
+
+    def _connect_aabb2(self, other):
+        c = _connect_circle_aabb2(self, other)
+        if c:
+            return c._swap()
+
+    def _distance_squared_aabb2(self, other):
+        return _distance_squared_circle_aabb2(self, other)
+
     def tangent_points(self, p):
         m = 0.5 * (self.c + p)
         return self.intersect(Circle(m, abs(p - m)))
 
 
-# 3D Geometry
-# -------------------------------------------------------------------------
+# Axis aligned boxes
+# The functions work on the components of Vector2 and Vector3 alike.
+
+def _clip_line_box(p, v, u_range, minimum, maximum):
+    # Interval (u0, u1) of the line p + u v inside the box, limited to
+    # u_range; None if it misses the box.
+    u0, u1 = u_range
+    for pi, vi, lo, hi in zip(p, v, minimum, maximum):
+        if vi == 0:
+            if pi < lo or pi > hi:
+                return None
+            continue
+        t0 = (lo - pi) / vi
+        t1 = (hi - pi) / vi
+        if t0 > t1:
+            t0, t1 = t1, t0
+        if t0 > u0:
+            u0 = t0
+        if t1 < u1:
+            u1 = t1
+        if u0 > u1:
+            return None
+    return u0, u1
+
+
+def _closest_point_box(p, minimum, maximum):
+    return [min(max(pi, lo), hi) for pi, lo, hi in zip(p, minimum, maximum)]
+
+
+def _distance_squared_point_box(p, minimum, maximum):
+    d2 = 0.0
+    for pi, lo, hi in zip(p, minimum, maximum):
+        if pi < lo:
+            d2 += (lo - pi) ** 2
+        elif pi > hi:
+            d2 += (pi - hi) ** 2
+    return d2
+
+
+def _distance_squared_box_box(A, B):
+    d2 = 0.0
+    for alo, ahi, blo, bhi in zip(A.minimum, A.maximum, B.minimum, B.maximum):
+        if ahi < blo:
+            d2 += (blo - ahi) ** 2
+        elif bhi < alo:
+            d2 += (alo - bhi) ** 2
+    return d2
+
+
+def _connect_box_box(A, B):
+    # Closest points of two boxes, taking the middle of the overlap along
+    # axes where they overlap; None if the boxes intersect.
+    a = []
+    b = []
+    for alo, ahi, blo, bhi in zip(A.minimum, A.maximum, B.minimum, B.maximum):
+        if ahi < blo:
+            a.append(ahi)
+            b.append(blo)
+        elif bhi < alo:
+            a.append(alo)
+            b.append(bhi)
+        else:
+            m = (max(alo, blo) + min(ahi, bhi)) * 0.5
+            a.append(m)
+            b.append(m)
+    if a == b:
+        return None
+    return a, b
 
-def _connect_point3_line3(P, L):
-    d = L.v.magnitude_squared()
-    assert d != 0
-    u = ((P.x - L.p.x) * L.v.x + \
-         (P.y - L.p.y) * L.v.y + \
-         (P.z - L.p.z) * L.v.z) / d
-    if not L._u_in(u):
-        u = max(min(u, 1.0), 0.0)
-    return LineSegment3(P, Point3(L.p.x + u * L.v.x,
-                                  L.p.y + u * L.v.y,
-                                  L.p.z + u * L.v.z))
 
+def _connect_sphere_box(c, r, minimum, maximum):
+    # (surface point of the sphere, closest point of the box), or None if
+    # they intersect
+    q = _closest_point_box(c, minimum, maximum)
+    d2 = sum([(qi - ci) ** 2 for qi, ci in zip(q, c)])
+    if d2 <= r * r:
+        return None
+    s = r / math.sqrt(d2)
+    return [ci + (qi - ci) * s for qi, ci in zip(q, c)], q
 
-def _connect_point3_sphere(P, S):
-    v = P - S.c
-    v.normalize()
-    v *= S.r
-    return LineSegment3(P, Point3(S.c.x + v.x, S.c.y + v.y, S.c.z + v.z))
 
+def _distance_squared_sphere_box(c, r, minimum, maximum):
+    d2 = _distance_squared_point_box(c, minimum, maximum)
+    if d2 <= r * r:
+        return 0.0
+    return (math.sqrt(d2) - r) ** 2
+
+
+def _closest_line_box(p, v, u_range, minimum, maximum):
+    # (squared distance, u) of the point p + u v, u within u_range, closest
+    # to the box.  The squared distance is convex and quadratic in u between
+    # the u where the line crosses the planes of the box faces, so it is
+    # minimised on each of those pieces and the best one kept.
+    u0, u1 = u_range
+    cuts = set()
+    for pi, vi, lo, hi in zip(p, v, minimum, maximum):
+        if vi:
+            for u in ((lo - pi) / vi, (hi - pi) / vi):
+                if u0 < u < u1:
+                    cuts.add(u)
+    bounds = [u0] + sorted(cuts) + [u1]
+    best = None
+    for a, b in zip(bounds, bounds[1:]):
+        # any u inside the piece tells which faces the line is outside of
+        if a == -float('inf'):
+            m = b - 1.0 if b != float('inf') else 0.0
+        elif b == float('inf'):
+            m = a + 1.0
+        else:
+            m = (a + b) * 0.5
+        num = den = 0.0
+        for pi, vi, lo, hi in zip(p, v, minimum, maximum):
+            x = pi + m * vi
+            if x < lo:
+                num += (pi - lo) * vi
+                den += vi * vi
+            elif x > hi:
+                num += (pi - hi) * vi
+                den += vi * vi
+        u = -num / den if den else m
+        u = min(max(u, a), b)
+        d2 = _distance_squared_point_box([pi + u * vi for pi, vi in zip(p, v)],
+                                         minimum, maximum)
+        if best is None or d2 < best[0]:
+            best = d2, u
+    return best
+
+
+def _intersect_box_box(A, B):
+    # Overlapping part of two boxes, or None
+    minimum = [max(a, b) for a, b in zip(A.minimum, B.minimum)]
+    maximum = [min(a, b) for a, b in zip(A.maximum, B.maximum)]
+    for lo, hi in zip(minimum, maximum):
+        if lo > hi:
+            return None
+    box = A.__class__.new_empty()
+    box.minimum[:] = minimum
+    box.maximum[:] = maximum
+    return box
+
+
+def _intersect_point2_aabb2(P, B):
+    return B.minimum.x <= P.x <= B.maximum.x and \
+        B.minimum.y <= P.y <= B.maximum.y
+
+
+def _intersect_line2_aabb2(L, B):
+    u = _clip_line_box(L.p, L.v, L._u_range, B.minimum, B.maximum)
+    if u is None:
+        return None
+    return LineSegment2(Point2(L.p.x + u[0] * L.v.x, L.p.y + u[0] * L.v.y),
+                        Point2(L.p.x + u[1] * L.v.x, L.p.y + u[1] * L.v.y))
 
-def _connect_point3_plane(p, plane):
-    n = plane.n.normalized()
-    d = p.dot(plane.n) - plane.k
-    return LineSegment3(p, Point3(p.x - n.x * d, p.y - n.y * d, p.z - n.z * d))
 
+def _intersect_circle_aabb2(C, B):
+    return _distance_squared_point_box(C.c, B.minimum, B.maximum) <= C.r ** 2
 
-def _connect_line3_line3(A, B):
-    assert A.v and B.v
-    p13 = A.p - B.p
-    d1343 = p13.dot(B.v)
-    d4321 = B.v.dot(A.v)
-    d1321 = p13.dot(A.v)
-    d4343 = B.v.magnitude_squared()
-    denom = A.v.magnitude_squared() * d4343 - d4321 ** 2
-    if denom == 0:
-        # Parallel, connect an endpoint with a line
-        if isinstance(B, Ray3) or isinstance(B, LineSegment3):
-            return _connect_point3_line3(B.p, A)._swap()
-        # No endpoint (or endpoint is on A), possibly choose arbitrary
-        # point on line.
-        return _connect_point3_line3(A.p, B)
 
-    ua = (d1343 * d4321 - d1321 * d4343) / denom
-    if not A._u_in(ua):
-        ua = max(min(ua, 1.0), 0.0)
-    ub = (d1343 + d4321 * ua) / d4343
-    if not B._u_in(ub):
-        ub = max(min(ub, 1.0), 0.0)
-    return LineSegment3(Point3(A.p.x + ua * A.v.x,
-                               A.p.y + ua * A.v.y,
-                               A.p.z + ua * A.v.z),
-                        Point3(B.p.x + ub * B.v.x,
-                               B.p.y + ub * B.v.y,
-                               B.p.z + ub * B.v.z))
+def _connect_point2_aabb2(P, B):
+    if _intersect_point2_aabb2(P, B):
+        return None
+    return LineSegment2(P, Point2(*_closest_point_box(P, B.minimum,
+                                                      B.maximum)))
 
 
-def _connect_line3_plane(L, P):
-    d = P.n.dot(L.v)
-    if not d:
-        # Parallel, choose an endpoint
-        return _connect_point3_plane(L.p, P)
+def _connect_circle_aabb2(C, B):
+    c = _connect_sphere_box(C.c, C.r, B.minimum, B.maximum)
+    if c:
+        return LineSegment2(Point2(*c[0]), Point2(*c[1]))
+
+
+def _connect_aabb2_aabb2(A, B):
+    c = _connect_box_box(A, B)
+    if c:
+        return LineSegment2(Point2(*c[0]), Point2(*c[1]))
+
+
+def _distance_squared_point2_aabb2(P, B):
+    return _distance_squared_point_box(P, B.minimum, B.maximum)
+
+
+def _connect_line2_aabb2(L, B):
+    d2, u = _closest_line_box(L.p, L.v, L._u_range, B.minimum, B.maximum)
+    if not d2:
+        return None
+    p = Point2(L.p.x + u * L.v.x, L.p.y + u * L.v.y)
+    return LineSegment2(p, Point2(*_closest_point_box(p, B.minimum,
+                                                      B.maximum)))
+
+
+def _distance_squared_circle_aabb2(C, B):
+    return _distance_squared_sphere_box(C.c, C.r, B.minimum, B.maximum)
+
+
+def _distance_squared_line2_aabb2(L, B):
+    return _closest_line_box(L.p, L.v, L._u_range, B.minimum, B.maximum)[0]
+
+
+class AABB2(Geometry):
+    '''Axis aligned rectangle between the corners minimum and maximum
+    (Point2).  Any two opposite corners can be passed in; new_empty gives an
+    inverted box that merges into anything, for accumulating bounds.
+    '''
+    __slots__ = ['minimum', 'maximum']
+
+    def __init__(self, minimum, maximum):
+        assert isinstance(minimum, Vector2) and isinstance(maximum, Vector2)
+        self.minimum = Point2(min(minimum.x, maximum.x),
+                              min(minimum.y, maximum.y))
+        self.maximum = Point2(max(minimum.x, maximum.x),
+                              max(minimum.y, maximum.y))
+
+    def __copy__(self):
+        # not through __init__, which would sort the corners of an empty box
+        B = self.__class__.__new__(self.__class__)
+        B.minimum = self.minimum.copy()
+        B.maximum = self.maximum.copy()
+        return B
+
+    copy = __copy__
+
+    def __repr__(self):
+        return 'AABB2(<%.2f, %.2f> to <%.2f, %.2f>)' % \
+               (self.minimum.x, self.minimum.y,
+                self.maximum.x, self.maximum.y)
+
+    center = property(lambda self: Point2(
+        (self.minimum.x + self.maximum.x) * 0.5,
+        (self.minimum.y + self.maximum.y) * 0.5))
+    extent = property(lambda self: Vector2(
+        (self.maximum.x - self.minimum.x) * 0.5,
+        (self.maximum.y - self.minimum.y) * 0.5))
+    size = property(lambda self: self.maximum - self.minimum)
+
+    def is_empty(self):
+        return self.minimum.x > self.maximum.x or \
+            self.minimum.y > self.maximum.y
+
+    def merge(self, other):
+        '''Grow the box to include a Vector2/Point2 or another AABB2.'''
+        if isinstance(other, AABB2):
+            lo = other.minimum
+            hi = other.maximum
+        else:
+            lo = hi = other
+        self.minimum.x = min(self.minimum.x, lo.x)
+        self.minimum.y = min(self.minimum.y, lo.y)
+        self.maximum.x = max(self.maximum.x, hi.x)
+        self.maximum.y = max(self.maximum.y, hi.y)
+        return self
+
+    def merged(self, other):
+        return self.copy().merge(other)
+
+    def contains(self, other):
+        '''True if a Point2, Circle or AABB2 lies completely inside.'''
+        if isinstance(other, AABB2):
+            return _intersect_point2_aabb2(other.minimum, self) and \
+                _intersect_point2_aabb2(other.maximum, self)
+        elif isinstance(other, Circle):
+            return self.minimum.x <= other.c.x - other.r and \
+                other.c.x + other.r <= self.maximum.x and \
+                self.minimum.y <= other.c.y - other.r and \
+                other.c.y + other.r <= self.maximum.y
+        return _intersect_point2_aabb2(other, self)
+
+    def _apply_transform(self, t):
+        # Arvo, "Transforming Axis-Aligned Bounding Boxes": the box of the
+        # transformed box from its centre and half extent, no corners needed.
+        if self.is_empty():
+            return
+        cx = (self.minimum.x + self.maximum.x) * 0.5
+        cy = (self.minimum.y + self.maximum.y) * 0.5
+        ex = (self.maximum.x - self.minimum.x) * 0.5
+        ey = (self.maximum.y - self.minimum.y) * 0.5
+        x = t.a * cx + t.b * cy + t.c
+        y = t.e * cx + t.f * cy + t.g
+        ex, ey = (abs(t.a) * ex + abs(t.b) * ey,
+                  abs(t.e) * ex + abs(t.f) * ey)
+        self.minimum.x = x - ex
+        self.minimum.y = y - ey
+        self.maximum.x = x + ex
+        self.maximum.y = y + ey
+
+    # Static constructors
+    def new_empty(cls):
+        '''Return an inverted box that any point or box merges into:
+
+        >>> AABB2.new_empty().merged(Point2(1., 2.))
+        AABB2(<1.00, 2.00> to <1.00, 2.00>)
+        '''
+        self = cls(Point2(0., 0.), Point2(0., 0.))
+        self.minimum.x = self.minimum.y = float('inf')
+        self.maximum.x = self.maximum.y = -float('inf')
+        return self
+
+    new_empty = classmethod(new_empty)
+
+    def new_from_points(cls, points):
+        self = cls.new_empty()
+        for p in points:
+            self.merge(p)
+        return self
+
+    new_from_points = classmethod(new_from_points)
+
+    def intersect(self, other):
+        return other._intersect_aabb2(self)
+
+    def _intersect_point2(self, other):
+        return _intersect_point2_aabb2(other, self)
+
+    def _intersect_line2(self, other):
+        return _intersect_line2_aabb2(other, self)
+
+    def _intersect_circle(self, other):
+        return _intersect_circle_aabb2(other, self)
+
+    def _intersect_aabb2(self, other):
+        return _intersect_box_box(other, self)
+
+    def connect(self, other):
+        return other._connect_aabb2(self)
+
+    def _connect_point2(self, other):
+        return _connect_point2_aabb2(other, self)
+
+    def _connect_line2(self, other):
+        return _connect_line2_aabb2(other, self)
+
+    def _connect_circle(self, other):
+        return _connect_circle_aabb2(other, self)
+
+    def _connect_aabb2(self, other):
+        return _connect_aabb2_aabb2(other, self)
+
+    def distance_squared(self, other):
+        return other._distance_squared_aabb2(self)
+
+    def _distance_squared_point2(self, other):
+        return _distance_squared_point2_aabb2(other, self)
+
+    def _distance_squared_line2(self, other):
+        return _distance_squared_line2_aabb2(other, self)
+
+    def _distance_squared_circle(self, other):
+        return _distance_squared_circle_aabb2(other, self)
+
+    def _distance_squared_aabb2(self, other):
+        return _distance_squared_box_box(other, self)
+
+
+# 3D Geometry
+# -------------------------------------------------------------------------
+
+def _connect_point3_line3(P, L):
+    d = L.v.magnitude_squared()
+    assert d != 0
+    u = ((P.x - L.p.x) * L.v.x + \
+         (P.y - L.p.y) * L.v.y + \
+         (P.z - L.p.z) * L.v.z) / d
+    if not L._u_in(u):
+        u = max(min(u, 1.0), 0.0)
+    return LineSegment3(P, Point3(L.p.x + u * L.v.x,
+                                  L.p.y + u * L.v.y,
+                                  L.p.z + u * L.v.z))
+
+
+def _connect_point3_sphere(P, S):
+    v = P - S.c
+    v.normalize()
+    v *= S.r
+    return LineSegment3(P, Point3(S.c.x + v.x, S.c.y + v.y, S.c.z + v.z))
+
+
+def _connect_point3_plane(p, plane):
+    n = plane.n.normalized()
+    d = p.dot(plane.n) - plane.k
+    return LineSegment3(p, Point3(p.x - n.x * d, p.y - n.y * d, p.z - n.z * d))
+
+
+def _connect_line3_line3(A, B):
+    assert A.v and B.v
+    p13 = A.p - B.p
+    d1343 = p13.dot(B.v)
+    d4321 = B.v.dot(A.v)
+    d1321 = p13.dot(A.v)
+    d4343 = B.v.magnitude_squared()
+    denom = A.v.magnitude_squared() * d4343 - d4321 ** 2
+    if denom == 0:
+        # Parallel, connect an endpoint with a line
+        if isinstance(B, Ray3) or isinstance(B, LineSegment3):
+            return _connect_point3_line3(B.p, A)._swap()
+        # No endpoint (or endpoint is on A), possibly choose arbitrary
+        # point on line.
+        return _connect_point3_line3(A.p, B)
+
+    ua = (d1343 * d4321 - d1321 * d4343) / denom
+    if not A._u_in(ua):
+        ua = max(min(ua, 1.0), 0.0)
+    ub = (d1343 + d4321 * ua) / d4343
+    if not B._u_in(ub):
+        ub = max(min(ub, 1.0), 0.0)
+    return LineSegment3(Point3(A.p.x + ua * A.v.x,
+                               A.p.y + ua * A.v.y,
+                               A.p.z + ua * A.v.z),
+                        Point3(B.p.x + ub * B.v.x,
+                               B.p.y + ub * B.v.y,
+                               B.p.z + ub * B.v.z))
+
+
+def _connect_line3_plane(L, P):
+    d = P.n.dot(L.v)
+    if not d:
+        # Parallel, choose an endpoint
+        return _connect_point3_plane(L.p, P)
     u = (P.k - P.n.dot(L.p)) / d
     if not L._u_in(u):
         # intersects out of range, choose nearest endpoint
@@ -2159,6 +3248,107 @@ def _connect_plane_plane(A, B):
         return _connect_point3_plane(A._get_point(), B)
 
 
+def _distance_squared_point3_line3(P, L):
+    d = L.v.magnitude_squared()
+    assert d != 0
+    u = ((P.x - L.p.x) * L.v.x + \
+         (P.y - L.p.y) * L.v.y + \
+         (P.z - L.p.z) * L.v.z) / d
+    if not L._u_in(u):
+        u = max(min(u, 1.0), 0.0)
+    dx = L.p.x + u * L.v.x - P.x
+    dy = L.p.y + u * L.v.y - P.y
+    dz = L.p.z + u * L.v.z - P.z
+    return dx * dx + dy * dy + dz * dz
+
+
+def _distance_squared_point3_sphere(P, S):
+    dx = P.x - S.c.x
+    dy = P.y - S.c.y
+    dz = P.z - S.c.z
+    return _distance_squared_surface(dx * dx + dy * dy + dz * dz, S.r)
+
+
+def _distance_squared_point3_plane(p, plane):
+    return (p.x * plane.n.x + p.y * plane.n.y + p.z * plane.n.z -
+            plane.k) ** 2
+
+
+def _distance_squared_line3_line3(A, B):
+    assert A.v and B.v
+    p13x = A.p.x - B.p.x
+    p13y = A.p.y - B.p.y
+    p13z = A.p.z - B.p.z
+    d1343 = p13x * B.v.x + p13y * B.v.y + p13z * B.v.z
+    d4321 = B.v.dot(A.v)
+    d1321 = p13x * A.v.x + p13y * A.v.y + p13z * A.v.z
+    d4343 = B.v.magnitude_squared()
+    denom = A.v.magnitude_squared() * d4343 - d4321 ** 2
+    if denom == 0:
+        if isinstance(B, Ray3) or isinstance(B, LineSegment3):
+            return _distance_squared_point3_line3(B.p, A)
+        return _distance_squared_point3_line3(A.p, B)
+
+    ua = (d1343 * d4321 - d1321 * d4343) / denom
+    if not A._u_in(ua):
+        ua = max(min(ua, 1.0), 0.0)
+    ub = (d1343 + d4321 * ua) / d4343
+    if not B._u_in(ub):
+        ub = max(min(ub, 1.0), 0.0)
+    dx = p13x + ua * A.v.x - ub * B.v.x
+    dy = p13y + ua * A.v.y - ub * B.v.y
+    dz = p13z + ua * A.v.z - ub * B.v.z
+    return dx * dx + dy * dy + dz * dz
+
+
+def _distance_squared_line3_plane(L, P):
+    d = P.n.dot(L.v)
+    if not d:
+        return _distance_squared_point3_plane(L.p, P)
+    u = (P.k - P.n.dot(L.p)) / d
+    if not L._u_in(u):
+        u = max(min(u, 1.0), 0.0)
+        return (P.n.x * (L.p.x + u * L.v.x) +
+                P.n.y * (L.p.y + u * L.v.y) +
+                P.n.z * (L.p.z + u * L.v.z) - P.k) ** 2
+    # Intersection
+    return 0.0
+
+
+def _distance_squared_sphere_line3(S, L):
+    d = L.v.magnitude_squared()
+    assert d != 0
+    u = ((S.c.x - L.p.x) * L.v.x + \
+         (S.c.y - L.p.y) * L.v.y + \
+         (S.c.z - L.p.z) * L.v.z) / d
+    if not L._u_in(u):
+        u = max(min(u, 1.0), 0.0)
+    dx = L.p.x + u * L.v.x - S.c.x
+    dy = L.p.y + u * L.v.y - S.c.y
+    dz = L.p.z + u * L.v.z - S.c.z
+    return _distance_squared_surface(dx * dx + dy * dy + dz * dz, S.r)
+
+
+def _distance_squared_sphere_sphere(A, B):
+    dx = B.c.x - A.c.x
+    dy = B.c.y - A.c.y
+    dz = B.c.z - A.c.z
+    return _distance_squared_circles(dx * dx + dy * dy + dz * dz, A.r, B.r)
+
+
+def _distance_squared_sphere_plane(S, P):
+    return _distance_squared_surface(
+        _distance_squared_point3_plane(S.c, P), S.r)
+
+
+def _distance_squared_plane_plane(A, B):
+    # Vector3 truthiness (__nonzero__) doesn't exist on Python 3, so unlike
+    # _connect_plane_plane test the cross product explicitly.
+    if A.n.cross(B.n).magnitude_squared():
+        return 0.0
+    return _distance_squared_point3_plane(A._get_point(), B)
+
+
 def _intersect_point3_sphere(P, S):
     return abs(P - S.c) <= S.r
 
@@ -2252,6 +3442,35 @@ class Point3(Vector3, Geometry):
         if c:
             return c._swap()
 
+    def distance_squared(self, other):
+        return other._distance_squared_point3(self)
+
+    def _distance_squared_point3(self, other):
+        dx = self.x - other.x
+        dy = self.y - other.y
+        dz = self.z - other.z
+        return dx * dx + dy * dy + dz * dz
+
+    def _distance_squared_line3(self, other):
+        return _distance_squared_point3_line3(self, other)
+
+    def _distance_squared_sphere(self, other):
+        return _distance_squared_point3_sphere(self, other)
+
+    def _distance_squared_plane(self, other):
+        return _distance_squared_point3_plane(self, other)
+
+    def _intersect_aabb3(self, other):
+        return _intersect_point3_aabb3(self, other)
+
+    def _connect_aabb3(self, other):
+        c = _connect_point3_aabb3(self, other)
+        if c:
+            return c._swap()
+
+    def _distance_squared_aabb3(self, other):
+        return _distance_squared_point3_aabb3(self, other)
+
 
 class Line3:
     __slots__ = ['p', 'v']
@@ -2303,6 +3522,10 @@ class Line3:
         self.p = t * self.p
         self.v = t * self.v
 
+    # Valid range of the line parameter u, used by the array kernels; must
+    # agree with _u_in.
+    _u_range = (-float('inf'), float('inf'))
+
     def _u_in(self, u):
         return True
 
@@ -2332,12 +3555,43 @@ class Line3:
         if c:
             return c
 
+    def distance(self, other):
+        return math.sqrt(self.distance_squared(other))
+
+    def distance_squared(self, other):
+        return other._distance_squared_line3(self)
+
+    def _distance_squared_point3(self, other):
+        return _distance_squared_point3_line3(other, self)
+
+    def _distance_squared_line3(self, other):
+        return _distance_squared_line3_line3(other, self)
+
+    def _distance_squared_sphere(self, other):
+        return _distance_squared_sphere_line3(other, self)
+
+    def _distance_squared_plane(self, other):
+        return _distance_squared_line3_plane(self, other)
+
+    def _intersect_aabb3(self, other):
+        return _intersect_line3_aabb3(self, other)
+
+    def _connect_aabb3(self, other):
+        c = _connect_line3_aabb3(self, other)
+        if c:
+            return c._swap()
+
+    def _distance_squared_aabb3(self, other):
+        return _distance_squared_line3_aabb3(self, other)
+
 
 class Ray3(Line3):
     def __repr__(self):
         return 'Ray3(<%.2f, %.2f, %.2f> + u<%.2f, %.2f, %.2f>)' % \
                (self.p.x, self.p.y, self.p.z, self.v.x, self.v.y, self.v.z)
 
+    _u_range = (0.0, float('inf'))
+
     def _u_in(self, u):
         return u >= 0.0
 
@@ -2348,6 +3602,8 @@ class LineSegment3(Line3):
                (self.p.x, self.p.y, self.p.z,
                 self.p.x + self.v.x, self.p.y + self.v.y, self.p.z + self.v.z)
 
+    _u_range = (0.0, 1.0)
+
     def _u_in(self, u):
         return u >= 0.0 and u <= 1.0
 
@@ -2414,6 +3670,35 @@ class Sphere:
         if c:
             return c
 
+    def distance(self, other):
+        return math.sqrt(self.distance_squared(other))
+
+    def distance_squared(self, other):
+        return other._distance_squared_sphere(self)
+
+    def _distance_squared_point3(self, other):
+        return _distance_squared_point3_sphere(other, self)
+
+    def _distance_squared_line3(self, other):
+        return _distance_squared_sphere_line3(self, other)
+
+    def _distance_squared_sphere(self, other):
+        return _distance_squared_sphere_sphere(other, self)
+
+    def _distance_squared_plane(self, other):
+        return _distance_squared_sphere_plane(self, other)
+
+    def _intersect_aabb3(self, other):
+        return _intersect_sphere_aabb3(self, other)
+
+    def _connect_aabb3(self, other):
+        c = _connect_sphere_aabb3(self, other)
+        if c:
+            return c._swap()
+
+    def _distance_squared_aabb3(self, other):
+        return _distance_squared_sphere_aabb3(self, other)
+
 
 class Plane:
     # n.p = k, where n is normal, p is point on plane, k is constant scalar
@@ -2489,3 +3774,1860 @@ class Plane:
 
     def _connect_plane(self, other):
         return _connect_plane_plane(other, self)
+
+    def distance(self, other):
+        return math.sqrt(self.distance_squared(other))
+
+    def distance_squared(self, other):
+        return other._distance_squared_plane(self)
+
+    def _distance_squared_point3(self, other):
+        return _distance_squared_point3_plane(other, self)
+
+    def _distance_squared_line3(self, other):
+        return _distance_squared_line3_plane(other, self)
+
+    def _distance_squared_sphere(self, other):
+        return _distance_squared_sphere_plane(other, self)
+
+    def _distance_squared_plane(self, other):
+        return _distance_squared_plane_plane(other, self)
+
+    def _intersect_aabb3(self, other):
+        return _intersect_plane_aabb3(self, other)
+
+    def _connect_aabb3(self, other):
+        c = _connect_plane_aabb3(self, other)
+        if c:
+            return c._swap()
+
+    def _distance_squared_aabb3(self, other):
+        return _distance_squared_plane_aabb3(self, other)
+
+
+def _intersect_point3_aabb3(P, B):
+    return B.minimum.x <= P.x <= B.maximum.x and \
+        B.minimum.y <= P.y <= B.maximum.y and \
+        B.minimum.z <= P.z <= B.maximum.z
+
+
+def _intersect_line3_aabb3(L, B):
+    u = _clip_line_box(L.p, L.v, L._u_range, B.minimum, B.maximum)
+    if u is None:
+        return None
+    return LineSegment3(Point3(L.p.x + u[0] * L.v.x,
+                               L.p.y + u[0] * L.v.y,
+                               L.p.z + u[0] * L.v.z),
+                        Point3(L.p.x + u[1] * L.v.x,
+                               L.p.y + u[1] * L.v.y,
+                               L.p.z + u[1] * L.v.z))
+
+
+def _intersect_sphere_aabb3(S, B):
+    return _distance_squared_point_box(S.c, B.minimum, B.maximum) <= S.r ** 2
+
+
+def _intersect_plane_aabb3(P, B):
+    # True if the plane passes through the box
+    c = B.center
+    e = B.extent
+    d = P.n.dot(c) - P.k
+    r = abs(P.n.x) * e.x + abs(P.n.y) * e.y + abs(P.n.z) * e.z
+    return abs(d) <= r
+
+
+def _connect_point3_aabb3(P, B):
+    if _intersect_point3_aabb3(P, B):
+        return None
+    return LineSegment3(P, Point3(*_closest_point_box(P, B.minimum,
+                                                      B.maximum)))
+
+
+def _connect_sphere_aabb3(S, B):
+    c = _connect_sphere_box(S.c, S.r, B.minimum, B.maximum)
+    if c:
+        return LineSegment3(Point3(*c[0]), Point3(*c[1]))
+
+
+def _connect_aabb3_aabb3(A, B):
+    c = _connect_box_box(A, B)
+    if c:
+        return LineSegment3(Point3(*c[0]), Point3(*c[1]))
+
+
+def _distance_squared_point3_aabb3(P, B):
+    return _distance_squared_point_box(P, B.minimum, B.maximum)
+
+
+def _connect_line3_aabb3(L, B):
+    d2, u = _closest_line_box(L.p, L.v, L._u_range, B.minimum, B.maximum)
+    if not d2:
+        return None
+    p = Point3(L.p.x + u * L.v.x, L.p.y + u * L.v.y, L.p.z + u * L.v.z)
+    return LineSegment3(p, Point3(*_closest_point_box(p, B.minimum,
+                                                      B.maximum)))
+
+
+def _plane_box_corner(P, B):
+    # (signed distance of the box centre to the plane, half the spread of
+    # the box along the normal, corner of the box nearest to the plane)
+    c = B.center
+    e = B.extent
+    d = P.n.dot(c) - P.k
+    r = abs(P.n.x) * e.x + abs(P.n.y) * e.y + abs(P.n.z) * e.z
+    lo = B.minimum
+    hi = B.maximum
+    if d < 0:
+        lo, hi = hi, lo
+    corner = Point3(lo.x if P.n.x > 0 else hi.x,
+                    lo.y if P.n.y > 0 else hi.y,
+                    lo.z if P.n.z > 0 else hi.z)
+    return d, r, corner
+
+
+def _connect_plane_aabb3(P, B):
+    d, r, corner = _plane_box_corner(P, B)
+    if abs(d) <= r:
+        return None
+    return _connect_point3_plane(corner, P)._swap()
+
+
+def _distance_squared_sphere_aabb3(S, B):
+    return _distance_squared_sphere_box(S.c, S.r, B.minimum, B.maximum)
+
+
+def _distance_squared_line3_aabb3(L, B):
+    return _closest_line_box(L.p, L.v, L._u_range, B.minimum, B.maximum)[0]
+
+
+def _distance_squared_plane_aabb3(P, B):
+    d, r, corner = _plane_box_corner(P, B)
+    if abs(d) <= r:
+        return 0.0
+    return (abs(d) - r) ** 2
+
+
+class AABB3:
+    '''Axis aligned box between the corners minimum and maximum (Point3).
+    Any two opposite corners can be passed in; new_empty gives an inverted
+    box that merges into anything, for accumulating bounds.
+
+    Transforming a box (``matrix * box``) returns the box bounding the
+    transformed one, computed in constant time from its centre and extent
+    (Arvo's method) rather than by transforming the eight corners.
+    '''
+    __slots__ = ['minimum', 'maximum']
+
+    def __init__(self, minimum, maximum):
+        assert isinstance(minimum, Vector3) and isinstance(maximum, Vector3)
+        self.minimum = Point3(min(minimum.x, maximum.x),
+                              min(minimum.y, maximum.y),
+                              min(minimum.z, maximum.z))
+        self.maximum = Point3(max(minimum.x, maximum.x),
+                              max(minimum.y, maximum.y),
+                              max(minimum.z, maximum.z))
+
+    def __copy__(self):
+        # not through __init__, which would sort the corners of an empty box
+        B = self.__class__.__new__(self.__class__)
+        B.minimum = self.minimum.copy()
+        B.maximum = self.maximum.copy()
+        return B
+
+    copy = __copy__
+
+    def __repr__(self):
+        return 'AABB3(<%.2f, %.2f, %.2f> to <%.2f, %.2f, %.2f>)' % \
+               (self.minimum.x, self.minimum.y, self.minimum.z,
+                self.maximum.x, self.maximum.y, self.maximum.z)
+
+    center = property(lambda self: Point3(
+        (self.minimum.x + self.maximum.x) * 0.5,
+        (self.minimum.y + self.maximum.y) * 0.5,
+        (self.minimum.z + self.maximum.z) * 0.5))
+    extent = property(lambda self: Vector3(
+        (self.maximum.x - self.minimum.x) * 0.5,
+        (self.maximum.y - self.minimum.y) * 0.5,
+        (self.maximum.z - self.minimum.z) * 0.5))
+    size = property(lambda self: self.maximum - self.minimum)
+
+    def is_empty(self):
+        return self.minimum.x > self.maximum.x or \
+            self.minimum.y > self.maximum.y or \
+            self.minimum.z > self.maximum.z
+
+    def surface_area(self):
+        x, y, z = self.maximum - self.minimum
+        return 2 * (x * y + y * z + z * x)
+
+    def merge(self, other):
+        '''Grow the box to include a Vector3/Point3 or another AABB3.'''
+        if isinstance(other, AABB3):
+            lo = other.minimum
+            hi = other.maximum
+        else:
+            lo = hi = other
+        self.minimum.x = min(self.minimum.x, lo.x)
+        self.minimum.y = min(self.minimum.y, lo.y)
+        self.minimum.z = min(self.minimum.z, lo.z)
+        self.maximum.x = max(self.maximum.x, hi.x)
+        self.maximum.y = max(self.maximum.y, hi.y)
+        self.maximum.z = max(self.maximum.z, hi.z)
+        return self
+
+    def merged(self, other):
+        return self.copy().merge(other)
+
+    def contains(self, other):
+        '''True if a Point3, Sphere or AABB3 lies completely inside.'''
+        if isinstance(other, AABB3):
+            return _intersect_point3_aabb3(other.minimum, self) and \
+                _intersect_point3_aabb3(other.maximum, self)
+        elif isinstance(other, Sphere):
+            r = other.r
+            return self.minimum.x <= other.c.x - r and \
+                other.c.x + r <= self.maximum.x and \
+                self.minimum.y <= other.c.y - r and \
+                other.c.y + r <= self.maximum.y and \
+                self.minimum.z <= other.c.z - r and \
+                other.c.z + r <= self.maximum.z
+        return _intersect_point3_aabb3(other, self)
+
+    def _apply_transform(self, t):
+        # Arvo, "Transforming Axis-Aligned Bounding Boxes", in centre and
+        # half extent form.  Only the affine part of t is used.
+        if self.is_empty():
+            return
+        if isinstance(t, Quaternion):
+            t = t.get_matrix()
+        cx = (self.minimum.x + self.maximum.x) * 0.5
+        cy = (self.minimum.y + self.maximum.y) * 0.5
+        cz = (self.minimum.z + self.maximum.z) * 0.5
+        ex = (self.maximum.x - self.minimum.x) * 0.5
+        ey = (self.maximum.y - self.minimum.y) * 0.5
+        ez = (self.maximum.z - self.minimum.z) * 0.5
+        x = t.a * cx + t.b * cy + t.c * cz + t.d
+        y = t.e * cx + t.f * cy + t.g * cz + t.h
+        z = t.i * cx + t.j * cy + t.k * cz + t.l
+        ex, ey, ez = (abs(t.a) * ex + abs(t.b) * ey + abs(t.c) * ez,
+                      abs(t.e) * ex + abs(t.f) * ey + abs(t.g) * ez,
+                      abs(t.i) * ex + abs(t.j) * ey + abs(t.k) * ez)
+        self.minimum.x = x - ex
+        self.minimum.y = y - ey
+        self.minimum.z = z - ez
+        self.maximum.x = x + ex
+        self.maximum.y = y + ey
+        self.maximum.z = z + ez
+
+    # Static constructors
+    def new_empty(cls):
+        '''Return an inverted box that any point or box merges into:
+
+        >>> AABB3.new_empty().merged(Point3(1., 2., 3.))
+        AABB3(<1.00, 2.00, 3.00> to <1.00, 2.00, 3.00>)
+        '''
+        self = cls(Point3(0., 0., 0.), Point3(0., 0., 0.))
+        self.minimum.x = self.minimum.y = self.minimum.z = float('inf')
+        self.maximum.x = self.maximum.y = self.maximum.z = -float('inf')
+        return self
+
+    new_empty = classmethod(new_empty)
+
+    def new_from_points(cls, points):
+        self = cls.new_empty()
+        for p in points:
+            self.merge(p)
+        return self
+
+    new_from_points = classmethod(new_from_points)
+
+    def new_from_sphere(cls, sphere):
+        r = Vector3(sphere.r, sphere.r, sphere.r)
+        return cls(sphere.c - r, sphere.c + r)
+
+    new_from_sphere = classmethod(new_from_sphere)
+
+    def intersect(self, other):
+        return other._intersect_aabb3(self)
+
+    def _intersect_point3(self, other):
+        return _intersect_point3_aabb3(other, self)
+
+    def _intersect_line3(self, other):
+        return _intersect_line3_aabb3(other, self)
+
+    def _intersect_sphere(self, other):
+        return _intersect_sphere_aabb3(other, self)
+
+    def _intersect_plane(self, other):
+        return _intersect_plane_aabb3(other, self)
+
+    def _intersect_aabb3(self, other):
+        return _intersect_box_box(other, self)
+
+    def connect(self, other):
+        return other._connect_aabb3(self)
+
+    def _connect_point3(self, other):
+        return _connect_point3_aabb3(other, self)
+
+    def _connect_line3(self, other):
+        return _connect_line3_aabb3(other, self)
+
+    def _connect_sphere(self, other):
+        return _connect_sphere_aabb3(other, self)
+
+    def _connect_plane(self, other):
+        return _connect_plane_aabb3(other, self)
+
+    def _connect_aabb3(self, other):
+        return _connect_aabb3_aabb3(other, self)
+
+    def distance(self, other):
+        return math.sqrt(self.distance_squared(other))
+
+    def distance_squared(self, other):
+        return other._distance_squared_aabb3(self)
+
+    def _distance_squared_point3(self, other):
+        return _distance_squared_point3_aabb3(other, self)
+
+    def _distance_squared_line3(self, other):
+        return _distance_squared_line3_aabb3(other, self)
+
+    def _distance_squared_sphere(self, other):
+        return _distance_squared_sphere_aabb3(other, self)
+
+    def _distance_squared_plane(self, other):
+        return _distance_squared_plane_aabb3(other, self)
+
+    def _distance_squared_aabb3(self, other):
+        return _distance_squared_box_box(other, self)
+
+
+class Frustum:
+    '''A view frustum bounded by six planes whose normals point inwards, in
+    the order left, right, bottom, top, near, far.
+
+    The test methods classify objects as OUTSIDE, INTERSECT or INSIDE.  The
+    batched versions take two optional arrays that are updated in place and
+    can be kept between calls:
+
+    plane_mask
+        (N,) integer bit masks of the planes still to be tested, bit i for
+        plane i (63 tests all of them).  The bits of planes an object lies
+        completely inside are cleared, so passing a parent's mask on to its
+        children skips those planes.
+    last_plane
+        (N,) integer index of the plane that culled each object (-1 if
+        none).  That plane is tried first on the next call, and objects it
+        still rejects skip the remaining tests.
+    '''
+    __slots__ = ['planes', '_arrays']
+
+    OUTSIDE = 0
+    INTERSECT = 1
+    INSIDE = 2
+
+    def __init__(self, planes):
+        assert len(planes) == 6
+        self.planes = [P.copy() for P in planes]
+        self._arrays = None
+
+    def __copy__(self):
+        return self.__class__(self.planes)
+
+    copy = __copy__
+
+    def __repr__(self):
+        return 'Frustum(%s)' % ', '.join([repr(P) for P in self.planes])
+
+    def new_from_matrix(cls, M):
+        '''Extract the planes from a projection (or projection * view)
+        matrix, e.g. one built by Matrix4.new_perspective, so that they are
+        in the space the matrix transforms from.'''
+        rows = ((M.a, M.b, M.c, M.d),
+                (M.e, M.f, M.g, M.h),
+                (M.i, M.j, M.k, M.l))
+        w = (M.m, M.n, M.o, M.p)
+        planes = []
+        for row in rows:
+            for sign in (1, -1):
+                a, b, c, d = [wi + sign * ri for wi, ri in zip(w, row)]
+                length = math.sqrt(a * a + b * b + c * c)
+                planes.append(Plane(Vector3(a / length, b / length,
+                                            c / length), -d / length))
+        return cls(planes)
+
+    new_from_matrix = classmethod(new_from_matrix)
+
+    def _apply_transform(self, t):
+        for P in self.planes:
+            P._apply_transform(t)
+        self._arrays = None
+
+    def test_point(self, point):
+        for P in self.planes:
+            if P.n.dot(point) < P.k:
+                return Frustum.OUTSIDE
+        return Frustum.INSIDE
+
+    def test_sphere(self, sphere):
+        result = Frustum.INSIDE
+        for P in self.planes:
+            d = P.n.dot(sphere.c) - P.k
+            if d < -sphere.r:
+                return Frustum.OUTSIDE
+            elif d < sphere.r:
+                result = Frustum.INTERSECT
+        return result
+
+    def test_aabb(self, box):
+        '''Classify an AABB3.'''
+        minimum = box.minimum
+        maximum = box.maximum
+        cx = (minimum.x + maximum.x) * 0.5
+        cy = (minimum.y + maximum.y) * 0.5
+        cz = (minimum.z + maximum.z) * 0.5
+        ex = (maximum.x - minimum.x) * 0.5
+        ey = (maximum.y - minimum.y) * 0.5
+        ez = (maximum.z - minimum.z) * 0.5
+        result = Frustum.INSIDE
+        for P in self.planes:
+            d = P.n.x * cx + P.n.y * cy + P.n.z * cz - P.k
+            r = abs(P.n.x) * ex + abs(P.n.y) * ey + abs(P.n.z) * ez
+            if d < -r:
+                return Frustum.OUTSIDE
+            elif d < r:
+                result = Frustum.INTERSECT
+        return result
+
+    def _plane_arrays(self):
+        if self._arrays is None:
+            _require_numpy()
+            self._arrays = (np.array([(P.n.x, P.n.y, P.n.z)
+                                      for P in self.planes]),
+                            np.array([P.k for P in self.planes]))
+        return self._arrays
+
+    def test_spheres(self, spheres, plane_mask=None, last_plane=None):
+        '''Classify every sphere of a SphereArray; returns an (N,) int8
+        array of OUTSIDE, INTERSECT and INSIDE.'''
+        r = spheres.r
+
+        def radius(index, planes):
+            if planes is None:
+                return r[index, None]
+            return r[index]
+
+        return self._classify(spheres.c, radius, plane_mask, last_plane)
+
+    def test_aabbs(self, boxes, plane_mask=None, last_plane=None):
+        '''Classify every box of an AABB3Array; returns an (N,) int8 array
+        of OUTSIDE, INTERSECT and INSIDE.'''
+        center = boxes.center
+        extent = boxes.extent
+        n = np.abs(self._plane_arrays()[0])
+
+        def radius(index, planes):
+            # extent of the boxes projected onto the plane normals
+            if planes is None:
+                return extent[index].dot(n.T)
+            return np.einsum('ij,ij->i', extent[index], n[planes])
+
+        return self._classify(center, radius, plane_mask, last_plane)
+
+    def _classify(self, center, radius, plane_mask, last_plane):
+        # radius(index, planes) gives the radius of the objects index
+        # against one plane each, or against all six (broadcastable to
+        # (len(index), 6)) if planes is None.
+        N, K = self._plane_arrays()
+        count = len(center)
+        result = np.full(count, Frustum.INSIDE, dtype=np.int8)
+        index = np.arange(count)
+
+        if last_plane is not None:
+            cached = index[last_plane >= 0]
+            planes = last_plane[cached]
+            d = np.einsum('ij,ij->i', center[cached], N[planes]) - K[planes]
+            culled = d < -radius(cached, planes)
+            result[cached[culled]] = Frustum.OUTSIDE
+            index = index[result != Frustum.OUTSIDE]
+
+        planes = np.arange(6)
+        d = center[index].dot(N.T) - K
+        r = radius(index, None)
+        outside = d < -r
+        inside = d >= r
+        if plane_mask is not None:
+            active = (plane_mask[index, None] >> planes) & 1 == 1
+            outside &= active
+            inside &= active
+            plane_mask[index] &= ~(inside * (1 << planes)).sum(axis=1)
+            inside |= ~active
+
+        culled = outside.any(axis=1)
+        result[index[culled]] = Frustum.OUTSIDE
+        result[index[~culled & ~inside.all(axis=1)]] = Frustum.INTERSECT
+        if last_plane is not None:
+            last_plane[index] = -1
+            last_plane[index[culled]] = outside[culled].argmax(axis=1)
+        return result
+
+
+# Arrays
+# Contiguous numpy-backed containers for operating on many vectors at once.
+# ---------------------------------------------------------------------------
+
+def _require_numpy():
+    if np is None:
+        raise ImportError('numpy is required for the euclid array types')
+
+
+def _as_vector3_data(data, dtype=None):
+    # Accepts another array, a sequence of Vector3, an (N, 3) array-like or
+    # a flat (3N,) buffer such as the vertex lists built by Torus.
+    if isinstance(data, Vector3Array):
+        data = data.data
+    elif isinstance(data, (list, tuple)) and data and \
+            isinstance(data[0], Vector3):
+        data = [(v.x, v.y, v.z) for v in data]
+    if dtype is None:
+        # keep float32 and other float buffers as they are
+        data = np.asarray(data)
+        if data.dtype.kind != 'f':
+            data = data.astype(np.float64)
+    else:
+        data = np.asarray(data, dtype=dtype)
+    if data.ndim == 1 and data.size % 3 == 0:
+        data = data.reshape(-1, 3)
+    if data.ndim != 2 or data.shape[1] != 3:
+        raise ValueError('expected an (N, 3) array, got shape %r' %
+                         (data.shape,))
+    return data
+
+
+def _vector3_operand(other, dtype=None):
+    # dtype is that of the array operated on, so that a single Vector3 does
+    # not promote a float32 array to float64.
+    if isinstance(other, Vector3Array):
+        return other.data
+    elif isinstance(other, Vector3):
+        return np.array((other.x, other.y, other.z),
+                        dtype=dtype or np.float64)
+    return other
+
+
+def _scalar_operand(other, dtype=None):
+    # 1-d arrays hold one scalar per element and must broadcast over rows.
+    if isinstance(other, np.ndarray) and other.ndim == 1:
+        return other[:, None]
+    return _vector3_operand(other, dtype)
+
+
+def _transform_array(src, R, t, w, out, cls):
+    # src * R^T + t, divided by the homogeneous coordinate computed from the
+    # bottom matrix row w if given.
+    # The result has the dtype of src (float32 vertex buffers stay float32),
+    # so the matrix is cast to it rather than src to float64.
+    data = _as_vector3_data(src)
+    R = R.astype(data.dtype, copy=False)
+    if t is not None:
+        t = t.astype(data.dtype, copy=False)
+    target = out.data if isinstance(out, Vector3Array) else out
+    if w is not None:
+        w = w.astype(data.dtype, copy=False)
+        W = data.dot(w[:3]) + w[3]
+        W[W == 0] = 1
+    if target is None:
+        target = np.empty(data.shape, dtype=data.dtype)
+        np.matmul(data, R.T, out=target)
+    else:
+        np.matmul(data, R.T, out=target)
+    if t is not None:
+        target += t
+    if w is not None:
+        target /= W[:, None]
+    if out is not None:
+        return out
+    if isinstance(src, Vector3Array):
+        return cls(target)
+    return target
+
+
+class Vector3Array:
+    '''An array of 3-component vectors stored in one (N, 3) numpy array.
+
+    The array can be created from an element count (all zero), a list of
+    `Vector3`, another array or any (N, 3) array-like; arrays and ndarrays of
+    a matching dtype are wrapped without copying.  Without dtype, float
+    data keeps its dtype (float32 vertex buffers stay float32) and anything
+    else becomes float64.  Indexing returns a `Vector3`, slicing returns an
+    array sharing the same storage.
+
+    The operators also work with a `Vector3` or `Point3` on the left:
+
+    >>> Vector3(1., 1., 1.) + Vector3Array([(1., 2., 3.)])
+    Vector3Array([[2., 3., 4.]])
+    >>> Point3(1., 1., 1.) - Point3Array([(1., 2., 3.)])
+    Vector3Array([[ 0., -1., -2.]])
+    >>> Vector3(2., 2., 2.) * Vector3Array([(1., 2., 3.)])
+    Vector3Array([[2., 4., 6.]])
+    '''
+    __slots__ = ['data']
+    __hash__ = None
+
+    _element = Vector3
+
+    def __init__(self, data=0, dtype=None):
+        _require_numpy()
+        if isinstance(data, (int, long)):
+            self.data = np.zeros((data, 3), dtype=dtype or np.float64)
+        else:
+            self.data = _as_vector3_data(data, dtype)
+
+    def __copy__(self):
+        return self._wrap(self.data.copy())
+
+    copy = __copy__
+
+    def _wrap(self, data):
+        # an array of the same class around data, without conversion
+        result = self.__class__.__new__(self.__class__)
+        result.data = data
+        return result
+
+    def __repr__(self):
+        name = self.__class__.__name__
+        return '%s(%s)' % (name, np.array2string(self.data, precision=2,
+                                                 separator=', ',
+                                                 prefix=name + '(',
+                                                 threshold=12))
+
+    def __len__(self):
+        return len(self.data)
+
+    def __getitem__(self, key):
+        if isinstance(key, (int, long, np.integer)):
+            x, y, z = self.data[key].tolist()
+            return self._element(x, y, z)
+        return self._wrap(self.data[key])
+
+    def __setitem__(self, key, value):
+        self.data[key] = self._operand(value)
+
+    def __iter__(self):
+        element = self._element
+        for x, y, z in self.data.tolist():
+            yield element(x, y, z)
+
+    def __array__(self, dtype=None, copy=None):
+        if dtype is None:
+            return self.data
+        return self.data.astype(dtype)
+
+    def _get_component(index):
+        def fget(self):
+            return self.data[:, index]
+
+        def fset(self, value):
+            self.data[:, index] = value
+
+        return property(fget, fset)
+
+    x = _get_component(0)
+    y = _get_component(1)
+    z = _get_component(2)
+
+    del _get_component
+
+    def _operand(self, other):
+        return _vector3_operand(other, self.data.dtype)
+
+    def _result_class(self, other):
+        # Same rules as Vector3.__add__: vector + vector -> vector,
+        # vector + point -> point, point + point -> vector.  Raw numbers and
+        # ndarrays keep the class of self.
+        if isinstance(other, (Vector3Array, Vector3)):
+            if isinstance(self, Point3Array) == \
+                    isinstance(other, (Point3Array, Point3)):
+                return Vector3Array
+            return Point3Array
+        return self.__class__
+
+    def __add__(self, other):
+        return self._result_class(other)(self.data + self._operand(other))
+
+    __radd__ = __add__
+
+    def __iadd__(self, other):
+        self.data += self._operand(other)
+        return self
+
+    def __sub__(self, other):
+        return self._result_class(other)(self.data - self._operand(other))
+
+    def __rsub__(self, other):
+        return self._result_class(other)(self._operand(other) - self.data)
+
+    def __isub__(self, other):
+        self.data -= self._operand(other)
+        return self
+
+    def __mul__(self, other):
+        return self.__class__(self.data *
+                              _scalar_operand(other, self.data.dtype))
+
+    __rmul__ = __mul__
+
+    def __imul__(self, other):
+        self.data *= _scalar_operand(other, self.data.dtype)
+        return self
+
+    def __truediv__(self, other):
+        return self.__class__(self.data /
+                              _scalar_operand(other, self.data.dtype))
+
+    def __itruediv__(self, other):
+        self.data /= _scalar_operand(other, self.data.dtype)
+        return self
+
+    def __neg__(self):
+        return self.__class__(-self.data)
+
+    __pos__ = __copy__
+
+    def __abs__(self):
+        return np.sqrt(self.magnitude_squared())
+
+    magnitude = __abs__
+
+    def magnitude_squared(self):
+        data = self.data
+        return np.einsum('ij,ij->i', data, data)
+
+    def normalize(self):
+        d = self.magnitude()
+        # Zero-length vectors are left unchanged, as with Vector3.
+        d[d == 0] = 1
+        self.data /= d[:, None]
+        return self
+
+    def normalized(self):
+        return self.copy().normalize()
+
+    def dot(self, other):
+        other = np.asarray(self._operand(other))
+        if other.ndim == 1:
+            return self.data.dot(other)
+        return np.einsum('ij,ij->i', self.data, other)
+
+    def cross(self, other):
+        return Vector3Array(np.cross(self.data, self._operand(other)))
+
+    def _apply_transform(self, t):
+        if isinstance(t, Quaternion):
+            t = t.get_matrix()
+        t.transform_vectors(self, out=self)
+
+
+class Point3Array(Vector3Array):
+    '''An array of points; indexing returns `Point3`.'''
+    __slots__ = []
+
+    _element = Point3
+
+    def _apply_transform(self, t):
+        if isinstance(t, Quaternion):
+            t = t.get_matrix()
+        t.transform_points(self, out=self)
+
+
+def _as_quaternion_data(data):
+    # Accepts a QuaternionArray, a single Quaternion (as one row that
+    # broadcasts against arrays), a list of Quaternion or an (N, 4) array of
+    # (w, x, y, z).
+    if isinstance(data, QuaternionArray):
+        return data.data
+    elif isinstance(data, Quaternion):
+        return np.array(((data.w, data.x, data.y, data.z),))
+    elif isinstance(data, (list, tuple)) and data and \
+            isinstance(data[0], Quaternion):
+        data = [(q.w, q.x, q.y, q.z) for q in data]
+    data = np.asarray(data, dtype=np.float64)
+    if data.ndim != 2 or data.shape[1] != 4:
+        raise ValueError('expected an (N, 4) array of (w, x, y, z), '
+                         'got shape %r' % (data.shape,))
+    return data
+
+
+class Matrix4Array:
+    '''An array of 4x4 matrices stored in one (N, 4, 4) numpy array.
+
+    ``data[n]`` holds matrix n in row-major order, i.e. ``data[n, 0]`` is
+    the row a b c d.  Products, inverses and transposes are computed for all
+    matrices at once; `column_major` packs the array into the layout OpenGL
+    expects for uniform arrays and instance buffers.
+    '''
+    __slots__ = ['data']
+    __hash__ = None
+
+    def __init__(self, data=0, dtype=None):
+        _require_numpy()
+        if isinstance(data, (int, long)):
+            self.data = np.zeros((data, 4, 4), dtype=dtype or np.float64)
+            self.data[:] = np.eye(4)
+            return
+        if isinstance(data, Matrix4Array):
+            data = data.data
+        elif isinstance(data, (list, tuple)) and data and \
+                isinstance(data[0], Matrix4):
+            data = [((M.a, M.b, M.c, M.d),
+                     (M.e, M.f, M.g, M.h),
+                     (M.i, M.j, M.k, M.l),
+                     (M.m, M.n, M.o, M.p)) for M in data]
+        data = np.asarray(data, dtype=dtype or np.float64)
+        if data.ndim != 3 or data.shape[1:] != (4, 4):
+            raise ValueError('expected an (N, 4, 4) array, got shape %r' %
+                             (data.shape,))
+        self.data = data
+
+    def __copy__(self):
+        return self.__class__(self.data.copy())
+
+    copy = __copy__
+
+    def __repr__(self):
+        return 'Matrix4Array(<%d matrices>)' % len(self.data)
+
+    def __len__(self):
+        return len(self.data)
+
+    def __getitem__(self, key):
+        if isinstance(key, (int, long, np.integer)):
+            M = Matrix4()
+            (M.a, M.b, M.c, M.d,
+             M.e, M.f, M.g, M.h,
+             M.i, M.j, M.k, M.l,
+             M.m, M.n, M.o, M.p) = self.data[key].ravel().tolist()
+            return M
+        return self.__class__(self.data[key])
+
+    def __setitem__(self, key, value):
+        if isinstance(value, Matrix4):
+            value = value._rows()
+        elif isinstance(value, Matrix4Array):
+            value = value.data
+        self.data[key] = value
+
+    def __iter__(self):
+        for i in range(len(self.data)):
+            yield self[i]
+
+    def __array__(self, dtype=None, copy=None):
+        if dtype is None:
+            return self.data
+        return self.data.astype(dtype)
+
+    def __mul__(self, other):
+        # Element-wise product with another array of the same length, or
+        # every matrix times a single Matrix4.
+        if isinstance(other, Matrix4Array):
+            return Matrix4Array(np.matmul(self.data, other.data))
+        elif isinstance(other, Matrix4):
+            return Matrix4Array(np.matmul(self.data, other._rows()))
+        return NotImplemented
+
+    def __imul__(self, other):
+        if isinstance(other, Matrix4Array):
+            np.matmul(self.data, other.data, out=self.data)
+        else:
+            assert isinstance(other, Matrix4)
+            np.matmul(self.data, other._rows(), out=self.data)
+        return self
+
+    def _apply_transform(self, t):
+        # Matrix4 * Matrix4Array premultiplies every matrix.
+        if isinstance(t, Quaternion):
+            t = t.get_matrix()
+        np.matmul(t._rows(), self.data, out=self.data)
+
+    def identity(self):
+        self.data[:] = np.eye(4)
+        return self
+
+    def transpose(self):
+        self.data[:] = self.data.transpose(0, 2, 1).copy()
+        return self
+
+    def transposed(self):
+        return Matrix4Array(self.data.transpose(0, 2, 1).copy())
+
+    def determinant(self):
+        return np.linalg.det(self.data)
+
+    def inverse(self, epsilon=None):
+        # As with Matrix4.inverse, singular matrices invert to identity.
+        if epsilon is None:
+            epsilon = _inverse_epsilon
+        result = Matrix4Array(len(self.data), dtype=self.data.dtype)
+        invertible = np.abs(self.determinant()) >= epsilon
+        result.data[invertible] = np.linalg.inv(self.data[invertible])
+        return result
+
+    def normal_matrices(self, epsilon=None):
+        '''Return the normal matrices (see `Matrix4.normal_matrix`) of all
+        matrices as an (N, 3, 3) array in row-major order.  Matrices with a
+        singular 3x3 part give identity.
+        '''
+        if epsilon is None:
+            epsilon = _inverse_epsilon
+        rows = self.data[:, :3, :3]
+        # The rows of the cofactor matrix are cross products of the rows.
+        cofactors = np.empty_like(rows)
+        cofactors[:, 0] = np.cross(rows[:, 1], rows[:, 2])
+        cofactors[:, 1] = np.cross(rows[:, 2], rows[:, 0])
+        cofactors[:, 2] = np.cross(rows[:, 0], rows[:, 1])
+        det = np.einsum('ij,ij->i', rows[:, 0], cofactors[:, 0])
+        singular = np.abs(det) < epsilon
+        det[singular] = 1
+        cofactors /= det[:, None, None]
+        cofactors[singular] = np.eye(3)
+        return cofactors
+
+    def column_major(self, dtype=np.float32, out=None):
+        '''Return the matrices as a contiguous (N, 16) buffer in OpenGL
+        (column-major) order, e.g. for glUniformMatrix4fv or an instance
+        buffer.  out may be a preallocated C-contiguous (N, 16) buffer to
+        reuse across frames.
+        '''
+        if out is None:
+            out = np.empty((len(self.data), 16), dtype=dtype)
+        elif out.shape != (len(self.data), 16) or \
+                not out.flags.c_contiguous:
+            # reshaping anything else would copy and drop the result
+            raise ValueError('expected a C-contiguous (%d, 16) array for '
+                             'out, got shape %r' % (len(self.data),
+                                                   out.shape))
+        np.copyto(out.reshape(-1, 4, 4), self.data.transpose(0, 2, 1),
+                  casting='unsafe')
+        return out
+
+    # Static constructors
+    def new_identity(cls, count):
+        return cls(count)
+
+    new_identity = classmethod(new_identity)
+
+    def new_trs(cls, translations, rotations, scales=None):
+        '''Build translate * rotate * scale matrices for many objects.
+
+        translations is a Vector3Array or (N, 3) array-like, rotations a list
+        of Quaternion or (N, 4) array of (w, x, y, z) and scales either None,
+        a number, one uniform scale per object or an (N, 3) array-like.
+        '''
+        t = _as_vector3_data(translations)
+        q = _as_quaternion_data(rotations)
+        w, x, y, z = q.T
+        xx = x * x
+        xy = x * y
+        xz = x * z
+        xw = x * w
+        yy = y * y
+        yz = y * z
+        yw = y * w
+        zz = z * z
+        zw = z * w
+
+        self = cls(len(t))
+        M = self.data
+        M[:, 0, 0] = 1 - 2 * (yy + zz)
+        M[:, 0, 1] = 2 * (xy - zw)
+        M[:, 0, 2] = 2 * (xz + yw)
+        M[:, 1, 0] = 2 * (xy + zw)
+        M[:, 1, 1] = 1 - 2 * (xx + zz)
+        M[:, 1, 2] = 2 * (yz - xw)
+        M[:, 2, 0] = 2 * (xz - yw)
+        M[:, 2, 1] = 2 * (yz + xw)
+        M[:, 2, 2] = 1 - 2 * (xx + yy)
+        if scales is not None:
+            scales = np.asarray(scales, dtype=np.float64)
+            if scales.ndim == 1:
+                scales = scales[:, None, None]
+            elif scales.ndim == 2:
+                scales = scales[:, None, :]
+            M[:, :3, :3] *= scales
+        M[:, :3, 3] = t
+        return self
+
+    new_trs = classmethod(new_trs)
+
+
+def _quaternion_product(A, B):
+    # Row-wise Hamilton product of (N, 4) arrays, as Quaternion.__mul__.
+    Aw, Ax, Ay, Az = A.T
+    Bw, Bx, By, Bz = B.T
+    return np.stack((-Ax * Bx - Ay * By - Az * Bz + Aw * Bw,
+                     Ax * Bw + Ay * Bz - Az * By + Aw * Bx,
+                     -Ax * Bz + Ay * Bw + Az * Bx + Aw * By,
+                     Ax * By - Ay * Bx + Az * Bw + Aw * Bz), axis=-1)
+
+
+class QuaternionArray:
+    '''An array of quaternions stored in one (N, 4) numpy array of
+    (w, x, y, z) rows.
+
+    The methods and constructors mirror `Quaternion` and give the same
+    results for every element, which makes it suitable for animating many
+    nodes at once.  Indexing returns a `Quaternion`.
+    '''
+    __slots__ = ['data']
+    __hash__ = None
+
+    def __init__(self, data=0):
+        _require_numpy()
+        if isinstance(data, (int, long)):
+            self.data = np.zeros((data, 4))
+            self.data[:, 0] = 1
+        else:
+            self.data = _as_quaternion_data(data)
+
+    def __copy__(self):
+        return self.__class__(self.data.copy())
+
+    copy = __copy__
+
+    def __repr__(self):
+        return 'QuaternionArray(<%d quaternions>)' % len(self.data)
+
+    def __len__(self):
+        return len(self.data)
+
+    def __getitem__(self, key):
+        if isinstance(key, (int, long, np.integer)):
+            return Quaternion(*self.data[key].tolist())
+        return self.__class__(self.data[key])
+
+    def __setitem__(self, key, value):
+        if isinstance(value, Quaternion):
+            value = (value.w, value.x, value.y, value.z)
+        elif isinstance(value, QuaternionArray):
+            value = value.data
+        self.data[key] = value
+
+    def __iter__(self):
+        for w, x, y, z in self.data.tolist():
+            yield Quaternion(w, x, y, z)
+
+    def __array__(self, dtype=None, copy=None):
+        if dtype is None:
+            return self.data
+        return self.data.astype(dtype)
+
+    w = property(lambda self: self.data[:, 0])
+    x = property(lambda self: self.data[:, 1])
+    y = property(lambda self: self.data[:, 2])
+    z = property(lambda self: self.data[:, 3])
+
+    def __mul__(self, other):
+        if isinstance(other, (QuaternionArray, Quaternion)):
+            return QuaternionArray(_quaternion_product(
+                self.data, _as_quaternion_data(other)))
+        elif isinstance(other, Vector3Array):
+            other = other.copy()
+            M = self.get_matrix().data
+            other.data[:] = np.einsum('nij,nj->ni', M[:, :3, :3], other.data)
+            return other
+        return NotImplemented
+
+    def __imul__(self, other):
+        self.data[:] = _quaternion_product(self.data,
+                                           _as_quaternion_data(other))
+        return self
+
+    def _apply_transform(self, t):
+        # Quaternion * QuaternionArray
+        self.data[:] = _quaternion_product(_as_quaternion_data(t), self.data)
+
+    def __abs__(self):
+        return np.sqrt(self.magnitude_squared())
+
+    magnitude = __abs__
+
+    def magnitude_squared(self):
+        return np.einsum('ij,ij->i', self.data, self.data)
+
+    def identity(self):
+        self.data[:] = (1, 0, 0, 0)
+        return self
+
+    def conjugated(self):
+        return QuaternionArray(self.data * (1, -1, -1, -1))
+
+    def normalize(self):
+        d = self.magnitude()
+        d[d == 0] = 1
+        self.data /= d[:, None]
+        return self
+
+    def normalized(self):
+        return self.copy().normalize()
+
+    def get_matrix(self):
+        '''Return the rotation matrices as a Matrix4Array.'''
+        return Matrix4Array.new_trs(np.zeros((len(self.data), 3)), self.data)
+
+    def get_euler(self):
+        '''Return (heading, attitude, bank) arrays, as Quaternion.get_euler.
+        '''
+        w, x, y, z = self.data.T
+        t = x * y + z * w
+        heading = np.arctan2(2 * y * w - 2 * x * z,
+                             1 - 2 * y ** 2 - 2 * z ** 2)
+        attitude = np.arcsin(np.clip(2 * t, -1, 1))
+        bank = np.arctan2(2 * x * w - 2 * y * z,
+                          1 - 2 * x ** 2 - 2 * z ** 2)
+        # Gimbal lock at the poles
+        north = t > 0.4999
+        south = t < -0.4999
+        heading[north] = 2 * np.arctan2(x[north], w[north])
+        heading[south] = -2 * np.arctan2(x[south], w[south])
+        attitude[north] = math.pi / 2
+        attitude[south] = -math.pi / 2
+        bank[north | south] = 0
+        return heading, attitude, bank
+
+    # Static constructors
+    def new_identity(cls, count):
+        return cls(count)
+
+    new_identity = classmethod(new_identity)
+
+    def new_rotate_axis(cls, angles, axes):
+        axes = Vector3Array(axes).normalized().data
+        half = np.asarray(angles, dtype=np.float64) / 2
+        s = np.sin(half)
+        data = np.empty((len(axes), 4))
+        data[:, 0] = np.cos(half)
+        data[:, 1:] = axes * s[..., None]
+        return cls(data)
+
+    new_rotate_axis = classmethod(new_rotate_axis)
+
+    def new_rotate_euler(cls, heading, attitude, bank):
+        '''Build quaternions from arrays of Euler angles (or numbers, which
+        broadcast), as Quaternion.new_rotate_euler.
+        '''
+        heading, attitude, bank = np.broadcast_arrays(
+            np.asarray(heading, dtype=np.float64) / 2,
+            np.asarray(attitude, dtype=np.float64) / 2,
+            np.asarray(bank, dtype=np.float64) / 2)
+        c1 = np.cos(heading)
+        s1 = np.sin(heading)
+        c2 = np.cos(attitude)
+        s2 = np.sin(attitude)
+        c3 = np.cos(bank)
+        s3 = np.sin(bank)
+        return cls(np.stack((c1 * c2 * c3 - s1 * s2 * s3,
+                             s1 * s2 * c3 + c1 * c2 * s3,
+                             s1 * c2 * c3 + c1 * s2 * s3,
+                             c1 * s2 * c3 - s1 * c2 * s3), axis=-1))
+
+    new_rotate_euler = classmethod(new_rotate_euler)
+
+    def new_interpolate(cls, q1, q2, t):
+        '''Spherical linear interpolation between q1 and q2 at t.
+
+        q1 and q2 are QuaternionArrays, lists of Quaternion or single
+        Quaternions, t an array or a number.  The special cases of
+        Quaternion.new_interpolate are kept so results match the scalar
+        code: if the quaternions are more than 90 degrees apart q1 is
+        conjugated, below 0.01 radians q2 is returned and the midpoint is
+        returned when sin(theta) is below 0.01.
+
+        A single pair at many t gives one quaternion per t:
+
+        >>> q = Quaternion.new_rotate_axis(math.pi / 2, Vector3(0., 0., 1.))
+        >>> len(QuaternionArray.new_interpolate(Quaternion(), q, [0., .5, 1.]))
+        3
+        '''
+        # one row per result, so the masks below line up with data when a
+        # single pair is interpolated at many t
+        q1, q2, t = np.broadcast_arrays(
+            _as_quaternion_data(q1), _as_quaternion_data(q2),
+            np.asarray(t, dtype=np.float64)[..., None])
+        t = t[:, 0]
+
+        costheta = np.einsum('ij,ij->i', q1, q2)
+        flip = costheta < 0
+        q1 = np.where(flip[:, None], q1 * (1, -1, -1, -1), q1)
+        costheta = np.minimum(np.abs(costheta), 1)
+
+        theta = np.arccos(costheta)
+        sintheta = np.sqrt(1.0 - costheta * costheta)
+        midpoint = sintheta < 0.01
+        sintheta[midpoint] = 1
+        ratio1 = np.sin((1 - t) * theta) / sintheta
+        ratio2 = np.sin(t * theta) / sintheta
+        data = q1 * ratio1[:, None] + q2 * ratio2[:, None]
+
+        data[midpoint] = ((q1 + q2) * 0.5)[midpoint]
+        close = theta < 0.01
+        data[close] = q2[close]
+        return cls(data)
+
+    new_interpolate = classmethod(new_interpolate)
+
+    def new_nlerp(cls, q1, q2, t):
+        '''Normalized linear interpolation between q1 and q2 at t, a cheaper
+        approximation of `new_interpolate` with non-uniform speed.  q2 is
+        negated where needed so the shorter arc is taken.
+        '''
+        q1 = _as_quaternion_data(q1)
+        q2 = _as_quaternion_data(q2)
+        t = np.asarray(t, dtype=np.float64)[..., None]
+        costheta = np.einsum('ij,ij->i', *np.broadcast_arrays(q1, q2))
+        q2 = np.where(costheta[:, None] < 0, -q2, q2)
+        return cls(q1 * (1 - t) + q2 * t).normalize()
+
+    new_nlerp = classmethod(new_nlerp)
+
+
+def _as_scalar_data(data, count=None):
+    data = np.asarray(data, dtype=np.float64)
+    if data.ndim == 0 and count is not None:
+        data = np.full(count, data)
+    if data.ndim != 1:
+        raise ValueError('expected an (N,) array, got shape %r' %
+                         (data.shape,))
+    return data
+
+
+def _line3_operand(L):
+    # (p, v, lo, hi) of a Line3 or Line3Array; a single line becomes one row
+    # that broadcasts against the shape arrays.
+    if isinstance(L, Line3):
+        return (np.array(((L.p.x, L.p.y, L.p.z),)),
+                np.array(((L.v.x, L.v.y, L.v.z),))) + L._u_range
+    return (L.p, L.v) + L._u_range
+
+
+def _intersect_line3_sphere_array(p, v, lo, hi, c, r):
+    # Rows of p, v and c, r broadcast against each other.  Same quadratic as
+    # _intersect_line3_sphere, solved for all rows at once.
+    m = p - c
+    a = np.einsum('ij,ij->i', v, v)
+    b = np.einsum('ij,ij->i', *np.broadcast_arrays(m, v))
+    cc = np.einsum('ij,ij->i', m, m) - r * r
+    det = b * b - a * cc
+    with np.errstate(invalid='ignore', divide='ignore'):
+        sq = np.sqrt(det)
+        near = (-b - sq) / a
+        far = (-b + sq) / a
+    hit = (det >= 0) & (far >= lo) & (near <= hi)
+    np.clip(near, lo, hi, out=near)
+    np.clip(far, lo, hi, out=far)
+    return hit, near, far
+
+
+def _intersect_line3_plane_array(p, v, lo, hi, n, k):
+    d = np.einsum('ij,ij->i', *np.broadcast_arrays(n, v))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        u = (k - np.einsum('ij,ij->i', *np.broadcast_arrays(n, p))) / d
+    hit = (d != 0) & (u >= lo) & (u <= hi)
+    return hit, u
+
+
+class Line3Array:
+    '''N lines stored as (N, 3) arrays of start points p and directions v,
+    the batched counterpart of `Line3`; a point on line i is p[i] + u v[i].
+
+    The intersect methods take one `Sphere`/`Plane` or a `SphereArray`/
+    `PlaneArray` of the same length and test row against row.  Going the
+    other way, `SphereArray.intersect` tests N shapes against one line.
+    '''
+    __slots__ = ['p', 'v']
+
+    _element = Line3
+    _u_range = Line3._u_range
+
+    def __init__(self, p, v):
+        _require_numpy()
+        self.p = _as_vector3_data(p)
+        self.v = _as_vector3_data(v)
+
+    def new_from_lines(cls, lines):
+        '''Pack a sequence of Line3 (or subclass) objects.'''
+        return cls([L.p for L in lines], [L.v for L in lines])
+
+    new_from_lines = classmethod(new_from_lines)
+
+    def __copy__(self):
+        return self.__class__(self.p.copy(), self.v.copy())
+
+    copy = __copy__
+
+    def __repr__(self):
+        return '%s(<%d lines>)' % (self.__class__.__name__, len(self.p))
+
+    def __len__(self):
+        return len(self.p)
+
+    def __getitem__(self, key):
+        if isinstance(key, (int, long, np.integer)):
+            return self._element(Point3(*self.p[key].tolist()),
+                                 Vector3(*self.v[key].tolist()))
+        return self.__class__(self.p[key], self.v[key])
+
+    def __iter__(self):
+        for i in range(len(self.p)):
+            yield self[i]
+
+    def _u_in(self, u):
+        lo, hi = self._u_range
+        return (u >= lo) & (u <= hi)
+
+    def point_at(self, u):
+        '''Return the points p + u v as an (N, 3) array.'''
+        return self.p + np.asarray(u)[..., None] * self.v
+
+    def intersect_sphere(self, sphere):
+        '''Intersect every line with a sphere.
+
+        Returns (hit, near, far): a boolean mask and the parameters of the
+        entry and exit points.  As in the scalar code, parameters outside
+        the line's valid range (u >= 0 for rays, 0 <= u <= 1 for segments)
+        are clamped to it; hit is False where the line misses the sphere or
+        the intersection lies entirely outside that range.
+        '''
+        c, r = _sphere_operand(sphere)
+        return _intersect_line3_sphere_array(self.p, self.v,
+                                             self._u_range[0],
+                                             self._u_range[1], c, r)
+
+    def intersect_plane(self, plane):
+        '''Intersect every line with a plane.
+
+        Returns (hit, u); u is only meaningful where hit is set, lines
+        parallel to the plane never hit.
+        '''
+        n, k = _plane_operand(plane)
+        return _intersect_line3_plane_array(self.p, self.v,
+                                            self._u_range[0],
+                                            self._u_range[1], n, k)
+
+
+class Ray3Array(Line3Array):
+    _element = Ray3
+    _u_range = Ray3._u_range
+
+
+class LineSegment3Array(Line3Array):
+    _element = LineSegment3
+    _u_range = LineSegment3._u_range
+
+    def new_from_points(cls, p1, p2):
+        p1 = _as_vector3_data(p1)
+        return cls(p1, _as_vector3_data(p2) - p1)
+
+    new_from_points = classmethod(new_from_points)
+
+    def clip(self, plane):
+        '''Clip every segment to the side of plane its normal points to
+        (n.p >= k).  plane is a Plane or a PlaneArray of the same length.
+
+        Returns (segments, index): the remaining parts as a new
+        LineSegment3Array and the indices of the segments they come from.
+        '''
+        n, k = _plane_operand(plane)
+        n, p = np.broadcast_arrays(n, self.p)
+        k = np.broadcast_to(k, len(p))
+        d1 = np.einsum('ij,ij->i', n, p) - k
+        d2 = d1 + np.einsum('ij,ij->i', n, self.v)
+        index = np.flatnonzero((d1 >= 0) | (d2 >= 0))
+        d1 = d1[index]
+        d2 = d2[index]
+        p = self.p[index]
+        v = self.v[index]
+        # parameter where the segment crosses the plane; only used where
+        # exactly one end is cut off, so the division is safe there
+        with np.errstate(divide='ignore', invalid='ignore'):
+            u = d1 / (d1 - d2)
+        u0 = np.where(d1 < 0, u, 0.0)
+        u1 = np.where(d2 < 0, u, 1.0)
+        return (self.__class__(p + u0[:, None] * v, (u1 - u0)[:, None] * v),
+                index)
+
+
+def _intersect_line3_aabb3_array(p, v, lo, hi, bmin, bmax):
+    # Slab test.  Returns (hit, near, far), the parameters where the lines
+    # enter and leave the boxes clamped to [lo, hi] (so a ray starting
+    # inside enters at 0).  Zero direction components are nudged so the
+    # slabs stay well defined for lines lying in a box face.
+    v = np.where(v == 0, 1e-300, v)
+    with np.errstate(over='ignore'):
+        t1 = (bmin - p) / v
+        t2 = (bmax - p) / v
+    near = np.minimum(t1, t2).max(axis=1)
+    far = np.maximum(t1, t2).min(axis=1)
+    hit = (far >= near) & (far >= lo) & (near <= hi)
+    return hit, np.maximum(near, lo), np.minimum(far, hi)
+
+
+def _sphere_operand(S):
+    if isinstance(S, Sphere):
+        return np.array(((S.c.x, S.c.y, S.c.z),)), S.r
+    return S.c, S.r
+
+
+def _plane_operand(P):
+    if isinstance(P, Plane):
+        return np.array(((P.n.x, P.n.y, P.n.z),)), P.k
+    return P.n, P.k
+
+
+class SphereArray:
+    '''N spheres stored as an (N, 3) array of centers c and an (N,) array
+    of radii r.'''
+    __slots__ = ['c', 'r']
+
+    def __init__(self, center, radius):
+        _require_numpy()
+        self.c = _as_vector3_data(center)
+        self.r = _as_scalar_data(radius, len(self.c))
+
+    def new_from_spheres(cls, spheres):
+        return cls([S.c for S in spheres], [S.r for S in spheres])
+
+    new_from_spheres = classmethod(new_from_spheres)
+
+    def __copy__(self):
+        return self.__class__(self.c.copy(), self.r.copy())
+
+    copy = __copy__
+
+    def __repr__(self):
+        return 'SphereArray(<%d spheres>)' % len(self.c)
+
+    def __len__(self):
+        return len(self.c)
+
+    def __getitem__(self, key):
+        if isinstance(key, (int, long, np.integer)):
+            return Sphere(Point3(*self.c[key].tolist()), float(self.r[key]))
+        return self.__class__(self.c[key], self.r[key])
+
+    def __iter__(self):
+        for i in range(len(self.c)):
+            yield self[i]
+
+    def _apply_transform(self, t):
+        self.c = t.transform_points(self.c)
+
+    def intersect(self, line):
+        '''Intersect every sphere with one Line3, Ray3 or LineSegment3 (or a
+        Line3Array of the same length).  See `Line3Array.intersect_sphere`.
+        '''
+        p, v, lo, hi = _line3_operand(line)
+        return _intersect_line3_sphere_array(p, v, lo, hi, self.c, self.r)
+
+
+class PlaneArray:
+    '''N planes n.p = k stored as an (N, 3) array of unit normals n and an
+    (N,) array of constants k.'''
+    __slots__ = ['n', 'k']
+
+    def __init__(self, normal, constant):
+        _require_numpy()
+        n = _as_vector3_data(normal)
+        d = np.sqrt(np.einsum('ij,ij->i', n, n))
+        if not d.all():
+            raise AttributeError('Plane normal has zero length')
+        self.n = n / d[:, None]
+        self.k = _as_scalar_data(constant, len(n))
+
+    def new_from_planes(cls, planes):
+        return cls([P.n for P in planes], [P.k for P in planes])
+
+    new_from_planes = classmethod(new_from_planes)
+
+    def __copy__(self):
+        return self.__class__(self.n.copy(), self.k.copy())
+
+    copy = __copy__
+
+    def __repr__(self):
+        return 'PlaneArray(<%d planes>)' % len(self.n)
+
+    def __len__(self):
+        return len(self.n)
+
+    def __getitem__(self, key):
+        if isinstance(key, (int, long, np.integer)):
+            return Plane(Vector3(*self.n[key].tolist()), float(self.k[key]))
+        P = self.__class__.__new__(self.__class__)
+        P.n = self.n[key]
+        P.k = self.k[key]
+        return P
+
+    def __iter__(self):
+        for i in range(len(self.n)):
+            yield self[i]
+
+    def intersect(self, line):
+        '''Intersect every plane with one line (or a Line3Array of the same
+        length).  See `Line3Array.intersect_plane`.
+        '''
+        p, v, lo, hi = _line3_operand(line)
+        return _intersect_line3_plane_array(p, v, lo, hi, self.n, self.k)
+
+
+def _aabb3_operand(B):
+    if isinstance(B, AABB3):
+        return (np.array(((B.minimum.x, B.minimum.y, B.minimum.z),)),
+                np.array(((B.maximum.x, B.maximum.y, B.maximum.z),)))
+    return B.minimum, B.maximum
+
+
+class AABB3Array:
+    '''N axis aligned boxes stored as (N, 3) arrays of minimum and maximum
+    corners.
+
+    Transforming the array by a Matrix4 replaces every box by the box
+    bounding its transformed self, using the same centre and extent form as
+    AABB3 for all rows at once.
+    '''
+    __slots__ = ['minimum', 'maximum']
+
+    def __init__(self, minimum, maximum):
+        _require_numpy()
+        minimum = _as_vector3_data(minimum)
+        maximum = _as_vector3_data(maximum)
+        self.minimum = np.minimum(minimum, maximum)
+        self.maximum = np.maximum(minimum, maximum)
+
+    def new_from_aabbs(cls, boxes):
+        return cls([B.minimum for B in boxes], [B.maximum for B in boxes])
+
+    new_from_aabbs = classmethod(new_from_aabbs)
+
+    def new_from_spheres(cls, spheres):
+        '''Boxes around a SphereArray or a list of Sphere.'''
+        if not isinstance(spheres, SphereArray):
+            spheres = SphereArray.new_from_spheres(spheres)
+        r = spheres.r[:, None]
+        return cls(spheres.c - r, spheres.c + r)
+
+    new_from_spheres = classmethod(new_from_spheres)
+
+    def __copy__(self):
+        return self.__class__(self.minimum.copy(), self.maximum.copy())
+
+    copy = __copy__
+
+    def __repr__(self):
+        return 'AABB3Array(<%d boxes>)' % len(self.minimum)
+
+    def __len__(self):
+        return len(self.minimum)
+
+    def __getitem__(self, key):
+        if isinstance(key, (int, long, np.integer)):
+            return AABB3(Point3(*self.minimum[key].tolist()),
+                         Point3(*self.maximum[key].tolist()))
+        B = self.__class__.__new__(self.__class__)
+        B.minimum = self.minimum[key]
+        B.maximum = self.maximum[key]
+        return B
+
+    def __iter__(self):
+        for i in range(len(self.minimum)):
+            yield self[i]
+
+    center = property(lambda self: (self.minimum + self.maximum) * 0.5)
+    extent = property(lambda self: (self.maximum - self.minimum) * 0.5)
+
+    def merge(self):
+        '''Return the AABB3 around all boxes.'''
+        if not len(self.minimum):
+            return AABB3.new_empty()
+        return AABB3(Point3(*self.minimum.min(axis=0).tolist()),
+                     Point3(*self.maximum.max(axis=0).tolist()))
+
+    def _apply_transform(self, t):
+        if isinstance(t, Quaternion):
+            t = t.get_matrix()
+        M = t._rows()
+        c = self.center.dot(M[:3, :3].T) + M[:3, 3]
+        e = self.extent.dot(np.abs(M[:3, :3]).T)
+        self.minimum = c - e
+        self.maximum = c + e
+
+    def contains(self, points):
+        '''Mask of the boxes containing a point, or of each box containing
+        the point of the same row of a Point3Array or (N, 3) array.'''
+        if isinstance(points, Vector3):
+            points = np.array(((points.x, points.y, points.z),))
+        else:
+            points = _as_vector3_data(points)
+        return ((self.minimum <= points) & (points <= self.maximum)).all(
+            axis=1)
+
+    def overlaps(self, other):
+        '''Mask of the boxes overlapping other, an AABB3, Sphere or an
+        AABB3Array or SphereArray of the same length.'''
+        if isinstance(other, (Sphere, SphereArray)):
+            c, r = _sphere_operand(other)
+            d = np.minimum(np.maximum(c, self.minimum), self.maximum) - c
+            return _rows_dot(d, d) <= r * r
+        bmin, bmax = _aabb3_operand(other)
+        return ((self.minimum <= bmax) & (bmin <= self.maximum)).all(axis=1)
+
+    def intersect(self, line):
+        '''Intersect every box with one Line3, Ray3 or LineSegment3 (or a
+        Line3Array of the same length).
+
+        Returns (hit, near, far), the line parameters where the line enters
+        and leaves each box; they are only meaningful where hit is set.
+        '''
+        p, v, lo, hi = _line3_operand(line)
+        return _intersect_line3_aabb3_array(p, v, lo, hi, self.minimum,
+                                            self.maximum)
+
+
+# Batched distances, the array counterparts of the _distance_squared
+# functions.  Operands are (N, 3) arrays (or single rows that broadcast).
+
+def _rows_dot(a, b):
+    a, b = np.broadcast_arrays(a, b)
+    return np.einsum('ij,ij->i', a, b)
+
+
+def _distance_squared_surface_array(d2, r):
+    return np.where(d2 > 0, (np.sqrt(d2) - r) ** 2, 0.0)
+
+
+def _closest_u_array(p, v, lo, hi, x):
+    u = _rows_dot(x - p, v) / _rows_dot(v, v)
+    return np.clip(u, lo, hi)
+
+
+def _distance_squared_point3_line3_array(x, p, v, lo, hi):
+    d = p + _closest_u_array(p, v, lo, hi, x)[:, None] * v - x
+    return _rows_dot(d, d)
+
+
+def _distance_squared_point3_sphere_array(x, c, r):
+    d = x - c
+    return _distance_squared_surface_array(_rows_dot(d, d), r)
+
+
+def _distance_squared_point3_plane_array(x, n, k):
+    return (_rows_dot(x, n) - k) ** 2
+
+
+def _distance_squared_line3_line3_array(pa, va, loa, hia, pb, vb, lob, hib):
+    p13 = pa - pb
+    d1343 = _rows_dot(p13, vb)
+    d4321 = _rows_dot(vb, va)
+    d1321 = _rows_dot(p13, va)
+    d4343 = _rows_dot(vb, vb)
+    denom = _rows_dot(va, va) * d4343 - d4321 ** 2
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ua = np.clip((d1343 * d4321 - d1321 * d4343) / denom, loa, hia)
+        ub = np.clip((d1343 + d4321 * ua) / d4343, lob, hib)
+    d = p13 + ua[:, None] * va - ub[:, None] * vb
+    result = _rows_dot(d, d)
+    parallel = denom == 0
+    if parallel.any():
+        # Connect an endpoint of B (if it has one) with A, as in the scalar
+        # function.
+        if lob > -float('inf'):
+            other = _distance_squared_point3_line3_array(pb, pa, va,
+                                                         loa, hia)
+        else:
+            other = _distance_squared_point3_line3_array(pa, pb, vb,
+                                                         lob, hib)
+        result = np.where(parallel, np.broadcast_to(other, result.shape),
+                          result)
+    return result
+
+
+def _distance_squared_line3_plane_array(p, v, lo, hi, n, k):
+    d = _rows_dot(n, v)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        u = (k - _rows_dot(n, p)) / d
+    inside = (d != 0) & (u >= lo) & (u <= hi)
+    u = np.where(d != 0, np.clip(u, lo, hi), 0.0)
+    result = _distance_squared_point3_plane_array(p + u[:, None] * v, n, k)
+    result[inside] = 0.0
+    return result
+
+
+def _distance_squared_sphere_line3_array(c, r, p, v, lo, hi):
+    d = p + _closest_u_array(p, v, lo, hi, c)[:, None] * v - c
+    return _distance_squared_surface_array(_rows_dot(d, d), r)
+
+
+def _distance_squared_sphere_sphere_array(ca, ra, cb, rb):
+    d2 = _rows_dot(cb - ca, cb - ca)
+    d = np.sqrt(d2)
+    ra, rb = np.broadcast_arrays(ra, rb)
+    result = np.where((rb > ra) & (d < rb), (d + ra - rb) ** 2,
+                      (d - ra - rb) ** 2)
+    result = np.where((ra >= rb) & (d < ra), (d + rb - ra) ** 2, result)
+    return np.where(d2 > 0, result, 0.0)
+
+
+def _distance_squared_sphere_plane_array(c, r, n, k):
+    return _distance_squared_surface_array(
+        _distance_squared_point3_plane_array(c, n, k), r)
+
+
+def _distance_squared_point3_aabb3_array(x, bmin, bmax):
+    d = np.maximum(np.maximum(bmin - x, x - bmax), 0)
+    return _rows_dot(d, d)
+
+
+def _distance_squared_sphere_aabb3_array(c, r, bmin, bmax):
+    d2 = _distance_squared_point3_aabb3_array(c, bmin, bmax)
+    return np.where(d2 > r * r, (np.sqrt(d2) - r) ** 2, 0.0)
+
+
+def _distance_squared_aabb3_aabb3_array(amin, amax, bmin, bmax):
+    d = np.maximum(np.maximum(bmin - amax, amin - bmax), 0)
+    return _rows_dot(d, d)
+
+
+def _distance_squared_line3_aabb3_array(p, v, lo, hi, bmin, bmax):
+    # _closest_line_box for all rows: the squared distance is minimised on
+    # each of the seven pieces between the sorted face crossings (at most
+    # six, the missing ones moved inside [lo, hi] where they only split a
+    # piece) and the smallest value kept.
+    p, v, bmin, bmax = np.broadcast_arrays(p, v, bmin, bmax)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        cuts = np.concatenate(((bmin - p) / v, (bmax - p) / v), axis=1)
+    cuts = np.where(np.isfinite(cuts), cuts, 0.0)
+    cuts = np.sort(np.clip(cuts, lo, hi), axis=1)
+    bounds = np.column_stack((np.full(len(p), float(lo)), cuts,
+                              np.full(len(p), float(hi))))
+    result = np.full(len(p), np.inf)
+    for i in range(7):
+        a = bounds[:, i]
+        b = bounds[:, i + 1]
+        # any u inside the piece tells which faces the line is outside of
+        with np.errstate(invalid='ignore'):
+            m = np.where(np.isinf(a), b - 1.0,
+                         np.where(np.isinf(b), a + 1.0, (a + b) * 0.5))
+        x = p + m[:, None] * v
+        below = x < bmin
+        above = x > bmax
+        face = np.where(below, bmin, bmax)
+        outside = below | above
+        num = np.where(outside, (p - face) * v, 0.0).sum(axis=1)
+        den = np.where(outside, v * v, 0.0).sum(axis=1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            u = np.where(den > 0, -num / den, m)
+        u = np.clip(u, a, b)
+        result = np.minimum(result, _distance_squared_point3_aabb3_array(
+            p + u[:, None] * v, bmin, bmax))
+    return result
+
+
+def _distance_squared_plane_aabb3_array(n, k, bmin, bmax):
+    d = np.abs(_rows_dot(n, (bmin + bmax) * 0.5) - k)
+    r = _rows_dot(np.abs(n), (bmax - bmin) * 0.5)
+    return np.where(d > r, (d - r) ** 2, 0.0)
+
+
+def _distance_squared_plane_plane_array(na, ka, nb, kb):
+    cross = np.cross(na, nb)
+    # Any point of A will do for parallel planes; take the one closest to
+    # the origin.
+    point = na * (ka / _rows_dot(na, na))[:, None]
+    result = _distance_squared_point3_plane_array(point, nb, kb)
+    return np.where(_rows_dot(cross, cross) > 0, 0.0, result)
+
+
+def _shape_operand(X):
+    # (kind, arrays) of a scalar shape or shape array.
+    if isinstance(X, (Line3, Line3Array)):
+        return 'line3', _line3_operand(X)
+    elif isinstance(X, (Sphere, SphereArray)):
+        return 'sphere', _sphere_operand(X)
+    elif isinstance(X, (Plane, PlaneArray)):
+        return 'plane', _plane_operand(X)
+    elif isinstance(X, (AABB3, AABB3Array)):
+        return 'aabb3', _aabb3_operand(X)
+    elif isinstance(X, Vector3):
+        return 'point3', (np.array(((X.x, X.y, X.z),)),)
+    return 'point3', (_as_vector3_data(X),)
+
+
+def _distance_squared_array(A, B):
+    kind_a, a = _shape_operand(A)
+    kind_b, b = _shape_operand(B)
+    if (kind_a, kind_b) in _distance_squared_kernels:
+        return _distance_squared_kernels[kind_a, kind_b](*(a + b))
+    elif (kind_b, kind_a) in _distance_squared_kernels:
+        return _distance_squared_kernels[kind_b, kind_a](*(b + a))
+    raise AttributeError('Cannot find distance between %s and %s' %
+                         (A.__class__, B.__class__))
+
+
+def _distance_squared_point3_point3_array(a, b):
+    d = a - b
+    return _rows_dot(d, d)
+
+
+_distance_squared_kernels = {
+    ('point3', 'point3'): _distance_squared_point3_point3_array,
+    ('point3', 'line3'): _distance_squared_point3_line3_array,
+    ('point3', 'sphere'): _distance_squared_point3_sphere_array,
+    ('point3', 'plane'): _distance_squared_point3_plane_array,
+    ('point3', 'aabb3'): _distance_squared_point3_aabb3_array,
+    ('line3', 'line3'): _distance_squared_line3_line3_array,
+    ('line3', 'plane'): _distance_squared_line3_plane_array,
+    ('line3', 'aabb3'): _distance_squared_line3_aabb3_array,
+    ('sphere', 'line3'): _distance_squared_sphere_line3_array,
+    ('sphere', 'sphere'): _distance_squared_sphere_sphere_array,
+    ('sphere', 'plane'): _distance_squared_sphere_plane_array,
+    ('sphere', 'aabb3'): _distance_squared_sphere_aabb3_array,
+    ('aabb3', 'aabb3'): _distance_squared_aabb3_aabb3_array,
+    ('plane', 'aabb3'): _distance_squared_plane_aabb3_array,
+    ('plane', 'plane'): _distance_squared_plane_plane_array,
+}
+
+
+def _array_distance_squared(self, other):
+    '''Return the squared distances to other as an (N,) array.
+
+    other is a single Point3, Line3 (or Ray3, LineSegment3), Sphere, Plane
+    or AABB3, or an array of those with the same length, which is compared
+    row by row.  The values are those of the scalar distance_squared
+    method for every pair:
+
+    >>> box = AABB3(Point3(0., 0., 0.), Point3(1., 1., 1.))
+    >>> ray = Ray3(Point3(3., 3., 3.), Vector3(1., 0., 0.))
+    >>> rays = Ray3Array([(3., 3., 3.)], [(1., 0., 0.)])
+    >>> rays.distance_squared(box)[0] == ray.distance_squared(box) == 12.
+    True
+    >>> plane = Plane(Vector3(0., 0., 1.), 3.)
+    >>> planes = PlaneArray([(0., 0., 1.)], [3.])
+    >>> planes.distance_squared(box)[0] == plane.distance_squared(box) == 4.
+    True
+    '''
+    return _distance_squared_array(self, other)
+
+
+def _array_distance(self, other):
+    '''Return the distances to other as an (N,) array; see
+    distance_squared.'''
+    return np.sqrt(_distance_squared_array(self, other))
+
+
+for _cls in (Point3Array, Line3Array, SphereArray, PlaneArray,
+             AABB3Array):
+    _cls.distance_squared = _array_distance_squared
+    _cls.distance = _array_distance
+del _cls
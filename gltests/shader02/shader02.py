@@ -53,11 +53,11 @@ def on_draw():
     translation = Matrix4.new_translate(0.0, 0.0, -4.0)
     matrix = translation * rotation
     location = glGetUniformLocation(program, b"ModelMatrix")
-    glUniformMatrix4fv(location, 1, 0, (GLfloat * 16)(*matrix))
+    glUniformMatrix4fv(location, 1, 0, matrix.as_ctypes())
 
     projection = Matrix4.new_perspective (math.radians(60.), window.width / float(window.height), .1, 1000)
     location = glGetUniformLocation(program, b"ProjectionMatrix")
-    glUniformMatrix4fv(location, 1, 0, (GLfloat * 16)(*projection))
+    glUniformMatrix4fv(location, 1, 0, projection.as_ctypes())
 
 
     batch.draw()
@@ -48,12 +48,12 @@ def on_draw():
     batch.draw()
 
 
+translation = Vector3(0.0, 0.0, -4.0)
+
+
 def model_matrix():
     quaternion = Quaternion.new_rotate_euler(math.radians(rx), math.radians(ry), math.radians(rz))
-    rotation = quaternion.get_matrix()
-    translation = Matrix4.new_translate(0.0, 0.0, -4.0)
-    matrix = translation * rotation
-    return matrix
+    return Matrix4.new_trs(translation, quaternion)
 
 
 # Define a simple function to create ctypes arrays of floats:
@@ -33,20 +33,6 @@ def update(dt):
 pyglet.clock.schedule(update)
 
 
-# a b c d
-# e f g h
-# i j k l
-# m n o p
-
-def get_normal_matrix(matrix):
-    normal_matrix = Matrix3.new_identity()
-    normal_matrix[:] = (matrix.a, matrix.b, matrix.c,
-                        matrix.e, matrix.f, matrix.g,
-                        matrix.i, matrix.j, matrix.k
-                        )
-    return normal_matrix
-
-
 @window.event
 def on_resize(width, height):
     glMatrixMode(GL_PROJECTION)
@@ -64,21 +50,24 @@ def on_draw():
     shader.use()
 
     matrix = model_matrix()
-    normal_matrix = get_normal_matrix(matrix)
+    normal_matrix = matrix.normal_matrix()
     projection = Matrix4.new_perspective(math.radians(60.), window.width / float(window.height), .1, 1000)
     shader.uniforms.ProjectionMatrix = [projection]
     shader.uniforms.ModelMatrix = [matrix]
+    shader.uniforms.PositionScale = torus.position_scale
+    shader.uniforms.PositionOffset = torus.position_offset
 
     glViewport(0, 0, window.width//2, window.height//2)
-    shader.uniforms.NormalMatrix = [normal_matrix.transposed()]
+    shader.uniforms.NormalMatrix = [normal_matrix]
     batch.draw()
 
     glViewport(window.width//2, 0, window.width//2, window.height//2)
-    shader.uniforms.NormalMatrix = [normal_matrix.inverse()]
+    # cached on the model matrix, not recomputed
+    shader.uniforms.NormalMatrix = [matrix.normal_matrix()]
     batch.draw()
 
     glViewport(window.width//2, window.height//2, window.width//2, window.height//2)
-    shader.uniforms.NormalMatrix = [Matrix3.new_identity()]
+    shader.uniforms.NormalMatrix = [identity3]
     batch.draw()
 
     shader.clear()
@@ -88,15 +77,22 @@ def on_draw():
     glRotatef(rz, 0, 0, 1)
     glRotatef(ry, 0, 1, 0)
 
-    batch.draw()
+    # the fixed function pipeline cannot decode the quantised vertices
+    float_batch.draw()
+
+
+# allocated once and reused every frame
+translation = Vector3(0.0, 0.0, -4.0)
+rotation = Quaternion()
+model = Matrix4()
+identity3 = Matrix3()
+
 
 def model_matrix():
-    quaternion = Quaternion.new_rotate_euler(0, math.radians(rz), 0) * \
-                Quaternion.new_rotate_euler(math.radians(ry), 0, 0)
-    rotation = quaternion.get_matrix()
-    translation = Matrix4.new_translate(0.0, 0.0, -4.0)
-    matrix = translation * rotation
-    return matrix
+    quaternion = rotation.identity()
+    quaternion.rotate_euler(0, math.radians(rz), 0)
+    quaternion.rotate_euler(math.radians(ry), 0, 0)
+    return Matrix4.new_trs_into(translation, quaternion, None, model)
 
 
 # Define a simple function to create ctypes arrays of floats:
@@ -148,7 +144,10 @@ shader = setup()
 print("shader: ", shader)
 batch = pyglet.graphics.Batch()
 torus = Torus(1, 0.3, 50, 30)
-torus.add_to_batch(batch)
+torus.add_to_batch(batch, quantized=True)
+float_batch = pyglet.graphics.Batch()
+float_torus = Torus(1, 0.3, 50, 30)
+float_torus.add_to_batch(float_batch)
 rx = ry = rz = 0
 
 pyglet.app.run()
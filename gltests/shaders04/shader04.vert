@@ -2,14 +2,33 @@ uniform mat4 ModelMatrix;
 uniform mat3 NormalMatrix;
 uniform mat4 ProjectionMatrix;
 
+/* The mesh is uploaded quantised (ParametricMesh.add_to_batch with
+quantized=True): gl_Vertex.xyz holds the position as shorts relative to the
+bounding box of the mesh and gl_MultiTexCoord0.xy the octahedral encoded
+normal as shorts. */
+uniform vec3 PositionScale;
+uniform vec3 PositionOffset;
+
+
+vec3 decodeNormal(vec2 e)
+{
+	/* unfold the lower hemisphere from the corners of the octahedron */
+	vec3 n = vec3(e, 1.0 - abs(e.x) - abs(e.y));
+	float t = max(-n.z, 0.0);
+	n.x += n.x >= 0.0 ? -t : t;
+	n.y += n.y >= 0.0 ? -t : t;
+	return normalize(n);
+}
+
 
 void main()
 {
 	vec3 normal, lightDir;
 	vec4 diffuse;
+	vec4 position = vec4(PositionOffset + PositionScale * gl_Vertex.xyz, 1.0);
 
 	/* first transform the normal into eye space and normalize the result */
-	normal = normalize(NormalMatrix * gl_Normal);
+	normal = normalize(NormalMatrix * decodeNormal(gl_MultiTexCoord0.xy / 32767.0));
 
 	/* now normalize the light's direction. Note that according to the
 	OpenGL specification, the light is stored in eye space. Also since
@@ -27,5 +46,5 @@ void main()
 	diffuse = gl_FrontMaterial.diffuse * gl_LightSource[0].diffuse;
 	gl_FrontColor =  NdotL * diffuse;
 
-	gl_Position = 	ProjectionMatrix * ModelMatrix * gl_Vertex;
+	gl_Position = 	ProjectionMatrix * ModelMatrix * position;
 }
\ No newline at end of file
@@ -58,7 +58,22 @@ def on_draw():
     glRotatef(ry, 0, 1, 0)
     glRotatef(rx, 1, 0, 0)
 
-    batch.draw()
+    # the same modelview matrix for culling
+    modelview = Matrix4.new_translate(0, 0, -4)
+    modelview.rotatez(math.radians(rz))
+    modelview.rotatey(math.radians(ry))
+    modelview.rotatex(math.radians(rx))
+
+    # one batch per viewport, so a viewport whose frustum misses the torus
+    # issues no draw calls at all
+    for viewport, batch in zip(viewports, batches):
+        projection = Matrix4.new_perspective(
+            math.radians(60.), viewport[2] / float(viewport[3]), .1, 1000.)
+        frustum = Frustum.new_from_matrix(projection * modelview)
+        if frustum.test_spheres(torus_bounds)[0] != Frustum.OUTSIDE:
+            batch.draw()
+
+    gui_batch.draw()
 
 #    label.draw()
 
@@ -96,22 +111,26 @@ def setup():
 
 
 setup()
-batch = pyglet.graphics.Batch()
 torus = Torus(1, 0.3, 50, 30)
+# bounding sphere of the torus in model space
+torus_bounds = SphereArray([(0., 0., 0.)], 1 + 0.3)
 viewport0 = [0, 0, 640, 480]
 viewport1 = [0, 0, 320, 240]
 viewport2 = [0  , 240, 320, 240]
 viewport3 = [320, 0,   320, 240]
 viewport4 = [320, 240, 320, 240]
 
+viewports = [viewport1, viewport2, viewport3, viewport4]
+batches = [pyglet.graphics.Batch() for viewport in viewports]
+
 perspectiveGroup = PerspectiveGroup(None)
 
-torus.add_to_batch(batch=batch, group=ViewportGroup(viewport1, perspectiveGroup))
-torus.add_to_batch(batch=batch, group=ViewportGroup(viewport2, perspectiveGroup))
-torus.add_to_batch(batch=batch, group=ViewportGroup(viewport3, perspectiveGroup))
-torus.add_to_batch(batch=batch, group=ViewportGroup(viewport4, perspectiveGroup))
+for viewport, batch in zip(viewports, batches):
+    torus.add_to_batch(batch=batch, group=ViewportGroup(viewport, perspectiveGroup))
 rx = ry = rz = 0
 
+gui_batch = pyglet.graphics.Batch()
+
 guiGroup = GUIProjectionGroup()
 
 label = pyglet.text.Label('Hello, world',
@@ -120,6 +139,6 @@ label = pyglet.text.Label('Hello, world',
                           x=window.width//2, y=window.height//2,
                           anchor_x='center', anchor_y='center',
                           group=guiGroup,
-                          batch=batch)
+                          batch=gui_batch)
 
 pyglet.app.run()
@@ -0,0 +1,255 @@
+'''
+k-d tree nearest neighbour index over Point3 clouds.
+
+PointIndex answers k-nearest and radius queries with indices and distances
+returned as numpy arrays, without creating Point3 or LineSegment3 objects.
+Points keep the index they were inserted with until the next bulk rebuild:
+
+    index = PointIndex(points)
+    ids, distances = index.nearest(Point3(0., 0., 0.), k=4)
+    index.delete(ids[:1])
+    new_ids = index.insert([(1., 2., 3.)])
+
+Inserted points are kept in a small side buffer that queries scan directly
+and deleted points are only flagged; the tree is rebuilt automatically once
+either makes up a quarter of the points.
+'''
+
+import heapq
+
+import numpy as np
+
+from euclid import *
+from euclid import _as_vector3_data, _require_numpy
+
+
+def _as_query(points):
+    # (queries, single) for one point given as a Vector3 or 3-sequence, or
+    # for an array of points
+    if isinstance(points, Vector3):
+        return np.array(((points.x, points.y, points.z),)), True
+    elif not isinstance(points, Vector3Array) and np.shape(points) == (3,):
+        return np.array((points,), dtype=np.float64), True
+    return _as_vector3_data(points), False
+
+
+class PointIndex(object):
+    """
+    k-d tree over a point cloud, built from a Point3Array, a list of Point3
+    or an (N, 3) array-like.
+
+    The tree is packed into flat arrays like the bvh module: node 0 is the
+    root, the left child of an inner node follows it directly, node_right
+    holds the right child (-1 for leaves) and leaves cover
+    order[node_start:node_start + node_count].  Inner nodes split their
+    points at the median of the axis of largest extent; queries prune with
+    the node bounding boxes node_lo and node_hi.
+
+    """
+    def __init__(self, points=(), leaf_size=16):
+        _require_numpy()
+        self.leaf_size = leaf_size
+        self.rebuild(points)
+
+    def __len__(self):
+        return int(self.alive[:self.size].sum())
+
+    def __repr__(self):
+        return 'PointIndex(<%d points>)' % len(self)
+
+    def rebuild(self, points=None):
+        '''Rebuild the tree.  With points, replace the whole point set (and
+        renumber from 0); otherwise compact the current points in place,
+        keeping their indices.'''
+        if points is not None:
+            points = _as_vector3_data(points)
+            self.points = points.copy()
+            self.size = len(points)
+            self.alive = np.ones(self.size, dtype=bool)
+        self._build(np.flatnonzero(self.alive[:self.size]))
+
+    def _build(self, ids):
+        points = self.points
+        node_lo = []
+        node_hi = []
+        node_right = []
+        node_start = []
+        node_count = []
+        order = ids.copy()
+
+        stack = [(0, len(order), -1)] if len(order) else []
+        while stack:
+            start, end, parent = stack.pop()
+            node = len(node_right)
+            if parent >= 0 and node != parent + 1:
+                node_right[parent] = node
+            index = order[start:end]
+            p = points[index]
+            lo = p.min(axis=0)
+            hi = p.max(axis=0)
+            node_lo.append(lo)
+            node_hi.append(hi)
+            node_start.append(start)
+            node_count.append(end - start)
+            node_right.append(-1)
+            if end - start <= self.leaf_size or not (hi > lo).any():
+                continue
+
+            axis = int(np.argmax(hi - lo))
+            half = (end - start) // 2
+            part = np.argpartition(p[:, axis], half)
+            order[start:end] = index[part]
+            stack.append((start + half, end, node))
+            stack.append((start, start + half, node))
+
+        self.order = order
+        self.node_lo = np.array(node_lo).reshape(-1, 3)
+        self.node_hi = np.array(node_hi).reshape(-1, 3)
+        self.node_right = np.array(node_right, dtype=np.intp)
+        self.node_start = np.array(node_start, dtype=np.intp)
+        self.node_count = np.array(node_count, dtype=np.intp)
+        self._built = self.size
+        self._dead = 0
+
+    def insert(self, points):
+        '''Add points and return their indices as an array.'''
+        points = _as_query(points)[0]
+        count = len(points)
+        if self.size + count > len(self.points):
+            capacity = max(2 * len(self.points), self.size + count, 16)
+            grown = np.empty((capacity, 3))
+            grown[:self.size] = self.points[:self.size]
+            self.points = grown
+            alive = np.zeros(capacity, dtype=bool)
+            alive[:self.size] = self.alive[:self.size]
+            self.alive = alive
+        ids = np.arange(self.size, self.size + count)
+        self.points[ids] = points
+        self.alive[ids] = True
+        self.size += count
+        self._check_rebuild()
+        return ids
+
+    def delete(self, ids):
+        '''Remove the points with the given indices.'''
+        ids = np.unique(np.asarray(ids, dtype=np.intp))
+        self._dead += int(self.alive[ids][ids < self._built].sum())
+        self.alive[ids] = False
+        self._check_rebuild()
+
+    def _check_rebuild(self):
+        if 4 * (self.size - self._built + self._dead) > self.size:
+            self._build(np.flatnonzero(self.alive[:self.size]))
+
+    def _pending(self):
+        ids = np.arange(self._built, self.size)
+        return ids[self.alive[ids]]
+
+    def nearest(self, points, k=1):
+        '''Return (indices, distances) of the k points nearest to points,
+        closest first.
+
+        For a single Point3 (or 3-sequence) both are (k,) arrays, for a
+        Point3Array or (M, 3) array-like of queries (M, k) arrays.  If the
+        index holds fewer than k points the missing entries are -1 and
+        infinity; k=0 gives empty results.
+        '''
+        if k < 0:
+            raise ValueError('k must not be negative, got %r' % (k,))
+        queries, single = _as_query(points)
+        ids = np.full((len(queries), k), -1, dtype=np.intp)
+        distances = np.full((len(queries), k), np.inf)
+        for i, q in enumerate(queries if k else ()):
+            found, d2 = self._nearest(q, k)
+            ids[i, :len(found)] = found
+            distances[i, :len(found)] = np.sqrt(d2)
+        if single:
+            return ids[0], distances[0]
+        return ids, distances
+
+    def _nearest(self, q, k):
+        best = self._pending()
+        d = self.points[best] - q
+        best_d2 = np.einsum('ij,ij->i', d, d)
+        best, best_d2 = self._keep(best, best_d2, k)
+
+        if len(self.node_right):
+            heap = [(0.0, 0)]
+            while heap:
+                bound, node = heapq.heappop(heap)
+                if len(best) == k and bound > best_d2[-1]:
+                    break
+                right = self.node_right[node]
+                if right < 0:
+                    start = self.node_start[node]
+                    ids = self.order[start:start + self.node_count[node]]
+                    ids = ids[self.alive[ids]]
+                    d = self.points[ids] - q
+                    best, best_d2 = self._keep(
+                        np.concatenate((best, ids)),
+                        np.concatenate((best_d2,
+                                        np.einsum('ij,ij->i', d, d))), k)
+                    continue
+                children = (node + 1, right)
+                d = np.maximum(np.maximum(self.node_lo[list(children)] - q,
+                                          q - self.node_hi[list(children)]),
+                               0)
+                for child, d2 in zip(children, np.einsum('ij,ij->i', d, d)):
+                    if len(best) < k or d2 <= best_d2[-1]:
+                        heapq.heappush(heap, (float(d2), child))
+        return best, best_d2
+
+    def _keep(self, ids, d2, k):
+        # the k smallest, sorted
+        if len(ids) > k:
+            part = np.argpartition(d2, k - 1)[:k]
+            ids = ids[part]
+            d2 = d2[part]
+        order = np.argsort(d2, kind='stable')
+        return ids[order], d2[order]
+
+    def query_radius(self, points, radius):
+        '''Return (indices, distances) of all points within radius of
+        points, closest first.
+
+        For a single query both are arrays; for several queries a list with
+        one (indices, distances) pair per query.
+        '''
+        queries, single = _as_query(points)
+        pending = self._pending()
+        results = []
+        r2 = radius * radius
+        for q in queries:
+            ids = np.concatenate((self._candidates(q, r2), pending))
+            d = self.points[ids] - q
+            d2 = np.einsum('ij,ij->i', d, d)
+            keep = d2 <= r2
+            ids = ids[keep]
+            d2 = d2[keep]
+            order = np.argsort(d2, kind='stable')
+            results.append((ids[order], np.sqrt(d2[order])))
+        if single:
+            return results[0]
+        return results
+
+    def _candidates(self, q, r2):
+        # Alive points in all leaves whose box is within sqrt(r2) of q,
+        # walking the tree one level at a time.
+        if not len(self.node_right):
+            return self.order
+        nodes = np.zeros(1, dtype=np.intp)
+        leaves = []
+        while len(nodes):
+            d = np.maximum(np.maximum(self.node_lo[nodes] - q,
+                                      q - self.node_hi[nodes]), 0)
+            nodes = nodes[np.einsum('ij,ij->i', d, d) <= r2]
+            right = self.node_right[nodes]
+            leaf = right < 0
+            leaves.append(nodes[leaf])
+            nodes = np.concatenate((nodes[~leaf] + 1, right[~leaf]))
+        leaves = np.concatenate(leaves)
+        starts = self.node_start[leaves]
+        counts = self.node_count[leaves]
+        offsets = np.repeat(starts - np.cumsum(counts) + counts, counts)
+        ids = self.order[offsets + np.arange(counts.sum())]
+        return ids[self.alive[ids]]
@@ -0,0 +1,391 @@
+'''
+parametric surface meshes for pyglet batches.
+
+A surface is given as a function of the grid parameters u and v, evaluated
+on the whole grid at once, and turned into flat float32 vertex and normal
+arrays and a flat uint32 triangle index array:
+
+    def surface(u, v):
+        # u has shape (U, 1) and v (1, V); the components only need to
+        # broadcast to (U, V)
+        return (x, y, z), (nx, ny, nz)
+
+    vertices, normals, indices = parametric_arrays(surface, 32, 16)
+
+Vertex (i, j) of a U x V grid is at index i * V + j and every grid quad
+becomes the triangles (p, p + V, p + V + 1) and (p, p + V + 1, p + 1), which
+face the side of the cross product of the u and v derivatives.  The meshes
+in this module and the Torus in torus.py are built on it.
+'''
+
+from math import hypot, pi
+
+import numpy as np
+
+import pyglet
+from pyglet.gl import GL_TRIANGLES, GL_UNSIGNED_INT, GL_UNSIGNED_SHORT
+from pyglet.graphics import Group, vertexdomain
+
+from vertexcache import reorder_vertices, tipsify
+
+
+def grid_indices(u_count, v_count, poles=(False, False),
+                 welded=(False, False)):
+    '''Triangle indices of a u_count x v_count vertex grid as a flat uint32
+    array.  poles marks the first and last column (v) as collapsed to a
+    single point; the triangles that degenerate there are left out.
+
+    welded marks directions whose last row (column) was dropped because it
+    duplicates the first; the quads along the seam then wrap around to the
+    first one, leaving a (u_count - 1) x v_count grid for welded[0] and so
+    on.
+    '''
+    u_size = u_count - 1 if welded[0] else u_count
+    v_size = v_count - 1 if welded[1] else v_count
+    i = np.arange(u_count - 1, dtype=np.uint32)[:, None]
+    j = np.arange(v_count - 1, dtype=np.uint32)[None, :]
+    i1 = (i + 1) % u_size * v_size
+    j1 = (j + 1) % v_size
+    i = i * v_size
+    indices = np.empty((u_count - 1, v_count - 1, 6), dtype=np.uint32)
+    indices[..., 0] = i + j
+    indices[..., 1] = i1 + j
+    indices[..., 2] = i1 + j1
+    indices[..., 3] = i + j
+    indices[..., 4] = i1 + j1
+    indices[..., 5] = i + j1
+    indices = indices.reshape(u_count - 1, v_count - 1, 2, 3)
+
+    if not poles[0] and not poles[1]:
+        return indices.reshape(-1)
+    keep = np.ones(indices.shape[:3], dtype=bool)
+    if poles[0]:
+        keep[:, 0, 0] = False
+    if poles[1]:
+        keep[:, -1, 1] = False
+    return indices[keep].reshape(-1)
+
+
+def parametric_arrays(surface, u_count, v_count, u_range=(0., 2 * pi),
+                      v_range=(0., 2 * pi), wrap_u=False, wrap_v=False,
+                      poles=(False, False), weld=False):
+    '''Evaluate surface on a u_count x v_count grid spanning u_range and
+    v_range (either may run backwards) and return (vertices, normals,
+    indices) as flat arrays.
+
+    wrap_u and wrap_v mark closed surfaces: the last row (column) is then
+    set to an exact copy of the first, so the seam has no cracks even where
+    the trigonometry does not return exactly to its start.  The seam
+    vertices stay separate unless weld is set, which drops the duplicate row
+    (column) and wraps the indices around instead (see grid_indices),
+    saving one row of vertices per closed direction; use it where no
+    per-vertex attribute, like a texture coordinate, differs across the
+    seam.  poles marks columns collapsed to one point; their positions are
+    made identical too.
+    '''
+    u = np.linspace(u_range[0], u_range[1], u_count)[:, None]
+    v = np.linspace(v_range[0], v_range[1], v_count)[None, :]
+    position, normal = surface(u, v)
+
+    shape = (u_count, v_count, 3)
+    vertices = np.empty(shape, dtype=np.float32)
+    normals = np.empty(shape, dtype=np.float32)
+    for axis in range(3):
+        vertices[..., axis] = position[axis]
+        normals[..., axis] = normal[axis]
+
+    if wrap_u:
+        vertices[-1] = vertices[0]
+        normals[-1] = normals[0]
+    if wrap_v:
+        vertices[:, -1] = vertices[:, 0]
+        normals[:, -1] = normals[:, 0]
+    if poles[0]:
+        vertices[:, 0] = vertices[0, 0]
+    if poles[1]:
+        vertices[:, -1] = vertices[0, -1]
+
+    welded = (weld and wrap_u, weld and wrap_v)
+    if welded[0]:
+        vertices = vertices[:-1]
+        normals = normals[:-1]
+    if welded[1]:
+        vertices = vertices[:, :-1]
+        normals = normals[:, :-1]
+
+    return (np.ascontiguousarray(vertices).reshape(-1),
+            np.ascontiguousarray(normals).reshape(-1),
+            grid_indices(u_count, v_count, poles, welded))
+
+
+def merge_arrays(*meshes):
+    '''Concatenate several (vertices, normals, indices) triples into one,
+    offsetting the indices.'''
+    offset = 0
+    indices = []
+    for vertices, normals, index in meshes:
+        indices.append(index + np.uint32(offset))
+        offset += len(vertices) // 3
+    return (np.concatenate([mesh[0] for mesh in meshes]),
+            np.concatenate([mesh[1] for mesh in meshes]),
+            np.concatenate(indices))
+
+
+def index_type(vertex_count):
+    '''The smallest GL index type, with its numpy dtype, that can address
+    vertex_count vertices.'''
+    if vertex_count <= 1 << 16:
+        return GL_UNSIGNED_SHORT, np.uint16
+    return GL_UNSIGNED_INT, np.uint32
+
+
+def _disc(radius, z, slices, rings, up, weld):
+    # disc around the z axis at height z, facing +z if up; the centre is a
+    # pole
+    def surface(u, v):
+        r = radius * v
+        return ((r * np.cos(u), r * np.sin(u), z),
+                (0., 0., 1. if up else -1.))
+
+    if up:
+        return parametric_arrays(surface, slices, rings, v_range=(1., 0.),
+                                 wrap_u=True, poles=(False, True), weld=weld)
+    return parametric_arrays(surface, slices, rings, v_range=(0., 1.),
+                             wrap_u=True, poles=(True, False), weld=weld)
+
+
+def quantize_positions(vertices):
+    '''Quantise positions to signed shorts relative to their bounding box.
+
+    Returns (positions, scale, offset): an (N, 4) int16 array with the w
+    component set to 1, padding each vertex to 8 bytes, and the per-axis
+    scale and offset (3-tuples of floats) that decode them again as
+    offset + scale * position.
+    '''
+    vertices = np.asarray(vertices, dtype=np.float64).reshape(-1, 3)
+    lo = vertices.min(axis=0) if len(vertices) else np.zeros(3)
+    hi = vertices.max(axis=0) if len(vertices) else np.zeros(3)
+    offset = (lo + hi) * 0.5
+    scale = (hi - lo) * 0.5 / 32767.
+    scale[scale == 0] = 1.
+    positions = np.ones((len(vertices), 4), dtype=np.int16)
+    positions[:, :3] = np.rint((vertices - offset) / scale)
+    return positions, tuple(scale.tolist()), tuple(offset.tolist())
+
+
+def octahedral_encode(normals):
+    '''Encode unit normals as (N, 2) int16 octahedral coordinates, mapping
+    [-1, 1] to [-32767, 32767].  The upper hemisphere is projected onto the
+    octahedron and the lower one folded over its diagonals.'''
+    n = np.asarray(normals, dtype=np.float64).reshape(-1, 3)
+    length = np.abs(n).sum(axis=1)
+    n = n / np.where(length > 0, length, 1.)[:, None]
+    x = n[:, 0]
+    y = n[:, 1]
+    sign_x = np.where(x >= 0, 1., -1.)
+    sign_y = np.where(y >= 0, 1., -1.)
+    lower = n[:, 2] < 0
+    x, y = (np.where(lower, (1. - np.abs(y)) * sign_x, x),
+            np.where(lower, (1. - np.abs(x)) * sign_y, y))
+    return np.rint(np.column_stack((x, y)) * 32767.).astype(np.int16)
+
+
+def octahedral_decode(encoded):
+    '''Decode octahedral normals as the decodeNormal function of the demo
+    shaders does; returns (N, 3) unit vectors.'''
+    e = np.asarray(encoded, dtype=np.float64).reshape(-1, 2) / 32767.
+    n = np.column_stack((e, 1. - np.abs(e).sum(axis=1)))
+    t = np.maximum(-n[:, 2], 0.)
+    n[:, 0] += np.where(n[:, 0] >= 0, -t, t)
+    n[:, 1] += np.where(n[:, 1] >= 0, -t, t)
+    return n / np.sqrt(np.einsum('ij,ij->i', n, n))[:, None]
+
+
+def _add_indexed_domain(batch, group, mode, formats, index_gl_type):
+    # Batch.add_indexed always creates GL_UNSIGNED_INT domains; register
+    # one with the wanted index type for the group first, the way
+    # Batch._get_domain does, so that add_indexed picks it up.
+    #
+    # This depends on Batch internals as they are in pyglet 1.2 to 1.5:
+    # group_map, _add_group, the (formats, mode, indexed) domain key and the
+    # name mangled __formats (hence pyglet<2 in requirements.txt).  Other
+    # versions are refused instead of silently ending up with
+    # GL_UNSIGNED_INT domains; add_to_batch checks the domain was used.
+    if not pyglet.version.startswith('1.') or \
+            not hasattr(batch, 'group_map') or \
+            not hasattr(batch, '_add_group'):
+        raise RuntimeError('index types need the Batch internals of '
+                           'pyglet 1.x, found pyglet %s' % pyglet.version)
+    if group not in batch.group_map:
+        batch._add_group(group)
+    domain_map = batch.group_map[group]
+    key = (formats, mode, True)
+    if key not in domain_map:
+        domain = vertexdomain.create_indexed_domain(
+            *formats, index_gl_type=index_gl_type)
+        domain._Batch__formats = formats
+        domain_map[key] = domain
+        batch._draw_list_dirty = True
+    return domain_map[key]
+
+
+class ParametricMesh(object):
+    """
+    Flat vertex, normal and index arrays that can be added to a batch.
+    Subclasses build them with parametric_arrays (and merge_arrays for
+    several patches).
+
+    The indices are stored with the smallest type that fits, index_type
+    being GL_UNSIGNED_SHORT for up to 65536 vertices and GL_UNSIGNED_INT
+    above.  add_to_batch puts every mesh into a group of its own so that
+    pyglet keeps it in an index buffer of that type; meshes sharing an
+    index buffer would all have to use the widest type.
+
+    pyglet interleaves all /static attributes of a vertex list into one
+    buffer, so the float format takes 24 bytes per vertex.  With quantized
+    set, add_to_batch uploads 12 instead: the position as four shorts (see
+    quantize_positions) and the octahedral normal as two shorts in the
+    texture coordinate.  Shaders decode them again, given position_scale
+    and position_offset as uniforms; see gltests/shaders04/shader04.vert.
+
+    """
+    def __init__(self, vertices, normals, indices):
+        self.vertices = vertices
+        self.normals = normals
+        self.index_type, dtype = index_type(len(vertices) // 3)
+        self.indices = indices.astype(dtype)
+        self.vertex_list = None
+        self.group = None
+        self.position_scale = (1., 1., 1.)
+        self.position_offset = (0., 0., 0.)
+
+    def __repr__(self):
+        return '%s(<%d vertices, %d triangles>)' % (
+            self.__class__.__name__, len(self.vertices) // 3,
+            len(self.indices) // 3)
+
+    def optimize(self, cache_size=16):
+        '''Reorder the triangles for the post-transform vertex cache and
+        the vertices for fetch locality (see the vertexcache module).  Call
+        before add_to_batch.'''
+        indices = tipsify(self.indices, len(self.vertices) // 3, cache_size)
+        self.indices, self.vertices, self.normals = reorder_vertices(
+            indices, self.vertices, self.normals)
+        return self
+
+    def buffer_bytes(self, quantized=False):
+        '''Return (vertex_bytes, index_bytes), the sizes of the vertex
+        (positions and normals) and index buffers.'''
+        vertex_size = 12 if quantized else 24
+        return (len(self.vertices) // 3 * vertex_size, self.indices.nbytes)
+
+    def add_to_batch(self, batch, group=None, quantized=False):
+        if quantized:
+            positions, self.position_scale, self.position_offset = \
+                quantize_positions(self.vertices)
+            formats = ('v4s/static', 't2s/static')
+            data = (positions.reshape(-1),
+                    octahedral_encode(self.normals).reshape(-1))
+        else:
+            formats = ('v3f/static', 'n3f/static')
+            data = (self.vertices, self.normals)
+        self.group = Group(parent=group)
+        domain = _add_indexed_domain(batch, self.group, GL_TRIANGLES,
+                                     formats, self.index_type)
+        self.vertex_list = batch.add_indexed(len(self.vertices) // 3,
+                                             GL_TRIANGLES,
+                                             self.group,
+                                             self.indices,
+                                             (formats[0], data[0]),
+                                             (formats[1], data[1]))
+        if self.vertex_list.domain is not domain:
+            self.vertex_list.delete()
+            raise RuntimeError('pyglet %s did not use the %s index domain'
+                               % (pyglet.version, self.indices.dtype))
+
+    def delete(self):
+        self.vertex_list.delete()
+
+
+class SphereMesh(ParametricMesh):
+    """
+    Sphere around the origin with slices meridians and stacks vertices from
+    the south to the north pole.
+
+    """
+    def __init__(self, radius, slices, stacks, weld=False):
+        def surface(u, v):
+            nx = np.sin(v) * np.cos(u)
+            ny = np.sin(v) * np.sin(u)
+            nz = -np.cos(v)
+            return (radius * nx, radius * ny, radius * nz), (nx, ny, nz)
+
+        super(SphereMesh, self).__init__(*parametric_arrays(
+            surface, slices, stacks, v_range=(0., pi), wrap_u=True,
+            poles=(True, True), weld=weld))
+
+
+class CylinderMesh(ParametricMesh):
+    """
+    Cylinder around the z axis, centred on the origin, with stacks vertex
+    rings along its height and, if capped, discs of rings rings closing
+    both ends.
+
+    """
+    def __init__(self, radius, height, slices, stacks=2, capped=True,
+                 rings=2, weld=False):
+        def surface(u, v):
+            return ((radius * np.cos(u), radius * np.sin(u),
+                     height * (v - 0.5)),
+                    (np.cos(u), np.sin(u), 0.))
+
+        meshes = [parametric_arrays(surface, slices, stacks,
+                                    v_range=(0., 1.), wrap_u=True,
+                                    weld=weld)]
+        if capped:
+            meshes.append(_disc(radius, -0.5 * height, slices, rings, False,
+                                weld))
+            meshes.append(_disc(radius, 0.5 * height, slices, rings, True,
+                                weld))
+        super(CylinderMesh, self).__init__(*merge_arrays(*meshes))
+
+
+class ConeMesh(ParametricMesh):
+    """
+    Cone around the z axis with its base at z = -height / 2 and the apex at
+    z = height / 2, with stacks vertex rings from base to apex and, if
+    capped, a base disc of rings rings.
+
+    """
+    def __init__(self, radius, height, slices, stacks=2, capped=True,
+                 rings=2, weld=False):
+        slant = hypot(radius, height)
+
+        def surface(u, v):
+            r = radius * (1. - v)
+            return ((r * np.cos(u), r * np.sin(u), height * (v - 0.5)),
+                    (height / slant * np.cos(u), height / slant * np.sin(u),
+                     radius / slant))
+
+        meshes = [parametric_arrays(surface, slices, stacks,
+                                    v_range=(0., 1.), wrap_u=True,
+                                    poles=(False, True), weld=weld)]
+        if capped:
+            meshes.append(_disc(radius, -0.5 * height, slices, rings, False,
+                                weld))
+        super(ConeMesh, self).__init__(*merge_arrays(*meshes))
+
+
+class PlaneMesh(ParametricMesh):
+    """
+    Grid of columns x rows vertices in the xy plane, centred on the origin
+    and facing +z.
+
+    """
+    def __init__(self, width, depth, columns=2, rows=2):
+        def surface(u, v):
+            return ((width * (u - 0.5), depth * (v - 0.5), 0.),
+                    (0., 0., 1.))
+
+        super(PlaneMesh, self).__init__(*parametric_arrays(
+            surface, columns, rows, u_range=(0., 1.), v_range=(0., 1.)))
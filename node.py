@@ -133,15 +133,12 @@ class TransformGroup(pyglet.graphics.Group):
         self.translation = translation
         self.rotation = rotation
         self.scale = scale
+        self.matrix = Matrix4()
 
     def set_state(self):
         glPushMatrix()
-        matrix = Matrix4.new_translate(self.translation.x, self.translation.y, self.translation.z)
-        matrix *= self.rotation.get_matrix()
-        matrix *= Matrix4.new_scale(self.scale.x, self.scale.y, self.scale.z)
-        buffer = (GLfloat * 16)()
-
-        glMultMatrixf(buffer)
+        Matrix4.new_trs_into(self.translation, self.rotation, self.scale, self.matrix)
+        glMultMatrixf(self.matrix.as_ctypes())
 
     def unset_state(self):
         glPopMatrix()
@@ -0,0 +1,225 @@
+'''
+uniform grid broadphase for the 2D euclid shapes: Point2, Circle, Line2 (and
+Ray2, LineSegment2) and AABB2.
+
+Shapes are bucketed into square cells by their bounding box, so only shapes
+sharing a cell are paired up and the exact intersect tests run on those
+candidates instead of on all N * N pairs.  Moving shapes are updated in
+place once per frame; a shape whose bounds stay in the same cells costs no
+rehashing:
+
+    grid = SpatialHash(cell_size=32.)
+    player = grid.insert(Circle(Point2(10., 10.), 5.))
+    button = grid.insert(AABB2(Point2(0., 0.), Point2(40., 20.)))
+    for a, b in grid.intersecting_pairs():
+        ...
+    grid.update(player, Circle(Point2(12., 11.), 5.))
+
+Lines and rays are unbounded and kept outside the grid; they are paired
+with every other shape.
+'''
+
+import itertools
+import math
+
+from euclid import *
+
+
+def _bounds(shape):
+    # (xmin, ymin, xmax, ymax) of a shape, or None if it is unbounded
+    if isinstance(shape, Point2):
+        return shape.x, shape.y, shape.x, shape.y
+    elif isinstance(shape, Circle):
+        c = shape.c
+        r = shape.r
+        return c.x - r, c.y - r, c.x + r, c.y + r
+    elif isinstance(shape, LineSegment2):
+        p1 = shape.p
+        p2 = shape.p2
+        return (min(p1.x, p2.x), min(p1.y, p2.y),
+                max(p1.x, p2.x), max(p1.y, p2.y))
+    elif isinstance(shape, Line2):
+        return None
+    elif isinstance(shape, AABB2):
+        return (shape.minimum.x, shape.minimum.y,
+                shape.maximum.x, shape.maximum.y)
+    raise TypeError('Cannot hash %s' % shape.__class__)
+
+
+def intersects(a, b):
+    '''Exact test used on the candidate pairs: the shapes' own intersect,
+    falling back to distance for pairs it does not cover (a point against
+    a point or a line).
+
+    Shapes count as filled regions, which Circle.intersect (the crossings
+    of the outlines) does not give for two circles, so those are compared
+    by their centres instead:
+
+    >>> intersects(Circle(Point2(0., 0.), 5.), Circle(Point2(1., 0.), 1.))
+    True
+    >>> intersects(Circle(Point2(0., 0.), 5.), Circle(Point2(0., 0.), 5.))
+    True
+    >>> intersects(Circle(Point2(0., 0.), 5.), Point2(1., 1.))
+    True
+    '''
+    if isinstance(a, Circle) and isinstance(b, Circle):
+        return abs(a.c - b.c) <= a.r + b.r
+    try:
+        result = a.intersect(b)
+        return result is not None and result is not False
+    except AttributeError:
+        return a.distance_squared(b) == 0
+
+
+class SpatialHash(object):
+    """
+    Spatial hash over 2D shapes.  insert() returns an integer handle used to
+    update() and remove() the shape and to identify it in pairs; handles
+    are not reused.
+
+    cells maps the integer cell coordinates (i, j), covering
+    [i * cell_size, (i + 1) * cell_size) along x and likewise along y, to
+    the set of handles whose bounding box touches the cell.  Pick cell_size
+    around the size of the typical shape: much smaller and big shapes
+    occupy many cells, much larger and unrelated shapes share cells.
+
+    """
+    def __init__(self, cell_size):
+        assert cell_size > 0
+        self.cell_size = float(cell_size)
+        self.cells = {}
+        self.shapes = {}
+        self._ranges = {}
+        self._unbounded = set()
+        self._next = 0
+
+    def __len__(self):
+        return len(self.shapes)
+
+    def __contains__(self, handle):
+        return handle in self.shapes
+
+    def __getitem__(self, handle):
+        return self.shapes[handle]
+
+    def __repr__(self):
+        return 'SpatialHash(<%d shapes in %d cells>)' % (len(self.shapes),
+                                                         len(self.cells))
+
+    def _range(self, shape):
+        # (i0, j0, i1, j1) cell range covered by the shape, None if unbounded
+        bounds = _bounds(shape)
+        if bounds is None:
+            return None
+        s = self.cell_size
+        return (int(math.floor(bounds[0] / s)),
+                int(math.floor(bounds[1] / s)),
+                int(math.floor(bounds[2] / s)),
+                int(math.floor(bounds[3] / s)))
+
+    def _add(self, handle, cells):
+        if cells is None:
+            self._unbounded.add(handle)
+            return
+        i0, j0, i1, j1 = cells
+        for key in itertools.product(range(i0, i1 + 1), range(j0, j1 + 1)):
+            self.cells.setdefault(key, set()).add(handle)
+
+    def _discard(self, handle, cells):
+        if cells is None:
+            self._unbounded.discard(handle)
+            return
+        i0, j0, i1, j1 = cells
+        for key in itertools.product(range(i0, i1 + 1), range(j0, j1 + 1)):
+            bucket = self.cells[key]
+            bucket.discard(handle)
+            if not bucket:
+                del self.cells[key]
+
+    def insert(self, shape):
+        '''Add a shape and return its handle.'''
+        cells = self._range(shape)
+        handle = self._next
+        self._next += 1
+        self.shapes[handle] = shape
+        self._ranges[handle] = cells
+        self._add(handle, cells)
+        return handle
+
+    def update(self, handle, shape=None):
+        '''Rehash a shape after it moved, either changed in place or
+        replaced by shape.  Only the cells it left or entered are touched.
+        '''
+        if shape is not None:
+            self.shapes[handle] = shape
+        cells = self._range(self.shapes[handle])
+        old = self._ranges[handle]
+        if cells == old:
+            return
+        if cells is None or old is None:
+            self._discard(handle, old)
+            self._add(handle, cells)
+        else:
+            # difference of the two cell rectangles
+            old_keys = set(itertools.product(range(old[0], old[2] + 1),
+                                             range(old[1], old[3] + 1)))
+            new_keys = set(itertools.product(range(cells[0], cells[2] + 1),
+                                             range(cells[1], cells[3] + 1)))
+            for key in old_keys - new_keys:
+                bucket = self.cells[key]
+                bucket.discard(handle)
+                if not bucket:
+                    del self.cells[key]
+            for key in new_keys - old_keys:
+                self.cells.setdefault(key, set()).add(handle)
+        self._ranges[handle] = cells
+
+    def remove(self, handle):
+        self._discard(handle, self._ranges.pop(handle))
+        del self.shapes[handle]
+
+    def clear(self):
+        self.cells.clear()
+        self.shapes.clear()
+        self._ranges.clear()
+        self._unbounded.clear()
+
+    def pairs(self):
+        '''Return the set of candidate pairs (a, b) of handles, a < b, whose
+        shapes share a cell.  Every intersecting pair is among them.'''
+        pairs = set()
+        for bucket in self.cells.values():
+            if len(bucket) > 1:
+                pairs.update(itertools.combinations(sorted(bucket), 2))
+        for a in self._unbounded:
+            for b in self.shapes:
+                if a != b:
+                    pairs.add((min(a, b), max(a, b)))
+        return pairs
+
+    def intersecting_pairs(self, test=intersects):
+        '''Return the sorted list of candidate pairs whose shapes pass
+        test(shape_a, shape_b), by default `intersects`.'''
+        shapes = self.shapes
+        return sorted([(a, b) for a, b in self.pairs()
+                       if test(shapes[a], shapes[b])])
+
+    def candidates(self, shape):
+        '''Return the set of handles of shapes sharing a cell with shape.'''
+        cells = self._range(shape)
+        if cells is None:
+            return set(self.shapes)
+        result = set(self._unbounded)
+        i0, j0, i1, j1 = cells
+        for key in itertools.product(range(i0, i1 + 1), range(j0, j1 + 1)):
+            bucket = self.cells.get(key)
+            if bucket:
+                result.update(bucket)
+        return result
+
+    def query(self, shape, test=intersects):
+        '''Return the sorted handles of the shapes intersecting shape, e.g.
+        the GUI regions under a Point2.'''
+        shapes = self.shapes
+        return sorted([handle for handle in self.candidates(shape)
+                       if test(shapes[handle], shape)])
@@ -0,0 +1,144 @@
+'''
+sweep and prune broadphase for many moving spheres.
+
+The spheres are projected onto one axis and kept sorted by the start of
+their interval; overlapping pairs are then found with one sweep over the
+sorted intervals and confirmed with the exact sphere test.  The order of
+the previous frame is reused, so when the spheres move a little per frame
+the sort only has to fix up a nearly sorted sequence:
+
+    sap = SweepAndPrune(centers, radii)
+    pairs = sap.pairs()          # (M, 2) array of sphere indices
+    ...
+    pairs = sap.update(new_centers)
+
+centers is a Point3Array or (N, 3) array-like and radii an (N,) array or a
+single radius, so no Sphere objects are needed.
+'''
+
+import numpy as np
+
+from euclid import *
+from euclid import _as_scalar_data, _as_vector3_data, _require_numpy
+
+
+# Below this many spheres still overlapping the next offset, the sweep
+# switches from testing one offset at a time to all remaining pairs at once.
+_gather_limit = 64
+
+
+class SweepAndPrune(object):
+    """
+    Sorted axis broadphase over N spheres.
+
+    order holds the sphere indices sorted by the lower end of their interval
+    along axis, the axis of largest spread of the centers.  The axis is
+    chosen again on every update and the previous order only reused while
+    it stays the same.
+
+    """
+    def __init__(self, centers, radii):
+        _require_numpy()
+        self.centers = _as_vector3_data(centers).copy()
+        self.radii = _as_scalar_data(radii, len(self.centers)).copy()
+        self.axis = None
+        self.order = None
+        self._pairs = None
+        self._sort()
+
+    def __len__(self):
+        return len(self.centers)
+
+    def __repr__(self):
+        return 'SweepAndPrune(<%d spheres>)' % len(self.centers)
+
+    def update(self, centers=None, radii=None):
+        '''Move the spheres and return the new pairs.  Either argument can
+        be left out if it did not change; the number of spheres is fixed.'''
+        if centers is not None:
+            self.centers[:] = _as_vector3_data(centers)
+        if radii is not None:
+            self.radii[:] = _as_scalar_data(radii, len(self.centers))
+        self._sort()
+        return self.pairs()
+
+    def _sort(self):
+        self._pairs = None
+        if not len(self.centers):
+            self.order = np.zeros(0, dtype=np.intp)
+            return
+        axis = int(np.argmax(self.centers.var(axis=0)))
+        lo = self.centers[:, axis] - self.radii
+        if axis != self.axis or self.order is None:
+            self.axis = axis
+            self.order = np.argsort(lo, kind='stable')
+        else:
+            # The stable sort (timsort) runs in close to linear time on the
+            # nearly sorted sequence left by the previous frame, which is
+            # what the classic insertion sort step exploits.
+            self.order = self.order[np.argsort(lo[self.order], kind='stable')]
+
+    def pairs(self):
+        '''Return the overlapping pairs as an (M, 2) array of sphere indices
+        i < j, sorted by i then j.  Touching spheres count as overlapping.
+        '''
+        if self._pairs is None:
+            self._pairs = self._sweep()
+        return self._pairs
+
+    def _sweep(self):
+        order = self.order
+        n = len(order)
+        if n < 2:
+            return np.zeros((0, 2), dtype=np.intp)
+        # coordinates as separate contiguous rows, in sorted order
+        x, y, z = np.ascontiguousarray(self.centers[order].T)
+        r = self.radii[order]
+        lo = [x, y, z][self.axis] - r
+        hi = lo + 2 * r
+
+        # Sphere k overlaps, along the axis, the following count[k] spheres.
+        # Pairs (k, k + offset) are tested one offset at a time, on slices
+        # while most spheres still have that many neighbours and on the
+        # remaining ones after that; the exact test rejects the pairs past
+        # the end of the interval.
+        count = np.searchsorted(lo, hi, side='right') - np.arange(1, n + 1)
+        first = []
+        second = []
+        active = np.arange(n)
+        offset = 1
+        while offset <= n - 1:
+            active = active[count[active] >= offset]
+            if len(active) < _gather_limit:
+                break
+            if 4 * len(active) > n - offset:
+                a = slice(0, n - offset)
+                b = slice(offset, n)
+                index = np.arange(n - offset)
+            else:
+                a = active
+                b = active + offset
+                index = active
+            dx = x[b] - x[a]
+            dy = y[b] - y[a]
+            dz = z[b] - z[a]
+            rs = r[b] + r[a]
+            hit = np.flatnonzero(dx * dx + dy * dy + dz * dz <= rs * rs)
+            first.append(index[hit])
+            second.append(index[hit] + offset)
+            offset += 1
+
+        # the few spheres with long intervals, all remaining offsets at once
+        remaining = np.maximum(count[active] - offset + 1, 0)
+        a = np.repeat(active, remaining)
+        b = a + offset + np.arange(len(a)) - np.repeat(
+            np.cumsum(remaining) - remaining, remaining)
+        d2 = (x[b] - x[a]) ** 2 + (y[b] - y[a]) ** 2 + (z[b] - z[a]) ** 2
+        hit = d2 <= (r[a] + r[b]) ** 2
+        first.append(a[hit])
+        second.append(b[hit])
+
+        a = order[np.concatenate(first)]
+        b = order[np.concatenate(second)]
+        pairs = np.column_stack((np.minimum(a, b), np.maximum(a, b)))
+        return pairs[np.lexsort((pairs[:, 1], pairs[:, 0]))]
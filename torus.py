@@ -1,7 +1,7 @@
 
-from math import pi, cos, sin
+import numpy as np
 
-from pyglet.gl import GL_TRIANGLES#!/usr/bin/env python
+from mesh import ParametricMesh, parametric_arrays#!/usr/bin/env python
 # ----------------------------------------------------------------------------
 # pyglet
 # Copyright (c) 2006-2008 Alex Holkner
@@ -41,57 +41,24 @@ from pyglet.gl import GL_TRIANGLES#!/usr/bin/env python
 #                         batch
 
 
-class Torus(object):
-    def __init__(self, radius, inner_radius, slices, inner_slices):
-        # Create the vertex and normal arrays.
-        vertices = []
-        normals = []
+class Torus(ParametricMesh):
+    """
+    Torus around the z axis, slices vertex rings around the axis and
+    inner_slices vertices around the tube; the first and last ring (and
+    column) coincide, unless weld drops the duplicates.
 
-        u_step = 2 * pi / (slices - 1)
-        v_step = 2 * pi / (inner_slices - 1)
-        u = 0.
-        for i in range(slices):
-            cos_u = cos(u)
-            sin_u = sin(u)
-            v = 0.
-            for j in range(inner_slices):
-                cos_v = cos(v)
-                sin_v = sin(v)
+    """
+    def __init__(self, radius, inner_radius, slices, inner_slices,
+                 weld=False):
+        def surface(u, v):
+            cos_u = np.cos(u)
+            sin_u = np.sin(u)
+            cos_v = np.cos(v)
+            sin_v = np.sin(v)
+            d = radius + inner_radius * cos_v
+            return ((d * cos_u, d * sin_u, inner_radius * sin_v),
+                    (cos_u * cos_v, sin_u * cos_v, sin_v))
 
-                d = (radius + inner_radius * cos_v)
-                x = d * cos_u
-                y = d * sin_u
-                z = inner_radius * sin_v
-
-                nx = cos_u * cos_v
-                ny = sin_u * cos_v
-                nz = sin_v
-
-                vertices.extend([x, y, z])
-                normals.extend([nx, ny, nz])
-                v += v_step
-            u += u_step
-
-        # Create a list of triangle indices.
-        indices = []
-        for i in range(slices - 1):
-            for j in range(inner_slices - 1):
-                p = i * inner_slices + j
-                indices.extend([p, p + inner_slices, p + inner_slices + 1])
-                indices.extend([p, p + inner_slices + 1, p + 1])
-
-        self.indices = indices
-        self.vertices = vertices
-        self.normals = normals
-        self.vertex_list = None
-
-    def add_to_batch(self, batch, group = None):
-        self.vertex_list = batch.add_indexed(len(self.vertices)//3,
-                                             GL_TRIANGLES,
-                                             group,
-                                             self.indices,
-                                             ('v3f/static', self.vertices),
-                                             ('n3f/static', self.normals))
-
-    def delete(self):
-        self.vertex_list.delete()
\ No newline at end of file
+        super(Torus, self).__init__(*parametric_arrays(
+            surface, slices, inner_slices, wrap_u=True, wrap_v=True,
+            weld=weld))